@@ -1,10 +1,11 @@
 """api.py - Create and configure the TicTacToe Game API exposing the resources.
 """
+import collections
+import time
+
 import endpoints
-import math
 from protorpc import remote, messages
-from google.appengine.api import memcache
-from google.appengine.api import taskqueue
+from google.appengine.api import datastore_errors, oauth
 from google.appengine.ext import ndb
 
 from models import (
@@ -15,24 +16,93 @@ from models import (
     NewGameForm,
     GameForm,
     MakeMoveForm,
+    GameMoveForms,
+    MoveResultForm,
+    MoveResultForms,
     UserForms,
     GameForms,
     RatingForms,
     RatingForm,
     HistoryForm,
+    GameWaitForm,
+    MatchForm,
+    PositionForm,
     StatisticForms,
+    EndpointStatForm,
+    CounterForm,
+    EndpointStatForms,
+    TournamentRequestForm,
+    TournamentForm,
+    Tournament,
+    get_rank,
+    get_rank_table,
+    get_rate,
+    get_statistics,
+    get_user_names,
+    statistic_changed,
+    set_game_versions,
+    get_game_version,
+    get_user,
+    get_user_async,
+    ROUND_ROBIN,
+    SWISS,
+)
+from utils import (
+    get_by_urlsafe,
+    get_key_by_urlsafe,
+    get_page_size,
+    fetch_page,
+    get_list_offset,
 )
-from utils import get_by_urlsafe
+from ndb_storage import NdbRepository, end_game
+from service import (
+    GameService,
+    GameError,
+    NotFoundError,
+    BadRequestError,
+    ForbiddenError,
+    ConflictError,
+)
+import bot
+import leaderboard
+import matchmaking
+import openings
+import stats
+import tournament
 
 NEW_GAME_REQUEST = endpoints.ResourceContainer(NewGameForm)
 GET_GAME_REQUEST = endpoints.ResourceContainer(
         urlsafe_game_key=messages.StringField(1),)
+WAIT_FOR_MOVE_REQUEST = endpoints.ResourceContainer(
+    urlsafe_game_key=messages.StringField(1),
+    move=messages.IntegerField(2, default=0))
 MAKE_MOVE_REQUEST = endpoints.ResourceContainer(
     MakeMoveForm,
     urlsafe_game_key=messages.StringField(1),)
 USER_REQUEST = endpoints.ResourceContainer(user_name=messages.StringField(1),
                                            email=messages.StringField(2))
-MEMCACHE_RATING = 'RATING'
+PAGE_REQUEST = endpoints.ResourceContainer(page_size=messages.IntegerField(1),
+                                           cursor=messages.StringField(2))
+GET_TOURNAMENT_REQUEST = endpoints.ResourceContainer(
+    urlsafe_tournament_key=messages.StringField(1),)
+POSITION_REQUEST = endpoints.ResourceContainer(
+    game_field=messages.StringField(1, required=True),
+    length=messages.IntegerField(2))
+USER_GAMES_REQUEST = endpoints.ResourceContainer(
+    user_name=messages.StringField(1),
+    page_size=messages.IntegerField(2),
+    cursor=messages.StringField(3))
+MAX_BATCH_MOVES = 1000
+WAIT_SECONDS = 20
+WAIT_POLL_SECONDS = 0.25
+SERVICE_EXCEPTIONS = {
+    NotFoundError: endpoints.NotFoundException,
+    BadRequestError: endpoints.BadRequestException,
+    ForbiddenError: endpoints.ForbiddenException,
+    ConflictError: endpoints.ConflictException,
+}
+
+_service = GameService(NdbRepository())
 
 
 @endpoints.api(name='tictactoegame', version='v1')
@@ -43,6 +113,7 @@ class tictactoegame(remote.Service):
                       path='user',
                       name='create_user',
                       http_method='POST')
+    @stats.instrument()
     def create_user(self, request):
         """Creates a User.
             Args:
@@ -54,11 +125,12 @@ class tictactoegame(remote.Service):
             Raises:
                 endpoints.ConflictException: If the user already exists.
         """
-        if User.query(User.name == request.user_name).get():
-            raise endpoints.ConflictException(
-                    'A User with that name already exists!')
-        user = User(name=request.user_name, email=request.email)
-        user.put()
+        # The name is the key of the user, so it is checked in the
+        # transaction which creates the user
+        try:
+            _service.create_user(request.user_name, request.email)
+        except GameError as error:
+            raise _endpoints_exception(error)
         return StringMessage(message='User {} created!'.format(
                 request.user_name))
 
@@ -67,38 +139,36 @@ class tictactoegame(remote.Service):
                       path='game',
                       name='new_game',
                       http_method='POST')
+    @stats.instrument()
     def new_game(self, request):
         """Creates a Game.
             Args:
             request: The NEW_GAME_REQUEST objects, which includes two players'
-                names
+                names. bot.BOT_NAME as a name means the computer player, it
+                makes the first move if it plays X. Optional size and length
+                create the game on the large board - length marks in a row
+                win, 5 by default.
             Returns:
                 GameForm with created game
             Raises:
                 endpoints.NotFoundException: If the user does not exist.
                 endpoints.BadRequestException: If the game is created with one
-                user.
+                user or the large board is not possible.
         """
-        user_x = User.query(User.name == request.user_name_x).get()
-        user_o = User.query(User.name == request.user_name_o).get()
-        if (not user_o) or (not user_x):
-            raise endpoints.NotFoundException(
-                    'A User with that name does not exist!')
         try:
-            game = Game.new_game(user_x.key, user_o.key)
-            history = History(game=game.key)
-            history.put()
-        except ValueError:
-            raise endpoints.BadRequestException('Players should be '
-                                                'different!')
-
-        return game.to_form('Good luck playing TicTacToe!')
+            game, names = _service.new_game(
+                request.user_name_x, request.user_name_o, request.size,
+                request.length)
+        except GameError as error:
+            raise _endpoints_exception(error)
+        return game.to_form('Good luck playing TicTacToe!', names)
 
     @endpoints.method(request_message=GET_GAME_REQUEST,
                       response_message=GameForm,
                       path='game/{urlsafe_game_key}',
                       name='get_game',
                       http_method='GET')
+    @stats.instrument()
     def get_game(self, request):
         """Return a Game.
             Args:
@@ -106,13 +176,16 @@ class tictactoegame(remote.Service):
                 urlsafe_game_key
             Returns:
                 GameForm with requested game with the current game state.
+                Archived games are read from the archive.
             Raises:
                 endpoints.NotFoundException: If the game does not exist.
         """
-        game = get_by_urlsafe(request.urlsafe_game_key, Game)
-        if game is None:
-            raise endpoints.NotFoundException('Game not found!')
-        elif game.game_over:
+        try:
+            game = _service.get_game(
+                get_key_by_urlsafe(request.urlsafe_game_key, Game))
+        except GameError as error:
+            raise _endpoints_exception(error)
+        if game.game_over:
             return game.to_form('Game is over!')
         else:
             return game.to_form('Game is running!')
@@ -122,6 +195,7 @@ class tictactoegame(remote.Service):
                       path='game/cancel/{urlsafe_game_key}',
                       name='cancel_game',
                       http_method='DELETE')
+    @stats.instrument()
     def cancel_game(self, request):
         """Cancel a Game.
             Args:
@@ -132,41 +206,48 @@ class tictactoegame(remote.Service):
             Raises:
                 endpoints.NotFoundException: If the game does not exist.
         """
-        game = get_by_urlsafe(request.urlsafe_game_key, Game)
-        if game is None:
-            raise endpoints.NotFoundException('Game not found!')
+        try:
+            game, deleted = _service.cancel_game(
+                get_key_by_urlsafe(request.urlsafe_game_key, Game))
+        except GameError as error:
+            raise _endpoints_exception(error)
+        if deleted:
+            return game.to_form('Game is deleted successfully!')
         elif game.game_over:
             return game.to_form('Game is over and it cannot be deleted!')
         else:
-            game.key.delete()
-            return game.to_form('Game is deleted successfully!')
+            return game.to_form('Tournament game cannot be deleted!')
 
     @endpoints.method(request_message=GET_GAME_REQUEST,
                       response_message=HistoryForm,
                       path='game/history/{urlsafe_game_key}',
                       name='get_game_history',
                       http_method='GET')
+    @stats.instrument()
     def get_game_history(self, request):
         """Return a Game history.
             Args:
             request: The GET_GAME_REQUEST objects, which includes
                 urlsafe_game_key
             Returns:
-                HistoryForm with the history of requested game.
+                HistoryForm with the history of requested game. Archived
+                games are read from the archive.
             Raises:
                 endpoints.NotFoundException: If the game does not exist.
         """
-        game = get_by_urlsafe(request.urlsafe_game_key, Game)
-        if game is None:
-            raise endpoints.NotFoundException('Game not found!')
-        else:
-            return History.query(History.game == game.key).get().to_form()
+        try:
+            game, history = _service.get_game_history(
+                get_key_by_urlsafe(request.urlsafe_game_key, Game))
+        except GameError as error:
+            raise _endpoints_exception(error)
+        return history.to_form(game)
 
     @endpoints.method(request_message=MAKE_MOVE_REQUEST,
                       response_message=GameForm,
                       path='game/{urlsafe_game_key}',
                       name='make_move',
                       http_method='PUT')
+    @stats.instrument()
     def make_move(self, request):
         """Make move.
             Args:
@@ -176,135 +257,292 @@ class tictactoegame(remote.Service):
             Returns:
                 GameForm with the current game state.
             Raises:
+                endpoints.NotFoundException: If the game does not exist.
+                endpoints.BadRequestException: If the cell is out of the grid.
                 endpoints.ForbiddenException: If the game is already over.
                                               If the cell is already used.
                                               If it is not move of the user.
         """
-        msg = 'Next move!'
-        game = get_by_urlsafe(request.urlsafe_game_key, Game)
-        history = History.query(History.game == game.key).get()
-        if game.game_over:
-            raise endpoints.ForbiddenException('Illegal action: '
-                                               'Game is already over.')
-
-        game_field_list = list(game.game_field)
-        dim_size = int(math.sqrt(len(game_field_list)))
-        row = request.row
-        col = request.col
-
-        msg = 'user is %s, and user_o is %s' % (request.user,
-                                                game.user_o.get().name)
-        if game_field_list[col + row * dim_size] != ' ':
-            raise endpoints.ForbiddenException('Illegal action: '
-                                               'the cell is already used.')
-
-        if request.user == game.user_o.get().name:
-            if game_field_list.count('x') - game_field_list.count('o') == 1:
-                game_field_list[col + row * dim_size] = 'o'
-                game_field_str = ''.join(game_field_list)
-                msg = 'Game_field is %s' % (game_field_str,)
-                game.game_field = game_field_str
-                game.put()
-                game = get_by_urlsafe(request.urlsafe_game_key, Game)
-                # Check whether game is over and winner
-                if check_winner(game_field_str, 'o', row, col):
-                    game.end_game(game.user_o, game.user_x)
-                    msg = 'Game is over! Winner-%s' % (game.user_o.get().name,)
-                    # Task queue to update the leader
-                    taskqueue.add(url='/tasks/_cache_current_leader')
-                history.update_history(msg, game.user_o.get().name, row,
-                                       col)
-            else:
-                return game.to_form('It is not your move!')
-        elif request.user == game.user_x.get().name:
-            if game_field_list.count('x') - game_field_list.count('o') == 0:
-                game_field_list[col + row * dim_size] = 'x'
-                game_field_str = ''.join(game_field_list)
-                msg = 'Game_field is %s' % (game_field_str,)
-                game.game_field = game_field_str
-                game.put()
-                game = get_by_urlsafe(request.urlsafe_game_key, Game)
-                # Check whether game is over and winner
-                if check_winner(game_field_str, 'x', row, col):
-                    game.end_game(game.user_x, game.user_o)
-                    msg = 'Game is over! Winner-%s' % (game.user_x.get().name,)
-                    # Task queue to update the leader
-                    taskqueue.add(url='/tasks/_cache_current_leader')
-                history.update_history(msg, game.user_x.get().name, row, col)
-            else:
-                raise endpoints.ForbiddenException('Illegal action: '
-                                                   'It is not your move!')
-
-        if game.game_field.count(' ') == 0:
-            game.end_game_draw(game.user_x, game.user_o)
-            msg = 'Game is over! Draw game!'
-            # Task queue to update the leader
-            taskqueue.add(url='/tasks/_cache_current_leader')
-            history.update_history(msg, '', row, col)
-        return game.to_form(msg)
+        game_key = get_key_by_urlsafe(request.urlsafe_game_key, Game)
+        try:
+            game, msg, names = _service.make_move(game_key, request.user,
+                                                  request.row, request.col)
+        except GameError as error:
+            raise _endpoints_exception(error)
+        return game.to_form(msg, names)
+
+    @endpoints.method(request_message=GameMoveForms,
+                      response_message=MoveResultForms,
+                      path='games/moves',
+                      name='make_moves',
+                      http_method='PUT')
+    @stats.instrument()
+    def make_moves(self, request):
+        """Make a batch of moves.
+            Args:
+            request: The GameMoveForms objects, which includes moves -
+                urlsafe_game_key, row, col and user of every move.
+            Returns:
+                MoveResultForms with the result of every move in the order
+                of the request - the message as of make_move or the error.
+                Moves of one game are applied in order in one transaction,
+                games are processed one after another.
+            Raises:
+                endpoints.BadRequestException: If there are more than
+                    MAX_BATCH_MOVES moves.
+        """
+        if len(request.moves) > MAX_BATCH_MOVES:
+            raise endpoints.BadRequestException(
+                'At most %d moves can be made at once!' % (MAX_BATCH_MOVES,))
+        results = [MoveResultForm(urlsafe_game_key=move.urlsafe_game_key)
+                   for move in request.moves]
+        # Indices of moves of every game
+        game_moves = collections.OrderedDict()
+        for index, move in enumerate(request.moves):
+            try:
+                game_key = get_key_by_urlsafe(move.urlsafe_game_key, Game)
+            except (endpoints.BadRequestException, ValueError):
+                results[index].error = 'Invalid Key'
+                continue
+            game_moves.setdefault(game_key, []).append(index)
+
+        games = dict(zip(game_moves, ndb.get_multi(game_moves.keys())))
+        names = get_user_names([user_key for game in games.values() if game
+                                for user_key in (game.user_x, game.user_o)])
+        ended = []
+        changed = []
+        # Transactions run in turn - transactional tasks of the end of a
+        # game can not be added from parallel transactions of one thread
+        for game_key, indices in game_moves.items():
+            if games[game_key] is None:
+                for index in indices:
+                    results[index].error = 'Game not found!'
+                continue
+            try:
+                game, outcomes = _make_moves(
+                    game_key, [(request.moves[index].user,
+                                request.moves[index].row,
+                                request.moves[index].col)
+                               for index in indices], names)
+            except datastore_errors.TransactionFailedError:
+                for index in indices:
+                    results[index].error = 'Game is busy, try again!'
+                continue
+            for index, outcome in zip(indices, outcomes):
+                if isinstance(outcome, tuple):
+                    results[index].message, results[index].game_over = outcome
+                else:
+                    results[index].error = str(outcome)
+            if any(isinstance(outcome, tuple) for outcome in outcomes):
+                changed.append(game)
+            if game and game.game_over and not games[game_key].game_over:
+                ended.append(game)
+        set_game_versions(changed)
+        if ended:
+            statistic_changed(list(set(key for game in ended
+                                       for key in (game.user_x, game.user_o))))
+            tournament.games_over(ended)
+        return MoveResultForms(items=results)
+
+    @endpoints.method(request_message=WAIT_FOR_MOVE_REQUEST,
+                      response_message=GameWaitForm,
+                      path='game/wait/{urlsafe_game_key}',
+                      name='wait_for_move',
+                      http_method='GET')
+    @stats.instrument()
+    def wait_for_move(self, request):
+        """Wait for a move in the Game.
+            Args:
+            request: The WAIT_FOR_MOVE_REQUEST objects, which includes
+                urlsafe_game_key and move - the number of moves the client
+                has seen.
+            Returns:
+                GameWaitForm with the game as soon as the number of moves
+                differs from move, or changed=False after WAIT_SECONDS.
+                Only the version of the game in memcache is read while
+                nothing changes, the game is read once before changed=False
+                in case the version was not saved after a move. An archived
+                game is returned as it is, it is over.
+            Raises:
+                endpoints.NotFoundException: If the game does not exist.
+        """
+        game_key = get_key_by_urlsafe(request.urlsafe_game_key, Game)
+        deadline = time.time() + WAIT_SECONDS
+        version = get_game_version(game_key)
+        while version == request.move:
+            if time.time() >= deadline:
+                version = get_game_version(game_key, refresh=True)
+                if version == request.move:
+                    return GameWaitForm(changed=False, move=version)
+                break
+            time.sleep(WAIT_POLL_SECONDS)
+            version = get_game_version(game_key)
+        try:
+            game = _service.get_game(game_key)
+        except GameError as error:
+            raise _endpoints_exception(error)
+        return GameWaitForm(changed=game.moves_made() != request.move,
+                            move=game.moves_made(),
+                            game=game.to_form('Game is over!' if game.game_over
+                                              else 'Game is running!'))
 
     @endpoints.method(request_message=USER_REQUEST,
+                      response_message=MatchForm,
+                      path='queue/{user_name}',
+                      name='join_queue',
+                      http_method='POST')
+    @stats.instrument()
+    def join_queue(self, request):
+        """Join the matchmaking queue.
+            Args:
+            request: The USER_REQUEST objects, which includes user_name
+            Returns:
+                MatchForm with the game if the user is matched at once with
+                a waiting player of a close rate, otherwise the user waits
+                for poll_match. Joining again while waiting changes nothing.
+            Raises:
+                endpoints.NotFoundException: If the user does not exist.
+                endpoints.BadRequestException: If it is the computer player.
+        """
+        if request.user_name == bot.BOT_NAME:
+            raise endpoints.BadRequestException(
+                'The computer does not join the queue!')
+        user = get_user(request.user_name)
+        if not user:
+            raise endpoints.NotFoundException(
+                    'A User with that name does not exist!')
+        return _match_to_form(matchmaking.join(user))
+
+    @endpoints.method(request_message=USER_REQUEST,
+                      response_message=MatchForm,
+                      path='queue/{user_name}',
+                      name='poll_match',
+                      http_method='GET')
+    @stats.instrument()
+    def poll_match(self, request):
+        """Poll the matchmaking queue.
+            Args:
+            request: The USER_REQUEST objects, which includes user_name
+            Returns:
+                MatchForm with the game when the user is matched. While the
+                user waits, the search for the opponent is widened to
+                farther rates and only memcache is read.
+            Raises:
+                endpoints.NotFoundException: If the user is not in the queue.
+        """
+        ticket = matchmaking.poll(request.user_name)
+        if ticket is None:
+            raise endpoints.NotFoundException(
+                '%s is not in the queue!' % (request.user_name,))
+        return _match_to_form(ticket)
+
+    @endpoints.method(request_message=POSITION_REQUEST,
+                      response_message=PositionForm,
+                      path='position',
+                      name='get_position',
+                      http_method='GET')
+    @stats.instrument()
+    def get_position(self, request):
+        """Return results of finished games which passed through the
+        position.
+            Args:
+            request: The POSITION_REQUEST objects, which includes game_field
+                - cells row by row, 'x' and 'o' for marks and any other
+                character for an empty cell - and optional length
+            Returns:
+                PositionForm with wins, draws and losses of the player to
+                move and the next move with the best score. Rotated and
+                reflected positions share their results, the position is
+                read with one key get or from memcache.
+            Raises:
+                endpoints.BadRequestException: If the position is not
+                    possible.
+        """
+        try:
+            position = openings.get_position(request.game_field,
+                                             request.length)
+        except GameError as error:
+            raise _endpoints_exception(error)
+        return _position_to_form(position)
+
+    @endpoints.method(request_message=USER_GAMES_REQUEST,
                       response_message=GameForms,
                       path='games/user/{user_name}',
                       name='get_user_games',
                       http_method='GET')
+    @stats.instrument()
     def get_user_games(self, request):
         """Return games of the user.
             Args:
-            request: The USER_REQUEST objects, which includes
-                urlsafe_name and optional e-mail
+            request: The USER_GAMES_REQUEST objects, which includes
+                urlsafe_name, optional page_size and cursor
             Returns:
-                GameForms with all active games for the user
+                GameForms with one page of active games for the user and
+                next_cursor of the next page
             Raises:
                 endpoints.NotFoundException: If the game does not exist.
                                              If there are no active games.
         """
-        user = User.query(User.name == request.user_name).get()
-        if not user:
-            raise endpoints.NotFoundException(
-                    'A User with that name does not exist!')
-        games = Game.query(Game.game_over == False)
-        if not games.get():
-            raise endpoints.NotFoundException(
-                'There are no active games for %s!' % (request.user_name,))
-        games = games.filter(ndb.OR(Game.user_o == user.key,
-                                   Game.user_x == user.key))
-        return GameForms(items=[game.to_form('') for game in games])
+        offset = get_list_offset(request.cursor)
+        page_size = get_page_size(request.page_size)
+        try:
+            games, more = _service.get_user_games(request.user_name, offset,
+                                                  page_size)
+        except GameError as error:
+            raise _endpoints_exception(error)
+        next_cursor = str(offset + page_size) if more else None
+        return GameForms(items=Game.to_forms(games, ''),
+                         next_cursor=next_cursor)
 
-    @endpoints.method(request_message=USER_REQUEST,
+    @endpoints.method(request_message=PAGE_REQUEST,
                       response_message=UserForms,
                       path='users',
                       name='get_users',
                       http_method='GET')
+    @stats.instrument()
     def get_users(self, request):
         """Return all Users.
             Args:
+            request: The PAGE_REQUEST objects, which includes optional
+                page_size and cursor
             Returns:
-                UserForms with users' data.
+                UserForms with one page of users' data and next_cursor.
         """
-        users = User.query()
-        return UserForms(items=[user.user_to_form() for user in users])
+        users, next_cursor = fetch_page(User.query(), request.page_size,
+                                        request.cursor)
+        return UserForms(items=[user.user_to_form() for user in users],
+                         next_cursor=next_cursor)
 
-    @endpoints.method(response_message=StatisticForms,
+    @endpoints.method(request_message=PAGE_REQUEST,
+                      response_message=StatisticForms,
                       path='statistic/users',
                       name='get_users_statistic',
                       http_method='GET')
+    @stats.instrument()
     def get_users_statistic(self, request):
         """Return Users' statistics.
             Args:
-            request: The USER_REQUEST objects
+            request: The PAGE_REQUEST objects, which includes optional
+                page_size and cursor
             Returns:
-                StatisticForms with statistic for every user.
+                StatisticForms with statistic for one page of users and
+                next_cursor.
         """
-        users = User.query().order(-User.rate)
-        return StatisticForms(items=[user.statistic_to_form()
-                                     for user in users])
+        users, next_cursor = fetch_page(User.query().order(-User.rate),
+                                        request.page_size, request.cursor)
+        ranks = get_rank_table()
+        statistics = get_statistics(users)
+        return StatisticForms(items=[
+            user.statistic_to_form(ranks.get(user.rate),
+                                   statistics[user.key]) for user in users],
+            next_cursor=next_cursor)
 
     @endpoints.method(request_message=USER_REQUEST,
                       response_message=RatingForm,
                       path='games/rating/user/{user_name}',
                       name='get_user_rate',
                       http_method='GET')
+    @stats.instrument()
     def get_user_rate(self, request):
         """Return a user rate.
             Args:
@@ -314,83 +552,235 @@ class tictactoegame(remote.Service):
             Raises:
                 endpoints.NotFoundException: If the user does not exist.
         """
-        user = User.query(User.name == request.user_name).get()
+        user = get_user(request.user_name)
         if not user:
             raise endpoints.NotFoundException(
                     'A User with that name does not exist!')
-        user_rate = User.query(User.name == request.user_name).get()
-        return user_rate.rate_to_form()
+        # Buckets count the saved rate, the live rate is only reported
+        live_rate = get_rate(*get_statistics([user])[user.key])
+        return user.rate_to_form(get_rank(user.rate), live_rate)
 
-    @endpoints.method(response_message=RatingForms,
+    @endpoints.method(request_message=PAGE_REQUEST,
+                      response_message=RatingForms,
                       path='games/ranking',
                       name='get_rankings',
                       http_method='GET')
+    @stats.instrument()
     def get_rankings(self, request):
         """Return a users' rankings.
             Args:
+            request: The PAGE_REQUEST objects, which includes optional
+                page_size and cursor
             Returns:
-                RatingForms with the rating info.
+                RatingForms with the rating info for one page of users and
+                next_cursor.
         """
-        ratings = User.query().order(User.rank)
-        return RatingForms(items=[rating.rate_to_form() for rating in ratings])
+        page_size = get_page_size(request.page_size)
+        offset = leaderboard.get_offset(request.cursor)
+        if offset is not None:
+            page = leaderboard.get_page(offset, page_size)
+            if page is not None:
+                rows, next_cursor = page
+                return RatingForms(items=[
+                    RatingForm(name=name, rate=rate, rank=rank)
+                    for name, rate, rank in rows], next_cursor=next_cursor)
+        # Only name and rate are loaded - no full entities
+        ratings, next_cursor = fetch_page(
+            User.query().order(-User.rate), page_size,
+            None if offset is not None else request.cursor,
+            offset=offset or 0, projection=[User.rate, User.name])
+        ranks = get_rank_table()
+        return RatingForms(items=[rating.rate_to_form(ranks.get(rating.rate))
+                                  for rating in ratings],
+                           next_cursor=next_cursor)
+
+    @endpoints.method(request_message=TournamentRequestForm,
+                      response_message=TournamentForm,
+                      path='tournament',
+                      name='create_tournament',
+                      http_method='POST')
+    @stats.instrument()
+    def create_tournament(self, request):
+        """Creates a Tournament.
+            Args:
+            request: The TournamentRequestForm objects, which includes name,
+                players' names, format - round_robin or swiss and optional
+                number of Swiss rounds.
+            Returns:
+                TournamentForm with created tournament. All games of the
+                round-robin tournament and the first Swiss round are
+                created, large tournaments are created by tasks.
+            Raises:
+                endpoints.NotFoundException: If a user does not exist.
+                endpoints.BadRequestException: If the format is unknown,
+                    there are less than two different players or the number
+                    of rounds is not possible.
+        """
+        if request.format not in (ROUND_ROBIN, SWISS):
+            raise endpoints.BadRequestException(
+                'Format should be %s or %s!' % (ROUND_ROBIN, SWISS))
+        futures = [get_user_async(name)
+                   for name in request.players if name != bot.BOT_NAME]
+        users = [future.get_result() for future in futures]
+        if bot.BOT_NAME in request.players:
+            users.append(_service.get_player(bot.BOT_NAME))
+        if not all(users):
+            raise endpoints.NotFoundException(
+                    'A User with that name does not exist!')
+        # Players are seeded by rate
+        users.sort(key=lambda user: -user.rate)
+        try:
+            new_tournament = tournament.create_tournament(
+                request.name, [user.key for user in users], request.format,
+                request.rounds)
+        except ValueError as error:
+            raise endpoints.BadRequestException(str(error))
+        return new_tournament.to_form(
+            tournament.get_standings(new_tournament),
+            dict((user.key, user.name) for user in users))
+
+    @endpoints.method(request_message=GET_TOURNAMENT_REQUEST,
+                      response_message=TournamentForm,
+                      path='tournament/{urlsafe_tournament_key}',
+                      name='get_tournament',
+                      http_method='GET')
+    @stats.instrument()
+    def get_tournament(self, request):
+        """Return a Tournament with standings.
+            Args:
+            request: The GET_TOURNAMENT_REQUEST objects, which includes
+                urlsafe_tournament_key
+            Returns:
+                TournamentForm with the current round and standings of
+                players ordered by points.
+            Raises:
+                endpoints.NotFoundException: If the tournament does not
+                    exist.
+        """
+        found = get_by_urlsafe(request.urlsafe_tournament_key, Tournament)
+        if found is None:
+            raise endpoints.NotFoundException('Tournament not found!')
+        return found.to_form(tournament.get_standings(found),
+                             get_user_names(found.players))
 
     @staticmethod
     def _cache_current_leader():
-        """Populates memcache with the current leader"""
-        ratings = User.query(User.rank == 1).get()
-        memcache.set(MEMCACHE_RATING, 'The leader is {} with rate={:.2f}'
-                     .format(ratings.name, ratings.rate))
+        """Populates memcache with the leaderboard of the current leaders"""
+        leaderboard.rebuild()
 
     @endpoints.method(response_message=StringMessage,
                       path='games/leader',
                       name='get_leader',
                       http_method='GET')
+    @stats.instrument()
     def get_leader(self, request):
         """Return a leader.
             Args:
             Returns:
-                StringMessage saved in MEMCACHE_RATING.
+                StringMessage with the first user of the leaderboard.
+        """
+        rows, complete = leaderboard.get_leaderboard()
+        if not rows:
+            return StringMessage(message='')
+        name, rate, rank = rows[0]
+        return StringMessage(message='The leader is {} with rate={:.2f}'
+                             .format(name, rate))
+
+    @endpoints.method(response_message=EndpointStatForms,
+                      path='stats',
+                      name='stats',
+                      http_method='GET')
+    def get_stats(self, request):
+        """Return latency and RPC statistics of endpoints and handlers.
+            Args:
+            Returns:
+                EndpointStatForms with statistics of sampled requests of the
+                current and the previous hour.
+            Raises:
+                endpoints.ForbiddenException: If the user is not an admin.
         """
-        return StringMessage(message=memcache.get(MEMCACHE_RATING) or '')
+        try:
+            admin = oauth.is_current_user_admin(endpoints.EMAIL_SCOPE)
+        except oauth.Error:
+            admin = False
+        if not admin:
+            raise endpoints.ForbiddenException('Only admins can see stats!')
+        return EndpointStatForms(
+            items=[_stat_to_form(row)
+                   for row in stats.get_stats(stats.names())],
+            sample_rate=stats.SAMPLE_RATE,
+            latency_buckets=list(stats.LATENCY_BUCKETS))
 
 
-def check_winner(game_field, symbol, row, col):
-    """
+@ndb.transactional(xg=True)
+def _make_moves(game_key, moves, names):
+    """Applies moves of one game in order in one transaction - the game and
+    its history are loaded and saved once for all moves. Invalid moves are
+    skipped.
     Args:
-        game_field: the current status of the game
-        symbol: x or o - the latest move
-        row: the latest move vertical index
-        col: the latest move horizontal index
-    Returns: True if the game is over
+        game_key: key of the game
+        moves: list of (user_name, row, col)
+        names: dict user key -> name for players of the game
+    Returns: tuple of the game and list with the tuple (message, game_over)
+        or the GameError of every move
     """
-    dim_size = int(math.sqrt(len(game_field)))
-    result_horizontal = True
-    result_vertical = True
-    result_diagonal = False
-    result_diagonal2 = False
-    # Check horizontal and vertical
-    for index in range(dim_size):
-        result_horizontal = result_horizontal and \
-                            (game_field[row * dim_size + index] == symbol)
-        result_vertical = result_vertical and \
-                          (game_field[index * dim_size + col] == symbol)
-    if result_horizontal or result_vertical:
-        return True
-    # Check diagonal1
-    if row == col:
-        result_diagonal = True
-        for index in range(dim_size):
-            result_diagonal = result_diagonal and \
-                              (game_field[index + index * dim_size] == symbol)
-    # Check diagonal2
-    if (row + col) == dim_size - 1:
-        result_diagonal2 = True
-        for index in range(dim_size):
-            result_diagonal2 = result_diagonal2 and \
-            (game_field[(dim_size - index - 1) * dim_size + index] == symbol)
-    if result_diagonal or result_diagonal2:
-        return True
-    return False
+    history_key = History.key_for(game_key)
+    game, history = ndb.get_multi([game_key, history_key])
+    if game is None:
+        return None, [NotFoundError('Game not found!') for _ in moves]
+    if history is None:
+        history = History(key=history_key)
+    board = game.board()
+    results = []
+    entities = []
+    for user_name, row, col in moves:
+        try:
+            msg, result = _service.apply_move(game, history, board, names,
+                                              user_name, row, col)
+        except GameError as error:
+            results.append(error)
+            continue
+        entities.extend(end_game(game, result, history))
+        results.append((msg, game.game_over))
+    if any(isinstance(result, tuple) for result in results):
+        ndb.put_multi([game, history] + entities)
+    return game, results
+
+
+def _stat_to_form(row):
+    """Returns EndpointStatForm of the statistics row"""
+    counters = row.pop('counters')
+    form = EndpointStatForm(**row)
+    form.counters = [CounterForm(name=name, total=total)
+                     for name, total in counters]
+    return form
+
+
+def _match_to_form(ticket):
+    """Returns MatchForm of the matchmaking ticket"""
+    if not ticket['game']:
+        return MatchForm(matched=False, message='Waiting for an opponent!')
+    return MatchForm(matched=True, message='Good luck playing TicTacToe!',
+                     urlsafe_game_key=ticket['game'],
+                     user_name_x=ticket['user_name_x'],
+                     user_name_o=ticket['user_name_o'])
+
+
+def _position_to_form(position):
+    """Returns PositionForm of the opening book position"""
+    form = PositionForm(symbol=position['symbol'], wins=position['wins'],
+                        draws=position['draws'], losses=position['losses'])
+    if position['best_move'] is not None:
+        form.best_move = '%d %d' % position['best_move']
+        form.best_wins = position['best_wins']
+        form.best_draws = position['best_draws']
+        form.best_losses = position['best_losses']
+    return form
+
+
+def _endpoints_exception(error):
+    """Returns the endpoints exception for the GameError"""
+    return SERVICE_EXCEPTIONS[type(error)](str(error))
 
 
 api = endpoints.api_server([tictactoegame])
@@ -0,0 +1,187 @@
+"""archive.py - Cold archive of finished games.
+
+Finished games older than ARCHIVE_AFTER_DAYS are moved out of the Game and
+History kinds in batches of ARCHIVE_BATCH_SIZE. Every batch is one
+ArchiveSegment - JSON records of games with their histories, one per line,
+compressed with zlib - and one small ArchivedGame per game with the offset of
+its record. The segment is saved first, then its index, and the originals
+are deleted last, so a failed batch is archived again by the next run:
+games which are indexed already are only deleted and the segment of the
+rest is keyed by their IDs, so the same games make the same segment.
+Archived games are read by key: the segment is decompressed once per
+instance and kept in an LRU cache.
+"""
+import base64
+import datetime
+import hashlib
+import json
+import os
+import zlib
+
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+from models import Game, History, ArchiveSegment, ArchivedGame
+from utils import LRUCache
+
+ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', '30'))
+ARCHIVE_BATCH_SIZE = 500
+ARCHIVE_CACHE_SIZE = 16
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+_segments = LRUCache(ARCHIVE_CACHE_SIZE)
+
+
+def _key(key):
+    return key.urlsafe() if key else None
+
+
+def _record(game, history):
+    """Returns the archive record of the game and its history"""
+    return {
+        'key': game.key.urlsafe(),
+        'user_x': _key(game.user_x),
+        'user_o': _key(game.user_o),
+        'game_field': game.game_field,
+        'game_over': game.game_over,
+        'date': game.date.strftime(DATE_FORMAT) if game.date else None,
+        'tournament': _key(game.tournament),
+        'round': game.round,
+        'size': game.size,
+        'length': game.length,
+        'packed_moves': base64.b64encode(game.packed_moves or ''),
+        'history_moves': history.moves if history else [],
+        'history_packed': base64.b64encode(
+            history.packed_moves if history else ''),
+    }
+
+
+def _restore(game_key, record):
+    """Returns the game and its history from the archive record, they are
+    not saved"""
+    def key(urlsafe):
+        return ndb.Key(urlsafe=urlsafe) if urlsafe else None
+
+    game = Game(key=game_key,
+                user_x=key(record['user_x']),
+                user_o=key(record['user_o']),
+                game_field=record['game_field'],
+                game_over=record['game_over'],
+                tournament=key(record['tournament']),
+                round=record['round'],
+                size=record['size'],
+                length=record['length'],
+                packed_moves=base64.b64decode(record['packed_moves']))
+    if record['date']:
+        game.date = datetime.datetime.strptime(record['date'], DATE_FORMAT)
+    history = History(key=History.key_for(game_key),
+                      moves=record['history_moves'],
+                      packed_moves=base64.b64decode(record['history_packed']))
+    return game, history
+
+
+def archive_games(urlsafe_cursor=None):
+    """ archive_games: archives one batch of finished games older than
+    ARCHIVE_AFTER_DAYS into a new segment and deletes them with histories
+    Args:
+        urlsafe_cursor: the cursor of the batch or None for the first batch
+    Returns: tuple of the number of archived games and the urlsafe cursor of
+        the next batch or None
+    """
+    cutoff = (datetime.datetime.utcnow() -
+              datetime.timedelta(days=ARCHIVE_AFTER_DAYS))
+    cursor = Cursor(urlsafe=urlsafe_cursor) if urlsafe_cursor else None
+    games, next_cursor, more = Game.query(
+        Game.game_over == True, Game.date < cutoff).fetch_page(
+            ARCHIVE_BATCH_SIZE, start_cursor=cursor)
+    if not games:
+        return 0, None
+    histories = ndb.get_multi([History.key_for(game.key) for game in games])
+    # JSON histories which are not migrated yet are found by the query
+    histories = [history or History.get_for_game(game.key)
+                 for game, history in zip(games, histories)]
+    # Games of a failed batch which are indexed are in their segment
+    pending = [(game, history) for game, history, archived in zip(
+        games, histories, is_archived([game.key for game in games]))
+        if not archived]
+    if pending:
+        _save_segment(pending)
+    ndb.delete_multi([game.key for game in games] +
+                     [history.key for history in histories if history])
+    if more and next_cursor:
+        return len(games), next_cursor.urlsafe()
+    return len(games), None
+
+
+def _segment_id(game_keys):
+    """Returns the ID of the segment of the games"""
+    return hashlib.sha1(','.join(str(key.id()) for key in game_keys)
+                        ).hexdigest()
+
+
+def _save_segment(pairs):
+    """Saves the segment of (game, history) pairs and then its index"""
+    segment_key = ndb.Key(ArchiveSegment,
+                          _segment_id([game.key for game, _ in pairs]))
+    lines = []
+    index = []
+    offset = 0
+    for game, history in pairs:
+        line = json.dumps(_record(game, history), separators=(',', ':'))
+        index.append(ArchivedGame(key=ArchivedGame.key_for(game.key),
+                                  segment=segment_key.id(), offset=offset,
+                                  length=len(line)))
+        lines.append(line)
+        offset += len(line) + 1
+    ArchiveSegment(key=segment_key, data=zlib.compress('\n'.join(lines), 9),
+                   count=len(pairs)).put()
+    # The index points only to a saved segment
+    ndb.put_multi(index)
+
+
+def _segment_data(segment_id):
+    """Returns the decompressed data of the segment or None"""
+    data = _segments.get(segment_id)
+    if data is None:
+        segment = ndb.Key(ArchiveSegment, segment_id).get()
+        if segment is None:
+            return None
+        data = zlib.decompress(segment.data)
+        _segments.set(segment_id, data)
+    return data
+
+
+def get_archived(game_key):
+    """ get_archived: the archived game with its history
+    Args:
+        game_key: key of the game
+    Returns: tuple of the Game and History which are not saved, or
+        (None, None) if the game is not archived
+    """
+    index = ArchivedGame.key_for(game_key).get()
+    if index is None:
+        return None, None
+    data = _segment_data(index.segment)
+    if data is None:
+        return None, None
+    record = json.loads(data[index.offset:index.offset + index.length])
+    return _restore(game_key, record)
+
+
+def iter_segment(segment):
+    """Returns generator of (game, history) of games archived in the
+    segment, they are not saved. Records left over by a failed batch are
+    skipped - their games are indexed in another segment."""
+    records = [json.loads(line)
+               for line in zlib.decompress(segment.data).split('\n')]
+    game_keys = [ndb.Key(urlsafe=record['key']) for record in records]
+    indices = ndb.get_multi([ArchivedGame.key_for(key) for key in game_keys])
+    for game_key, record, index in zip(game_keys, records, indices):
+        if index is not None and index.segment == segment.key.id():
+            yield _restore(game_key, record)
+
+
+def is_archived(game_keys):
+    """Returns True for every game key which is archived"""
+    return [index is not None for index in ndb.get_multi(
+        [ArchivedGame.key_for(key) for key in game_keys])]
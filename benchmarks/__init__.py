@@ -0,0 +1 @@
+"""benchmarks - Scripts measuring the game service hot paths."""
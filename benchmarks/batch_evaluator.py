@@ -0,0 +1,100 @@
+"""batch_evaluator.py - Throughput of evaluator.py against the original check.
+
+Random game fields are checked one by one with check_winner - the original
+check of make_move, the reference of the tests - and with the engine board
+used by make_move now, and at once with evaluator.check_winners. The results
+must be the same.
+
+    python -m benchmarks.batch_evaluator --boards 1000000 --size 3
+"""
+import argparse
+import math
+import random
+import time
+
+from engine import Board
+
+
+def check_winner(game_field, symbol, row, col):
+    """The original check of full lines through the latest move, kept as the
+    reference for the engine and the evaluator
+    Returns: True if the game is over
+    """
+    dim_size = int(math.sqrt(len(game_field)))
+    if all(game_field[row * dim_size + index] == symbol
+           for index in range(dim_size)):
+        return True
+    if all(game_field[index * dim_size + col] == symbol
+           for index in range(dim_size)):
+        return True
+    if row == col and all(game_field[index * dim_size + index] == symbol
+                          for index in range(dim_size)):
+        return True
+    if row + col == dim_size - 1 and all(
+            game_field[(dim_size - index - 1) * dim_size + index] == symbol
+            for index in range(dim_size)):
+        return True
+    return False
+
+
+def random_games(count, size, seed=0):
+    """Returns game fields with the latest moves of random games
+    Returns: list of (game field, symbol, row, col)"""
+    generator = random.Random(seed)
+    games = []
+    for _ in range(count):
+        board = Board(size)
+        cells = list(range(size * size))
+        generator.shuffle(cells)
+        for cell in cells[:generator.randint(1, size * size)]:
+            symbol = board.next_symbol()
+            row, col = divmod(cell, size)
+            board.play(symbol, row, col)
+            if board.is_winner(symbol, row, col):
+                break
+        games.append((board.to_field(), symbol, row, col))
+    return games
+
+
+def run(count, size):
+    # NumPy is needed by the benchmark only, tests use random_games without it
+    import evaluator
+
+    games = random_games(count, size)
+
+    start = time.time()
+    expected = [check_winner(*game) for game in games]
+    single = time.time() - start
+
+    start = time.time()
+    engine = [Board.from_field(field).is_winner(symbol, row, col)
+              for field, symbol, row, col in games]
+    board = time.time() - start
+
+    start = time.time()
+    boards = evaluator.load_fields(field for field, _, _, _ in games)
+    result = evaluator.check_winners(
+        boards,
+        [evaluator.X if symbol == 'x' else evaluator.O
+         for _, symbol, _, _ in games],
+        [row for _, _, row, _ in games],
+        [col for _, _, _, col in games])
+    evaluator.evaluate(boards)
+    batch = time.time() - start
+
+    if engine != expected:
+        raise AssertionError('Engine results differ from check_winner')
+    if list(result) != expected:
+        raise AssertionError('Batch results differ from check_winner')
+    print('{} boards {}x{}: check_winner {:.0f} boards/s, '
+          'engine {:.0f} boards/s, batch {:.0f} boards/s, x{:.1f}'.format(
+              count, size, size, count / single, count / board,
+              count / batch, single / batch))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--boards', type=int, default=100000)
+    parser.add_argument('--size', type=int, default=3)
+    arguments = parser.parse_args()
+    run(arguments.boards, arguments.size)
@@ -0,0 +1,231 @@
+"""endpoints.py - Cost of the tictactoegame hot paths on local stubs.
+
+Every data size gets fresh datastore, memcache and taskqueue stubs with the
+given number of users. Calls of make_move, new_game, get_user_games,
+get_rankings, refresh_rates and refresh_dirty_rates are measured - wall time
+and the number of datastore gets, puts and queries (all RPCs are counted by
+an apiproxy hook). The report is written as JSON.
+
+Datastore calls of every path are checked against RPC_BUDGETS - they must
+not grow with the number of users - and the script exits with status 1 if
+a path makes more calls than its budget.
+
+    python -m benchmarks.endpoints --sdk ~/google_appengine \\
+        --users 100 10000 100000 --report benchmark_report.json
+"""
+import argparse
+import collections
+import json
+import sys
+import time
+
+from tools.sdk import ROOT, RpcCounter, fix_sys_path
+
+GAMES_PER_USER = 20
+REPEAT = 5
+BATCH_SIZE = 500
+# Moves of X win on the first row
+WIN_MOVES = ((0, 0, 'x'), (1, 0, 'o'), (0, 1, 'x'), (1, 1, 'o'), (0, 2, 'x'))
+
+DATASTORE_CALLS = {
+    'gets': ('Get',),
+    'puts': ('Put',),
+    'deletes': ('Delete',),
+    'queries': ('RunQuery',),
+    'query_batches': ('Next',),
+    'transactions': ('BeginTransaction',),
+    'commits': ('Commit',),
+}
+# Maximum datastore calls per call of the path, the same for every data size
+RPC_BUDGETS = {
+    'new_game': {'gets': 3, 'puts': 1, 'queries': 0},
+    'make_move': {'gets': 1, 'puts': 1, 'queries': 0},
+    'make_move (game over)': {'gets': 3, 'puts': 1, 'queries': 0},
+    'get_user_games': {'gets': 2, 'puts': 0, 'queries': 0},
+    'get_rankings': {'gets': 0, 'puts': 0, 'queries': 0},
+    'get_rankings (datastore page)': {'gets': 0, 'puts': 0, 'queries': 2},
+    'refresh_rates': {'gets': 3, 'puts': 1, 'queries': 0},
+    'refresh_dirty_rates': {'gets': 8, 'puts': 6, 'queries': 0},
+}
+
+
+class Benchmark(object):
+    """Stubs with users for one data size"""
+    def __init__(self, users):
+        from google.appengine.datastore import datastore_stub_util
+        from google.appengine.ext import testbed
+
+        self.users = users
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        # endpoints reads the revision from the version ID
+        self.testbed.setup_env(current_version_id='benchmark.1',
+                               overwrite=True)
+        self.testbed.init_datastore_v3_stub(
+            consistency_policy=datastore_stub_util.
+            PseudoRandomHRConsistencyPolicy(probability=1))
+        self.testbed.init_memcache_stub()
+        self.testbed.init_taskqueue_stub(root_path=ROOT)
+        self.testbed.init_app_identity_stub()
+        self.counter = RpcCounter()
+        self.counter.install()
+        self.results = []
+
+    def close(self):
+        self.testbed.deactivate()
+
+    def populate(self):
+        """Creates users, their rank index and active games of player0"""
+        from google.appengine.ext import ndb
+        import leaderboard
+        from models import (User, Game, History, add_active_games,
+                            rebuild_rank_index)
+
+        for start in range(0, self.users, BATCH_SIZE):
+            ndb.put_multi([User(key=User.key_for('player%d' % index),
+                                name='player%d' % index,
+                                email='player%d@example.com' % index,
+                                win=index % 7, loss=index % 5,
+                                draw=index % 3,
+                                rate=2 * (index % 7) + index % 3 - index % 5)
+                           for index in range(start, min(start + BATCH_SIZE,
+                                                         self.users))])
+        cursor = rebuild_rank_index()
+        while cursor:
+            cursor = rebuild_rank_index(cursor)
+        leaderboard.rebuild()
+        games = [Game(user_x=User.key_for('player0'),
+                      user_o=User.key_for('player%d' % index))
+                 for index in range(1, min(GAMES_PER_USER + 1, self.users))]
+        ndb.put_multi(games)
+        ndb.put_multi([History(key=History.key_for(game.key))
+                       for game in games])
+        add_active_games(games)
+
+    def measure(self, name, call, repeat=REPEAT):
+        """Runs the call and records the mean wall time and RPCs per call
+        Args:
+            name: name of the measured call
+            call: function without arguments
+            repeat: number of calls
+        """
+        from google.appengine.ext import ndb
+
+        wall = 0.0
+        calls = collections.Counter()
+        for _ in range(repeat):
+            ndb.get_context().clear_cache()
+            self.counter.reset()
+            start = time.time()
+            call()
+            wall += time.time() - start
+            calls.update(self.counter.calls)
+
+        datastore = dict((kind, sum(calls[('datastore_v3', method)]
+                                    for method in methods) / float(repeat))
+                         for kind, methods in DATASTORE_CALLS.items())
+        self.results.append({
+            'name': name,
+            'users': self.users,
+            'calls': repeat,
+            'wall_ms': 1000 * wall / repeat,
+            'datastore': datastore,
+            'memcache': sum(count for (service, _), count in calls.items()
+                            if service == 'memcache') / float(repeat),
+            'rpcs': dict(('%s.%s' % key, count / float(repeat))
+                         for key, count in calls.items()),
+        })
+
+    def run(self):
+        import api
+        from api import tictactoegame
+        import models
+
+        service = tictactoegame()
+        new_game = api.NEW_GAME_REQUEST.combined_message_class
+        make_move = api.MAKE_MOVE_REQUEST.combined_message_class
+        user_games = api.USER_GAMES_REQUEST.combined_message_class
+        page = api.PAGE_REQUEST.combined_message_class
+
+        games = []
+
+        def create_game():
+            games.append(service.new_game(new_game(
+                user_name_x='player1', user_name_o='player2')))
+        self.measure('new_game', create_game)
+
+        # Every move is measured once in each created game
+        for index, (row, col, symbol) in enumerate(WIN_MOVES):
+            user = 'player1' if symbol == 'x' else 'player2'
+            pending = iter(games)
+            last = index == len(WIN_MOVES) - 1
+            self.measure('make_move (game over)' if last else 'make_move',
+                         lambda: service.make_move(make_move(
+                             urlsafe_game_key=next(pending).urlsafe_key,
+                             row=row, col=col, user=user)),
+                         repeat=len(games))
+
+        self.measure('get_user_games', lambda: service.get_user_games(
+            user_games(user_name='player0')))
+        self.measure('get_rankings', lambda: service.get_rankings(page()))
+        self.measure('get_rankings (datastore page)',
+                     lambda: service.get_rankings(page(cursor='top:100')))
+        self.measure('refresh_rates', lambda: models.refresh_rates(
+            [models.User.key_for('player1')]))
+        # One refresh of the rates marked dirty by the finished games
+        self.measure('refresh_dirty_rates', models.refresh_dirty_rates,
+                     repeat=1)
+
+
+def over_budget(results):
+    """Returns messages for results with more datastore calls than
+    RPC_BUDGETS"""
+    messages = []
+    for result in results:
+        budget = RPC_BUDGETS.get(result['name'], {})
+        for kind, limit in sorted(budget.items()):
+            if result['datastore'][kind] > limit:
+                messages.append('{} with {} users: {} {:.1f} > {}'.format(
+                    result['name'], result['users'], kind,
+                    result['datastore'][kind], limit))
+    return messages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sdk', help='path to the App Engine SDK')
+    parser.add_argument('--users', type=int, nargs='+',
+                        default=[100, 10000, 100000])
+    parser.add_argument('--report', default='benchmark_report.json')
+    arguments = parser.parse_args()
+    fix_sys_path(arguments.sdk)
+
+    report = []
+    for users in arguments.users:
+        benchmark = Benchmark(users)
+        try:
+            start = time.time()
+            benchmark.populate()
+            print('{} users created in {:.1f}s'.format(
+                users, time.time() - start))
+            benchmark.run()
+        finally:
+            benchmark.close()
+        for result in benchmark.results:
+            print('{users:>7} {name:<32} {wall_ms:>9.1f} ms  '
+                  'gets {datastore[gets]:.1f}  puts {datastore[puts]:.1f}  '
+                  'queries {datastore[queries]:.1f}'.format(**result))
+        report.extend(benchmark.results)
+
+    with open(arguments.report, 'w') as report_file:
+        json.dump({'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                   'results': report}, report_file, indent=2, sort_keys=True)
+    failures = over_budget(report)
+    for message in failures:
+        print('Over budget: ' + message)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""simulation.py - Throughput of game play on the in-memory repository.
+
+Users play games against each other and the computer player with random
+legal moves through service.GameService on storage.MemoryRepository, so the
+game logic is measured without the App Engine SDK and the datastore. With
+--size games are played on the large board without the computer player.
+
+    python -m benchmarks.simulation --users 100 --games 10000
+    python -m benchmarks.simulation --games 100 --size 19
+"""
+import argparse
+import random
+import time
+
+import bot
+from service import GameService
+from storage import MemoryRepository
+
+
+def simulate(users, games, bot_share, seed=None, size=None):
+    """Plays games to the end
+    Args:
+        users: number of users
+        games: number of games
+        bot_share: part of games against the computer player
+        seed: seed of random moves
+        size: dimension of the large board, the classic board by default
+    Returns: dict with numbers of games and moves and wall time in seconds
+    """
+    rng = random.Random(seed)
+    service = GameService(MemoryRepository())
+    names = ['player%d' % index for index in range(users)]
+    for name in names:
+        service.create_user(name)
+
+    moves = 0
+    start = time.time()
+    for _ in range(games):
+        if not size and rng.random() < bot_share:
+            name_x, name_o = rng.choice(names), bot.BOT_NAME
+        else:
+            name_x, name_o = rng.sample(names, 2)
+        game, _ = service.new_game(name_x, name_o, size)
+        while not game.game_over:
+            board = game.board()
+            name = name_x if board.next_symbol() == 'x' else name_o
+            free = [(row, col) for row in range(board.size)
+                    for col in range(board.size) if board.is_free(row, col)]
+            row, col = rng.choice(free)
+            game, _, _ = service.make_move(game.key, name, row, col)
+            moves += 1
+    return {'games': games, 'moves': moves, 'wall': time.time() - start}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--games', type=int, default=10000)
+    parser.add_argument('--bot-share', type=float, default=0.5)
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--size', type=int)
+    arguments = parser.parse_args()
+    result = simulate(arguments.users, arguments.games, arguments.bot_share,
+                      arguments.seed, arguments.size)
+    print('{games} games, {moves} moves in {wall:.2f}s'.format(**result))
+    print('{:.0f} games/s, {:.0f} moves/s'.format(
+        result['games'] / result['wall'], result['moves'] / result['wall']))
+
+
+if __name__ == '__main__':
+    main()
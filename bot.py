@@ -0,0 +1,249 @@
+"""bot.py - Computer player.
+
+Moves are chosen by alpha-beta search with a transposition table keyed by
+the canonical board - the smallest of its 8 rotations and reflections. The
+game rules are the engine win lines used by make_move. All reachable
+3x3 positions are solved once per instance, so a move on the classic board
+is a table lookup. Search on larger boards is limited by depth and time.
+"""
+import time
+
+from engine import cell_masks, win_masks
+
+BOT_NAME = 'TicTacToeBot'
+MAX_DEPTH = 6
+TIME_LIMIT = 1.0
+PERFECT_PLAY_SIZE = 3
+WIN = 1000000
+
+EXACT, LOWER, UPPER = range(3)
+
+_SYMMETRIES = {}
+_PERFECT_MOVES = {}
+
+
+class _Timeout(Exception):
+    pass
+
+
+def symmetries(size):
+    """Returns 8 permutations of cells - rotations and reflections of
+    size x size grid"""
+    if size not in _SYMMETRIES:
+        last = size - 1
+        transforms = (lambda r, c: (r, c),
+                      lambda r, c: (c, last - r),
+                      lambda r, c: (last - r, last - c),
+                      lambda r, c: (last - c, r),
+                      lambda r, c: (r, last - c),
+                      lambda r, c: (c, r),
+                      lambda r, c: (last - r, c),
+                      lambda r, c: (last - c, last - r))
+        permutations = []
+        for transform in transforms:
+            permutation = []
+            for cell in range(size * size):
+                row, col = transform(*divmod(cell, size))
+                permutation.append(row * size + col)
+            permutations.append(tuple(permutation))
+        _SYMMETRIES[size] = tuple(permutations)
+    return _SYMMETRIES[size]
+
+
+def _permute(bits, permutation):
+    """Moves every set bit to its cell in the permutation"""
+    result = 0
+    while bits:
+        low = bits & -bits
+        result |= 1 << permutation[low.bit_length() - 1]
+        bits ^= low
+    return result
+
+
+def canonical(me, other, size):
+    """Returns the canonical position and the permutation which gives it
+    Args:
+        me: bitboard of the player to move
+        other: bitboard of the opponent
+        size: dimension of the grid
+    """
+    return min(((_permute(me, permutation), _permute(other, permutation)),
+                permutation) for permutation in symmetries(size))
+
+
+def canonical_permutations(me, other, size):
+    """Returns the canonical position and all permutations which give it -
+    more than one if the position is symmetric, equivalent cells of the
+    position are mapped to the same set of cells"""
+    positions = [((_permute(me, permutation), _permute(other, permutation)),
+                  permutation) for permutation in symmetries(size)]
+    position = min(positions)[0]
+    return position, [permutation for candidate, permutation in positions
+                      if candidate == position]
+
+
+def _cells_by_preference(size):
+    """Returns cells ordered from the center to the corners"""
+    center = (size - 1) / 2.0
+    return sorted(range(size * size),
+                  key=lambda cell: (abs(cell // size - center) +
+                                    abs(cell % size - center), cell))
+
+
+class _Search(object):
+    """Negamax with alpha-beta pruning and a transposition table"""
+    def __init__(self, size, length, deadline=None):
+        self.size = size
+        self.length = length
+        self.deadline = deadline
+        self.full = (1 << size * size) - 1
+        self.lines = win_masks(size, length)
+        self.masks = cell_masks(size, length)
+        self.order = _cells_by_preference(size)
+        self.table = {}
+
+    def is_win(self, bits, cell):
+        for mask in self.masks[cell]:
+            if bits & mask == mask:
+                return True
+        return False
+
+    def evaluate(self, me, other):
+        """Open lines weighted by the number of marks in them"""
+        score = 0
+        for line in self.lines:
+            mine, theirs = line & me, line & other
+            if mine and not theirs:
+                score += 1 << (2 * bin(mine).count('1'))
+            elif theirs and not mine:
+                score -= 1 << (2 * bin(theirs).count('1'))
+        return score
+
+    def win_value(self, bits):
+        """Value of the win - quick wins are preferred"""
+        return WIN - bin(bits).count('1')
+
+    def negamax(self, me, other, depth, alpha, beta):
+        """Returns the value of the position for the player to move
+        Args:
+            me, other: bitboards of the player to move and the opponent
+            depth: remaining depth or None for the full search
+            alpha, beta: search window
+        """
+        if self.deadline is not None and time.time() > self.deadline:
+            raise _Timeout()
+        free = self.full & ~(me | other)
+        if not free:
+            return 0
+        if depth == 0:
+            return self.evaluate(me, other)
+
+        key = canonical(me, other, self.size)[0]
+        entry = self.table.get(key)
+        if entry is not None and (entry[0] is None or
+                                  depth is not None and entry[0] >= depth):
+            entry_depth, value, flag = entry
+            if flag == EXACT:
+                return value
+            if flag == LOWER:
+                alpha = max(alpha, value)
+            elif flag == UPPER:
+                beta = min(beta, value)
+            if alpha >= beta:
+                return value
+
+        original_alpha = alpha
+        best = -WIN * 2
+        for cell in self.order:
+            if not free >> cell & 1:
+                continue
+            mine = me | 1 << cell
+            if self.is_win(mine, cell):
+                value = self.win_value(mine | other)
+            else:
+                value = -self.negamax(other, mine,
+                                      None if depth is None else depth - 1,
+                                      -beta, -alpha)
+            best = max(best, value)
+            alpha = max(alpha, value)
+            if alpha >= beta:
+                break
+
+        if best <= original_alpha:
+            flag = UPPER
+        elif best >= beta:
+            flag = LOWER
+        else:
+            flag = EXACT
+        self.table[key] = (depth, best, flag)
+        return best
+
+    def best_move(self, me, other, depth):
+        """Returns the cell with the best value for the player to move"""
+        free = self.full & ~(me | other)
+        best_cell, best = None, -WIN * 2
+        for cell in self.order:
+            if not free >> cell & 1:
+                continue
+            mine = me | 1 << cell
+            if self.is_win(mine, cell):
+                return cell
+            value = -self.negamax(other, mine,
+                                  None if depth is None else depth - 1,
+                                  -WIN * 2, -best)
+            if best_cell is None or value > best:
+                best_cell, best = cell, value
+        return best_cell
+
+
+def _perfect_moves(size, length):
+    """Solves all reachable positions of the small grid
+    Returns: dict canonical position -> the best cell in it"""
+    key = (size, length)
+    if key not in _PERFECT_MOVES:
+        search = _Search(size, length)
+        moves = {}
+        positions = [(0, 0)]
+        while positions:
+            me, other = positions.pop()
+            position = canonical(me, other, size)[0]
+            if position in moves:
+                continue
+            me, other = position
+            moves[position] = search.best_move(me, other, None)
+            free = search.full & ~(me | other)
+            for cell in range(size * size):
+                if free >> cell & 1 and not search.is_win(me | 1 << cell,
+                                                          cell):
+                    positions.append((other, me | 1 << cell))
+        _PERFECT_MOVES[key] = moves
+    return _PERFECT_MOVES[key]
+
+
+def choose_move(board):
+    """Returns the move of the player whose move it is
+    Args:
+        board: engine Board of the game which is not over
+    Returns: tuple (row, col)
+    """
+    symbol = board.next_symbol()
+    me = board.bits[symbol]
+    other = board.bits['o' if symbol == 'x' else 'x']
+    if board.size == PERFECT_PLAY_SIZE:
+        position, permutation = canonical(me, other, board.size)
+        cell = permutation.index(
+            _perfect_moves(board.size, board.length)[position])
+        return divmod(cell, board.size)
+
+    search = _Search(board.size, board.length, time.time() + TIME_LIMIT)
+    cell = None
+    # Iterative deepening - the move of the last finished depth is used
+    for depth in range(1, MAX_DEPTH + 1):
+        try:
+            cell = search.best_move(me, other, depth)
+        except _Timeout:
+            break
+    if cell is None:
+        cell = next(cell for cell in search.order
+                    if not (me | other) >> cell & 1)
+    return divmod(cell, board.size)
@@ -0,0 +1,229 @@
+"""engine.py - Bitboard game engine.
+
+Marks of each player are kept as an integer - bit (row * size + col) is set
+when the cell is marked. The game field string saved in Game ('x', 'o' and
+' ' for every cell) is converted to the board and back, so stored games stay
+readable.
+
+Large boards are SparseBoard - only marked cells are kept, in the order of
+moves, and a win is found by walking outward from the latest move. Memory,
+checks and the saved game grow with the number of moves, not with the area.
+"""
+import math
+import struct
+
+SYMBOLS = ('x', 'o')
+EMPTY = ' '
+MAX_SPARSE_SIZE = 19
+GOMOKU_LENGTH = 5
+
+_WIN_MASKS = {}
+_CELL_MASKS = {}
+
+
+def popcount(bits):
+    """Returns the number of set bits"""
+    return bin(bits).count('1')
+
+
+def win_masks(size, length):
+    """Returns all lines of `length` cells in a row on size x size grid
+    Args:
+        size: dimension of the grid
+        length: number of marks in a row needed to win
+    Returns: tuple of bit masks - horizontal, vertical and both diagonals
+    """
+    key = (size, length)
+    if key not in _WIN_MASKS:
+        masks = []
+        directions = ((0, 1), (1, 0), (1, 1), (1, -1))
+        for row in range(size):
+            for col in range(size):
+                for d_row, d_col in directions:
+                    end_row = row + d_row * (length - 1)
+                    end_col = col + d_col * (length - 1)
+                    if not (0 <= end_row < size and 0 <= end_col < size):
+                        continue
+                    mask = 0
+                    for step in range(length):
+                        mask |= 1 << ((row + d_row * step) * size +
+                                      col + d_col * step)
+                    masks.append(mask)
+        _WIN_MASKS[key] = tuple(masks)
+    return _WIN_MASKS[key]
+
+
+def cell_masks(size, length):
+    """Returns win masks grouped by cell - only lines through the latest
+    move have to be checked
+    Returns: tuple indexed by cell with tuples of bit masks
+    """
+    key = (size, length)
+    if key not in _CELL_MASKS:
+        masks = win_masks(size, length)
+        _CELL_MASKS[key] = tuple(
+            tuple(mask for mask in masks if mask >> cell & 1)
+            for cell in range(size * size))
+    return _CELL_MASKS[key]
+
+
+class Board(object):
+    """Game grid as two bitboards"""
+    SPARSE = False
+
+    def __init__(self, size=3, length=None, x=0, o=0):
+        """
+        Args:
+            size: dimension of the grid
+            length: marks in a row to win, the whole line by default
+            x, o: bitboards of the players
+        """
+        self.size = size
+        self.length = length or size
+        self.full = (1 << size * size) - 1
+        self.bits = {'x': x, 'o': o}
+
+    @classmethod
+    def from_field(cls, game_field, length=None):
+        """Creates the board from the game field string saved in Game"""
+        size = int(round(math.sqrt(len(game_field))))
+        if size * size != len(game_field):
+            raise ValueError('Game field should be a square grid')
+        x = o = 0
+        for cell, symbol in enumerate(game_field):
+            if symbol == 'x':
+                x |= 1 << cell
+            elif symbol == 'o':
+                o |= 1 << cell
+        return cls(size, length, x, o)
+
+    def to_field(self):
+        """Returns the game field string for Game"""
+        x, o = self.bits['x'], self.bits['o']
+        return ''.join('x' if x >> cell & 1 else 'o' if o >> cell & 1
+                       else EMPTY for cell in range(self.size * self.size))
+
+    def cell(self, row, col):
+        """Returns the cell index or raises ValueError if out of the grid"""
+        if not (0 <= row < self.size and 0 <= col < self.size):
+            raise ValueError('The cell is out of the grid')
+        return row * self.size + col
+
+    @property
+    def moves(self):
+        """Number of marked cells"""
+        return popcount(self.bits['x'] | self.bits['o'])
+
+    def next_symbol(self):
+        """Returns whose move it is - 'x' starts the game"""
+        if popcount(self.bits['x']) == popcount(self.bits['o']):
+            return 'x'
+        return 'o'
+
+    def is_free(self, row, col):
+        return not (self.bits['x'] | self.bits['o']) >> self.cell(row, col) & 1
+
+    def is_full(self):
+        return (self.bits['x'] | self.bits['o']) == self.full
+
+    def play(self, symbol, row, col):
+        """Marks the cell for the player"""
+        self.bits[symbol] |= 1 << self.cell(row, col)
+
+    def is_winner(self, symbol, row, col):
+        """Checks lines through the latest move
+        Args:
+            symbol: x or o - the latest move
+            row, col: coordinates of the latest move
+        Returns: True if the player has `length` marks in a row
+        """
+        bits = self.bits[symbol]
+        masks = cell_masks(self.size, self.length)[self.cell(row, col)]
+        for mask in masks:
+            if bits & mask == mask:
+                return True
+        return False
+
+
+class SparseBoard(object):
+    """Large game grid - dict cell -> symbol of marked cells and the list of
+    cells in the order of moves, 'x' makes the first move"""
+    SPARSE = True
+    DIRECTIONS = ((0, 1), (1, 0), (1, 1), (1, -1))
+
+    def __init__(self, size, length=None, cells=()):
+        """
+        Args:
+            size: dimension of the grid
+            length: marks in a row to win, GOMOKU_LENGTH by default
+            cells: marked cells in the order of moves
+        """
+        self.size = size
+        self.length = length or min(size, GOMOKU_LENGTH)
+        self.marks = {}
+        self.order = []
+        for cell in cells:
+            self.marks[cell] = SYMBOLS[len(self.order) % 2]
+            self.order.append(cell)
+
+    @classmethod
+    def from_packed(cls, size, length, packed):
+        """Creates the board from moves packed by to_packed"""
+        return cls(size, length,
+                   struct.unpack('>%dH' % (len(packed) // 2,), packed))
+
+    def to_packed(self):
+        """Returns the moves packed into two bytes per move"""
+        return struct.pack('>%dH' % (len(self.order),), *self.order)
+
+    def cell(self, row, col):
+        """Returns the cell index or raises ValueError if out of the grid"""
+        if not (0 <= row < self.size and 0 <= col < self.size):
+            raise ValueError('The cell is out of the grid')
+        return row * self.size + col
+
+    @property
+    def moves(self):
+        """Number of marked cells"""
+        return len(self.order)
+
+    def next_symbol(self):
+        """Returns whose move it is - 'x' starts the game"""
+        return SYMBOLS[len(self.order) % 2]
+
+    def is_free(self, row, col):
+        return self.cell(row, col) not in self.marks
+
+    def is_full(self):
+        return len(self.order) == self.size * self.size
+
+    def play(self, symbol, row, col):
+        """Marks the cell for the player"""
+        cell = self.cell(row, col)
+        self.marks[cell] = symbol
+        self.order.append(cell)
+
+    def _run(self, symbol, row, col, d_row, d_col):
+        """Returns the number of marks of the symbol next to the cell in the
+        direction"""
+        run = 0
+        row, col = row + d_row, col + d_col
+        while (0 <= row < self.size and 0 <= col < self.size and
+               self.marks.get(row * self.size + col) == symbol):
+            run += 1
+            row, col = row + d_row, col + d_col
+        return run
+
+    def is_winner(self, symbol, row, col):
+        """Counts marks in a row through the latest move in four directions
+        Args:
+            symbol: x or o - the latest move
+            row, col: coordinates of the latest move
+        Returns: True if the player has at least `length` marks in a row
+        """
+        for d_row, d_col in self.DIRECTIONS:
+            if (1 + self._run(symbol, row, col, d_row, d_col) +
+                    self._run(symbol, row, col, -d_row, -d_col) >=
+                    self.length):
+                return True
+        return False
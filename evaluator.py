@@ -0,0 +1,102 @@
+"""evaluator.py - Batch evaluation of game fields with NumPy.
+
+Boards are loaded into one int8 array - one row per board, one column per
+cell with 1 for 'x', -1 for 'o' and 0 for the empty cell. Marks of every
+line are counted for all boards at once by the matrix product with the
+engine win lines, so the results are the same as of the engine board.
+"""
+import numpy
+
+from engine import win_masks
+
+X, O, EMPTY = 1, -1, 0
+_LINES = {}
+
+
+def line_matrix(size, length=None):
+    """Returns (cells, lines) matrix - 1 if the cell is in the line
+    Args:
+        size: dimension of the grid
+        length: marks in a row to win, the whole line by default
+    """
+    key = (size, length or size)
+    if key not in _LINES:
+        masks = win_masks(size, length or size)
+        matrix = numpy.zeros((size * size, len(masks)), dtype=numpy.int16)
+        for line, mask in enumerate(masks):
+            for cell in range(size * size):
+                if mask >> cell & 1:
+                    matrix[cell, line] = 1
+        _LINES[key] = matrix
+    return _LINES[key]
+
+
+def load_fields(game_fields):
+    """Returns int8 array of boards
+    Args:
+        game_fields: game field strings of the same size
+    """
+    game_fields = list(game_fields)
+    if not game_fields:
+        return numpy.zeros((0, 0), dtype=numpy.int8)
+    chars = numpy.frombuffer(''.join(game_fields).encode('ascii'),
+                             dtype=numpy.uint8)
+    chars = chars.reshape(len(game_fields), -1)
+    boards = numpy.zeros(chars.shape, dtype=numpy.int8)
+    boards[chars == ord('x')] = X
+    boards[chars == ord('o')] = O
+    return boards
+
+
+def _size(boards):
+    size = int(round(numpy.sqrt(boards.shape[1])))
+    if size * size != boards.shape[1]:
+        raise ValueError('Game field should be a square grid')
+    return size
+
+
+def _line_counts(boards, symbol, length):
+    """Returns (boards, lines) numbers of marks of the symbol in lines"""
+    marks = (boards == symbol).astype(numpy.int16)
+    return numpy.dot(marks, line_matrix(_size(boards), length))
+
+
+def evaluate(boards, length=None):
+    """Evaluates all boards
+    Args:
+        boards: array from load_fields
+        length: marks in a row to win, the whole line by default
+    Returns: dict of arrays with one item per board
+        winner: X, O or EMPTY if there is no full line
+        draw: True if the board is full without a winner
+        turn: X or O - whose move it is
+    """
+    length = length or _size(boards)
+    x_win = (_line_counts(boards, X, length) == length).any(axis=1)
+    o_win = (_line_counts(boards, O, length) == length).any(axis=1)
+    winner = numpy.where(x_win, X, numpy.where(o_win, O, EMPTY))
+    full = (boards != EMPTY).all(axis=1)
+    x_count = (boards == X).sum(axis=1)
+    o_count = (boards == O).sum(axis=1)
+    return {'winner': winner.astype(numpy.int8),
+            'draw': full & (winner == EMPTY),
+            'turn': numpy.where(x_count == o_count, X, O).astype(numpy.int8)}
+
+
+def check_winners(boards, symbols, rows, cols, length=None):
+    """Board.is_winner for all boards - only lines through the latest move
+    Args:
+        boards: array from load_fields
+        symbols: X or O - the latest move of every board
+        rows, cols: the latest move of every board
+        length: marks in a row to win, the whole line by default
+    Returns: bool array - True if the game is over
+    """
+    size = _size(boards)
+    length = length or size
+    symbols = numpy.asarray(symbols, dtype=numpy.int8)
+    cells = numpy.asarray(rows) * size + numpy.asarray(cols)
+    marks = (boards == symbols[:, numpy.newaxis]).astype(numpy.int16)
+    lines = line_matrix(size, length)
+    full_lines = numpy.dot(marks, lines) == length
+    return (full_lines & (lines[cells] == 1)).any(axis=1)
@@ -0,0 +1,177 @@
+"""export.py - Streaming export of games for offline analysis.
+
+Games are walked by the cursor in batches - the next page of games is
+fetched while histories and names of the current one are loaded with
+get_multi, histories saved before with JSON moves by their query - and
+archived games are read segment by segment. Every game is
+written as one compact NDJSON record:
+
+    {"game": <urlsafe key>, "x": <name>, "o": <name>, "date": <date>,
+     "size": 3, "length": 3, "result": "x" | "o" | "draw" | null,
+     "moves": [<cell>, ...]}
+
+where moves are cell indices (row * size + col) in the order of moves, 'x'
+moves first, and result is null for the game in play. Only one batch is held
+in memory. After every batch the file is flushed and the checkpoint - the
+phase, cursor and size of the file - is saved, so an interrupted export
+resumes from the last batch. Segments are walked by their date, so the ones
+saved while the export runs are read too, and every archived game is read
+from the one segment its index points to. A game which is archived after
+the games phase has read it is written by both phases - the records are
+the same, readers keep one per game key.
+"""
+import json
+import os
+
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+from models import Game, History, ArchiveSegment, get_user_names
+import archive
+
+EXPORT_BATCH_SIZE = 500
+GAMES, ARCHIVE = 'games', 'archive'
+
+
+def _result(game, cells):
+    """Returns 'x' or 'o' for the winner, 'draw' or None if the game is in
+    play"""
+    if not game.game_over or not cells:
+        return None
+    board = game.board()
+    symbol = 'x' if len(cells) % 2 else 'o'
+    row, col = divmod(cells[-1], board.size)
+    return symbol if board.is_winner(symbol, row, col) else 'draw'
+
+
+def game_record(game, history, names):
+    """Returns the export record of the game
+    Args:
+        game, history: the game and its history or None
+        names: dict user key -> name for players of the game
+    """
+    cells = game.move_cells(history)
+    board = game.board()
+    return {'game': game.key.urlsafe(),
+            'x': names.get(game.user_x),
+            'o': names.get(game.user_o),
+            'date': game.date.strftime('%Y-%m-%d %H:%M:%S')
+            if game.date else None,
+            'size': board.size,
+            'length': board.length,
+            'result': _result(game, cells),
+            'moves': cells}
+
+
+def _records(pairs):
+    """Returns export records of (game, history) pairs, names of all players
+    are resolved at once"""
+    names = get_user_names([key for game, _ in pairs
+                            for key in (game.user_x, game.user_o)])
+    return [game_record(game, history, names) for game, history in pairs]
+
+
+def iter_game_batches(urlsafe_cursor=None, batch_size=EXPORT_BATCH_SIZE):
+    """Walks games which are not archived
+    Args:
+        urlsafe_cursor: the cursor of the batch or None for the first batch
+        batch_size: number of games per batch
+    Returns: generator of (records, urlsafe cursor of the next batch or None)
+    """
+    query = Game.query()
+    cursor = Cursor(urlsafe=urlsafe_cursor) if urlsafe_cursor else None
+    future = query.fetch_page_async(batch_size, start_cursor=cursor)
+    while future is not None:
+        games, next_cursor, more = future.get_result()
+        # The next page is fetched while the batch is processed
+        future = None
+        if more and next_cursor:
+            future = query.fetch_page_async(batch_size,
+                                            start_cursor=next_cursor)
+        histories = ndb.get_multi([History.key_for(game.key)
+                                   for game in games])
+        # JSON histories which are not migrated yet are found by the query
+        legacy = dict((game.key,
+                       History.query(History.game == game.key).get_async())
+                      for game, history in zip(games, histories)
+                      if history is None)
+        histories = [history or legacy[game.key].get_result()
+                     for game, history in zip(games, histories)]
+        yield (_records(zip(games, histories)),
+               next_cursor.urlsafe() if future is not None else None)
+
+
+def iter_archive_batches(urlsafe_cursor=None):
+    """Walks archived games one segment per batch
+    Args:
+        urlsafe_cursor: the cursor of the segment or None for the first one
+    Returns: generator of (records, urlsafe cursor of the next batch or None)
+    """
+    query = ArchiveSegment.query().order(ArchiveSegment.date)
+    cursor = Cursor(urlsafe=urlsafe_cursor) if urlsafe_cursor else None
+    more = True
+    while more:
+        segments, cursor, more = query.fetch_page(1, start_cursor=cursor)
+        if not segments:
+            return
+        more = more and cursor is not None
+        yield (_records(list(archive.iter_segment(segments[0]))),
+               cursor.urlsafe() if more else None)
+
+
+def iter_batches(checkpoint=None, batch_size=EXPORT_BATCH_SIZE):
+    """Walks games and then archived games from the checkpoint
+    Args:
+        checkpoint: dict with phase and cursor or None to start from the
+            beginning
+        batch_size: number of games per batch
+    Returns: generator of (records, checkpoint after the batch or None at
+        the end)
+    """
+    phase = checkpoint['phase'] if checkpoint else GAMES
+    cursor = checkpoint['cursor'] if checkpoint else None
+    if phase == GAMES:
+        for records, cursor in iter_game_batches(cursor, batch_size):
+            yield records, ({'phase': GAMES, 'cursor': cursor} if cursor
+                            else {'phase': ARCHIVE, 'cursor': None})
+    for records, cursor in iter_archive_batches(cursor):
+        yield records, ({'phase': ARCHIVE, 'cursor': cursor} if cursor
+                        else None)
+
+
+def export_ndjson(path, batch_size=EXPORT_BATCH_SIZE):
+    """Writes all games into the NDJSON file, the export is resumed from
+    the checkpoint file <path>.checkpoint if it exists
+    Args:
+        path: the output file
+        batch_size: number of games per batch
+    Returns: number of games written by the call
+    """
+    checkpoint_path = path + '.checkpoint'
+    checkpoint = None
+    if os.path.exists(checkpoint_path):
+        with open(checkpoint_path) as checkpoint_file:
+            checkpoint = json.load(checkpoint_file)
+    if not os.path.exists(path):
+        checkpoint = None
+    count = 0
+    with open(path, 'r+b' if checkpoint else 'wb') as out:
+        if checkpoint:
+            # Records written after the checkpoint are written again
+            out.seek(checkpoint['offset'])
+            out.truncate()
+        for records, position in iter_batches(checkpoint, batch_size):
+            for record in records:
+                out.write(json.dumps(record, separators=(',', ':')) + '\n')
+            count += len(records)
+            out.flush()
+            os.fsync(out.fileno())
+            if position is not None:
+                position['offset'] = out.tell()
+                # The checkpoint is replaced at once
+                with open(checkpoint_path + '.tmp', 'w') as checkpoint_file:
+                    json.dump(position, checkpoint_file)
+                os.rename(checkpoint_path + '.tmp', checkpoint_path)
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    return count
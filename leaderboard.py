@@ -0,0 +1,170 @@
+"""leaderboard.py - Snapshot of the best players in memcache.
+
+The snapshot keeps (name, rate, rank) of LEADERBOARD_SIZE best players. It is
+saved under a version number and readers get the current version first, so
+a new snapshot replaces the previous one at once. Finished games update it
+with write-through, on a miss it is rebuilt from the datastore. When users
+drop out of a full snapshot, it is refilled from the datastore, so it keeps
+LEADERBOARD_SIZE rows. Users which are not ranked - new users and the bot -
+are left out as by the rank index.
+"""
+import json
+
+from google.appengine.api import memcache
+import endpoints
+
+from models import User
+
+LEADERBOARD_SIZE = 100
+MEMCACHE_VERSION = 'LEADERBOARD_VERSION'
+MEMCACHE_SNAPSHOT = 'LEADERBOARD:%d'
+SNAPSHOT_TIME = 24 * 60 * 60
+CURSOR_PREFIX = 'top:'
+
+
+def _ranked(rows):
+    """Returns (name, rate, rank) rows sorted by rate - users with equal rate
+    share the same rank
+    Args:
+        rows: (name, rate) of users
+    """
+    ranked = []
+    for index, (name, rate) in enumerate(sorted(rows,
+                                                key=lambda row: -row[1])):
+        if ranked and ranked[-1][1] == rate:
+            rank = ranked[-1][2]
+        else:
+            rank = index + 1
+        ranked.append((name, rate, rank))
+    return ranked
+
+
+def _load():
+    """Returns (version, rows, complete) of the snapshot or None"""
+    version = memcache.get(MEMCACHE_VERSION)
+    if version is None:
+        return None
+    data = memcache.get(MEMCACHE_SNAPSHOT % version)
+    if data is None:
+        return None
+    complete, rows = json.loads(data)
+    return version, [tuple(row) for row in rows], complete
+
+
+def _publish(rows, complete):
+    """Saves the snapshot under the next version
+    Args:
+        rows: (name, rate, rank) of best users
+        complete: True if rows include all users
+    Returns: the version of the snapshot or None if memcache is unavailable
+    """
+    version = memcache.incr(MEMCACHE_VERSION, initial_value=0)
+    if version is not None:
+        memcache.set(MEMCACHE_SNAPSHOT % version,
+                     json.dumps([complete, rows], separators=(',', ':')),
+                     time=SNAPSHOT_TIME)
+    return version
+
+
+def _fetch(limit):
+    """Returns (name, rate) of users with the highest rates from the
+    datastore and True if these are all users. Users which are not ranked -
+    new users and the bot - are skipped as by the rank index, ranked is not
+    indexed so full entities are loaded."""
+    rows = []
+    for user in User.query().order(-User.rate).iter(batch_size=limit):
+        if user.ranked:
+            rows.append((user.name, user.rate))
+            if len(rows) == limit:
+                return rows, False
+    return rows, True
+
+
+def rebuild():
+    """Rebuilds the snapshot from the datastore
+    Returns: tuple of rows (name, rate, rank) and complete flag
+    """
+    rows, complete = _fetch(LEADERBOARD_SIZE)
+    rows = _ranked(rows)
+    _publish(rows, complete)
+    return rows, complete
+
+
+def get_leaderboard():
+    """Returns the snapshot, it is rebuilt on a miss
+    Returns: tuple of rows (name, rate, rank) and complete flag - True if
+        rows include all users
+    """
+    snapshot = _load()
+    if snapshot is None or not (snapshot[1] or snapshot[2]):
+        return rebuild()
+    return snapshot[1:]
+
+
+def update(users):
+    """Write-through of users with changed rates
+    Args:
+        users: User entities with new rates
+    """
+    snapshot = _load()
+    if snapshot is None:
+        rebuild()
+        return
+    version, rows, complete = snapshot
+    names = set(user.name for user in users)
+    rows = [(name, rate) for name, rate, rank in rows if name not in names]
+    # All users with a higher rate than the last row are in the snapshot
+    lowest = rows[-1][1] if rows else None
+    users = [user for user in users if user.ranked]
+    for user in users:
+        if complete or (lowest is not None and user.rate >= lowest):
+            rows.append((user.name, user.rate))
+    if not complete and len(rows) < LEADERBOARD_SIZE:
+        # Users who dropped below the last row are replaced by the next
+        # ones from the datastore, the changed users are taken as given
+        # since the query can miss their latest rates
+        rows, complete = _fetch(LEADERBOARD_SIZE + len(users))
+        rows = [(name, rate) for name, rate in rows if name not in names]
+        rows.extend((user.name, user.rate) for user in users)
+    rows = _ranked(rows)
+    if len(rows) > LEADERBOARD_SIZE:
+        rows = rows[:LEADERBOARD_SIZE]
+        complete = False
+    if _publish(rows, complete) != version + 1:
+        # Another snapshot was published meanwhile
+        rebuild()
+
+
+def get_offset(cursor):
+    """Returns the offset of the leaderboard cursor, 0 for the first page or
+    None for a datastore cursor
+    Raises:
+        endpoints.BadRequestException: If the cursor String is malformed."""
+    if not cursor:
+        return 0
+    if not cursor.startswith(CURSOR_PREFIX):
+        return None
+    try:
+        offset = int(cursor[len(CURSOR_PREFIX):])
+    except ValueError:
+        raise endpoints.BadRequestException('Invalid Cursor')
+    if offset < 0:
+        raise endpoints.BadRequestException('Invalid Cursor')
+    return offset
+
+
+def get_page(offset, page_size):
+    """Returns one page of the snapshot
+    Args:
+        offset: index of the first row
+        page_size: number of rows
+    Returns: tuple of rows (name, rate, rank) and the leaderboard cursor of
+        the next page or None, or None if the page is not in the snapshot
+    """
+    rows, complete = get_leaderboard()
+    end = offset + page_size
+    if end > len(rows) and not complete:
+        return None
+    if end < len(rows) or not complete:
+        return rows[offset:end], CURSOR_PREFIX + str(end)
+    return rows[offset:end], None
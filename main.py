@@ -3,40 +3,301 @@
 """main.py - This file contains handlers that are called by taskqueue and/or
 cronjobs."""
 
+import datetime
+import logging
 import webapp2
-from google.appengine.api import mail, app_identity
+from google.appengine.api import mail, app_identity, memcache, taskqueue
+from google.appengine.datastore.datastore_query import Cursor
 from api import tictactoegame
-from models import Game
 from google.appengine.ext import ndb
-from models import User
+from models import rebuild_rank_index, migrate_histories
+from models import refresh_dirty_rates
+from models import ActiveGames, backfill_active_games, migrate_user_names
+from utils import add_named_tasks
+import archive
+import leaderboard
+import matchmaking
+import openings
+import stats
+import tournament
+
+REMINDER_PAGE_SIZE = 1000
+REMINDER_PAGES_PER_TASK = 10
+REMINDER_BATCH_SIZE = 100
+MEMCACHE_REMINDED = 'REMINDED:%s:%s'
 
 
 class SendReminderEmail(webapp2.RequestHandler):
+    @stats.instrument('/crons/send_reminder')
     def get(self):
         """Send a reminder email to each User with an email about games.
-         Called every day using a cron job"""
+         Called every day using a cron job. Starts the scan of players with
+         active games, emails are sent by ReminderScan and ReminderMail
+         tasks"""
+        run = datetime.date.today().isoformat()
+        add_named_tasks([taskqueue.Task(url='/tasks/reminder_scan',
+                                        name='reminder-scan-%s-0' % (run,),
+                                        params={'run': run, 'step': 0})])
+
+
+class ReminderScan(webapp2.RequestHandler):
+    @stats.instrument('/tasks/reminder_scan')
+    def post(self):
+        """Collect players with active games from pages of their ActiveGames
+        keys and add ReminderMail tasks for batches of players. The next
+        pages are scanned by the next task from the cursor, so a failed task
+        is retried from its own cursor."""
+        run = self.request.get('run')
+        step = int(self.request.get('step'))
+        cursor = self.request.get('cursor')
+        cursor = Cursor(urlsafe=cursor) if cursor else None
+        query = ActiveGames.query(ActiveGames.count > 0)
+        user_keys = set()
+        more = True
+        for _ in range(REMINDER_PAGES_PER_TASK):
+            keys, cursor, more = query.fetch_page(
+                REMINDER_PAGE_SIZE, start_cursor=cursor, keys_only=True)
+            user_keys.update(ActiveGames.user_key(key) for key in keys)
+            if not more or not cursor:
+                break
+
+        user_keys = [key.urlsafe() for key in user_keys]
+        tasks = [taskqueue.Task(
+            url='/tasks/reminder_mail',
+            name='reminder-mail-%s-%d-%d' % (run, step, start),
+            params={'run': run,
+                    'users': user_keys[start:start + REMINDER_BATCH_SIZE]})
+            for start in range(0, len(user_keys), REMINDER_BATCH_SIZE)]
+        if more and cursor:
+            tasks.append(taskqueue.Task(
+                url='/tasks/reminder_scan',
+                name='reminder-scan-%s-%d' % (run, step + 1),
+                params={'run': run, 'step': step + 1,
+                        'cursor': cursor.urlsafe()}))
+        add_named_tasks(tasks)
+
+
+class ReminderMail(webapp2.RequestHandler):
+    @stats.instrument('/tasks/reminder_mail')
+    def post(self):
+        """Send a reminder email to a batch of players. Players are marked in
+        memcache, so they get one email per run even if they are found by
+        several scan tasks or the task is retried."""
         app_id = app_identity.get_application_id()
         subject = 'This is a reminder!'
-        users = User.query(User.email != None)
-        for user in users:
-            active_games = Game.query(Game.game_over == False).\
-            filter(ndb.OR(Game.user_x == user.key, Game.user_o == user.key))\
-                .count()
-            if active_games != 0:
-                body = 'Hello {}, you have incomplete game!'.format(user.name)
-                # This will send test emails, the arguments to send_mail are:
-                # from, to, subject, body
-                mail.send_mail('noreply@{}.appspotmail.com'.format(app_id),
-                               user.email, subject, body)
+        run = self.request.get('run')
+        urlsafe_keys = self.request.get_all('users')
+        reminded = memcache.get_multi(
+            [MEMCACHE_REMINDED % (run, key) for key in urlsafe_keys])
+        users = ndb.get_multi([ndb.Key(urlsafe=key) for key in urlsafe_keys])
+        for urlsafe_key, user in zip(urlsafe_keys, users):
+            memcache_key = MEMCACHE_REMINDED % (run, urlsafe_key)
+            if not user or not user.email or memcache_key in reminded:
+                continue
+            body = 'Hello {}, you have incomplete game!'.format(user.name)
+            # This will send test emails, the arguments to send_mail are:
+            # from, to, subject, body
+            mail.send_mail('noreply@{}.appspotmail.com'.format(app_id),
+                           user.email, subject, body)
+            memcache.set(memcache_key, 1, time=24 * 60 * 60)
 
 
 class UpdateCurrentLeader(webapp2.RequestHandler):
+    @stats.instrument('/tasks/_cache_current_leader')
     def post(self):
         """Update game announcement in memcache."""
         tictactoegame._cache_current_leader()
         self.response.set_status(204)
 
 
+class RefreshRates(webapp2.RequestHandler):
+    def get(self):
+        """Refresh rates left by a missed window. Called every minute using
+        a cron job."""
+        self.post()
+
+    @stats.instrument('/tasks/refresh_rates', sample_rate=1)
+    def post(self):
+        """Save rates of all users whose statistic changed in the window
+        from their statistic shards and update ranks and the leaderboard
+        once. users of tasks added before pull tasks are refreshed too."""
+        user_keys = [ndb.Key(urlsafe=key)
+                     for key in self.request.get_all('users')]
+        changed, coalesced, more = refresh_dirty_rates(user_keys)
+        if changed:
+            leaderboard.update(changed)
+        stats.count('coalesced', coalesced)
+        stats.count('changed', len(changed))
+        logging.info('Rates refreshed: %d updates coalesced, %d changed',
+                     coalesced, len(changed))
+        if more:
+            taskqueue.add(url='/tasks/refresh_rates')
+        self.response.set_status(204)
+
+
+class RebuildRankIndex(webapp2.RequestHandler):
+    def get(self):
+        """Start recounting rate buckets used for ranks from all users."""
+        self.post()
+
+    @stats.instrument('/tasks/rebuild_rank_index')
+    def post(self):
+        """Recount rate buckets from one page of users, the next page is
+        counted by the next task. The leaderboard is rebuilt after the last
+        page."""
+        cursor = rebuild_rank_index(self.request.get('cursor') or None)
+        if cursor:
+            taskqueue.add(url='/tasks/rebuild_rank_index',
+                          params={'cursor': cursor})
+        else:
+            tictactoegame._cache_current_leader()
+        self.response.set_status(204)
+
+
+class MigrateHistories(webapp2.RequestHandler):
+    def get(self):
+        """Start packing JSON moves of histories into histories keyed by the
+        game."""
+        self.post()
+
+    @stats.instrument('/tasks/migrate_histories')
+    def post(self):
+        """Pack one page of histories, the next page is migrated by the
+        next task."""
+        cursor = migrate_histories(self.request.get('cursor') or None)
+        if cursor:
+            taskqueue.add(url='/tasks/migrate_histories',
+                          params={'cursor': cursor})
+        self.response.set_status(204)
+
+
+class BackfillActiveGames(webapp2.RequestHandler):
+    def get(self):
+        """Start adding active games saved before ActiveGames to indices of
+        their players."""
+        self.post()
+
+    @stats.instrument('/tasks/backfill_active_games')
+    def post(self):
+        """Add one page of active games to indices of their players, the
+        next page is added by the next task."""
+        cursor = backfill_active_games(self.request.get('cursor') or None)
+        if cursor:
+            taskqueue.add(url='/tasks/backfill_active_games',
+                          params={'cursor': cursor})
+        self.response.set_status(204)
+
+
+class MigrateUserNames(webapp2.RequestHandler):
+    def get(self):
+        """Start adding UserName for users saved before users were keyed by
+        name."""
+        self.post()
+
+    @stats.instrument('/tasks/migrate_user_names')
+    def post(self):
+        """Add UserName for one page of users, the next page is migrated by
+        the next task."""
+        cursor = migrate_user_names(self.request.get('cursor') or None)
+        if cursor:
+            taskqueue.add(url='/tasks/migrate_user_names',
+                          params={'cursor': cursor})
+        self.response.set_status(204)
+
+
+class ArchiveGames(webapp2.RequestHandler):
+    def get(self):
+        """Start archiving finished games older than ARCHIVE_AFTER_DAYS."""
+        self.post()
+
+    @stats.instrument('/tasks/archive_games')
+    def post(self):
+        """Archive one batch of finished games into a segment and delete
+        them, the next batch is archived by the next task."""
+        archived, cursor = archive.archive_games(
+            self.request.get('cursor') or None)
+        stats.count('archived', archived)
+        logging.info('Archived %d games', archived)
+        if cursor:
+            taskqueue.add(url='/tasks/archive_games',
+                          params={'cursor': cursor})
+        self.response.set_status(204)
+
+
+class CleanMatchRequests(webapp2.RequestHandler):
+    def get(self):
+        """Start deleting match requests older than MATCH_TIME. Called every
+        hour using a cron job."""
+        self.post()
+
+    @stats.instrument('/tasks/clean_match_requests')
+    def post(self):
+        """Delete old match requests of one page, the next page is cleaned
+        by the next task."""
+        deleted, cursor = matchmaking.clean_requests(
+            self.request.get('cursor') or None)
+        logging.info('Deleted %d match requests', deleted)
+        if cursor:
+            taskqueue.add(url='/tasks/clean_match_requests',
+                          params={'cursor': cursor})
+        self.response.set_status(204)
+
+
+class RefreshBook(webapp2.RequestHandler):
+    def get(self):
+        """Add games left by a missed window to the opening book. Called
+        every minute using a cron job."""
+        self.post()
+
+    @stats.instrument('/tasks/refresh_book', sample_rate=1)
+    def post(self):
+        """Replay games finished in the window into the opening book,
+        every position is saved once."""
+        games, positions, more = openings.refresh_book()
+        stats.count('games', games)
+        stats.count('positions', positions)
+        logging.info('Opening book refreshed: %d games, %d positions',
+                     games, positions)
+        if more:
+            taskqueue.add(url='/tasks/refresh_book')
+        self.response.set_status(204)
+
+
+class TournamentGames(webapp2.RequestHandler):
+    @stats.instrument('/tasks/tournament_games')
+    def post(self):
+        """Create a batch of games of the scheduled tournament block."""
+        found = ndb.Key(urlsafe=self.request.get('tournament')).get()
+        number = int(self.request.get('round'))
+        if found is not None and found.round == number:
+            start = int(self.request.get('start'))
+            tournament.create_games(found, start,
+                                    start + tournament.TOURNAMENT_BATCH_SIZE)
+        self.response.set_status(204)
+
+
+class TournamentRound(webapp2.RequestHandler):
+    @stats.instrument('/tasks/tournament_round')
+    def post(self):
+        """Start the next Swiss round if all games of the round are over."""
+        tournament.advance_round(
+            ndb.Key(urlsafe=self.request.get('tournament')),
+            int(self.request.get('round')))
+        self.response.set_status(204)
+
+
 app = webapp2.WSGIApplication([
     ('/crons/send_reminder', SendReminderEmail),
-    ('/tasks/_cache_current_leader', UpdateCurrentLeader),], debug=True)
+    ('/tasks/reminder_scan', ReminderScan),
+    ('/tasks/reminder_mail', ReminderMail),
+    ('/tasks/_cache_current_leader', UpdateCurrentLeader),
+    ('/tasks/refresh_rates', RefreshRates),
+    ('/tasks/rebuild_rank_index', RebuildRankIndex),
+    ('/tasks/migrate_histories', MigrateHistories),
+    ('/tasks/backfill_active_games', BackfillActiveGames),
+    ('/tasks/migrate_user_names', MigrateUserNames),
+    ('/tasks/archive_games', ArchiveGames),
+    ('/tasks/refresh_book', RefreshBook),
+    ('/tasks/tournament_games', TournamentGames),
+    ('/tasks/tournament_round', TournamentRound),
+    ('/tasks/clean_match_requests', CleanMatchRequests),], debug=True)
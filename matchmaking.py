@@ -0,0 +1,281 @@
+"""matchmaking.py - Queue of players waiting for a game.
+
+Waiting players are kept in memcache pools by rate - one pool per
+MATCH_BUCKET_WIDTH points, pools are changed by compare and set. The ticket
+of the player in memcache holds its state, so polling reads only memcache
+while the player waits. The player who joins or polls takes the waiting
+player with the closest rate, the search is widened by one pool every
+MATCH_WIDEN_SECONDS of waiting. Players who stopped polling are dropped from
+pools after MATCH_STALE_SECONDS.
+
+MatchRequest entities are the fallback: a ticket lost from memcache is
+restored from the request, and the game is created only if requests of both
+players are still waiting - in one transaction with its history, the
+requests and active games of players, so a player is never matched twice.
+The request is created in a transaction which keeps the game of a request
+matched meanwhile. It is deleted when its game is returned to the player,
+requests older than MATCH_TIME are deleted by /tasks/clean_match_requests.
+Pools searched for the opponent are read with one get_multi, only the pool
+with the closest waiting player is changed.
+"""
+import time
+
+from google.appengine.api import memcache
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+from models import Game, History, MatchRequest, ActiveGames
+
+MATCH_BUCKET_WIDTH = 10
+MATCH_WIDEN_SECONDS = 10
+MATCH_MAX_WIDEN = 10
+MATCH_STALE_SECONDS = 60
+MATCH_TIME = 60 * 60
+MATCH_RETRIES = 5
+MEMCACHE_POOL = 'MATCH_POOL:%d'
+MEMCACHE_TICKET = 'MATCH_TICKET:%s'
+CLEAN_PAGE_SIZE = 500
+
+
+def _bucket(rate):
+    return rate // MATCH_BUCKET_WIDTH
+
+
+def _ticket(request):
+    """Returns the memcache ticket of the MatchRequest"""
+    return {'name': request.key.id(),
+            'user': request.user.urlsafe(),
+            'rate': request.rate,
+            'joined': request.joined,
+            'game': request.game.urlsafe() if request.game else None,
+            'user_name_x': request.user_name_x,
+            'user_name_o': request.user_name_o,
+            'delivered': False}
+
+
+def _entry(ticket):
+    """Returns the pool entry (name, rate, user, seen) of the ticket"""
+    return ticket['name'], ticket['rate'], ticket['user'], time.time()
+
+
+def _update_pool(bucket, change, create=False):
+    """Changes the pool by compare and set
+    Args:
+        bucket: the rate bucket of the pool
+        change: function list of entries -> tuple of the new list or None
+            if it is not changed and the returned value
+        create: True if the missing pool is created
+    Returns: the value returned by change or None
+    """
+    client = memcache.Client()
+    key = MEMCACHE_POOL % bucket
+    for _ in range(MATCH_RETRIES):
+        pool = client.gets(key)
+        if pool is None:
+            if not create:
+                return None
+            client.add(key, [], time=MATCH_TIME)
+            continue
+        new_pool, value = change(pool)
+        if new_pool is None or client.cas(key, new_pool, time=MATCH_TIME):
+            return value
+    return None
+
+
+def _add(ticket):
+    """Adds the player to the pool of its rate"""
+    entry = _entry(ticket)
+
+    def change(pool):
+        return ([item for item in pool if item[0] != entry[0]] + [entry],
+                None)
+    _update_pool(_bucket(ticket['rate']), change, create=True)
+
+
+def _remove(ticket):
+    """Removes the player from the pool of its rate"""
+    def change(pool):
+        new_pool = [item for item in pool if item[0] != ticket['name']]
+        return (new_pool if len(new_pool) != len(pool) else None), None
+    _update_pool(_bucket(ticket['rate']), change)
+
+
+def _take(ticket, widen):
+    """Removes the waiting player with the closest rate from pools
+    Args:
+        ticket: the ticket of the player who looks for the opponent
+        widen: number of pools searched above and below the pool of the rate
+    Returns: the pool entry of the opponent or None
+    """
+    stale = time.time() - MATCH_STALE_SECONDS
+
+    def candidates(pool):
+        return [item for item in pool
+                if item[3] >= stale and item[0] != ticket['name']]
+
+    def change(pool):
+        new_pool = [item for item in pool if item[3] >= stale]
+        waiting = candidates(new_pool)
+        if not waiting:
+            return (new_pool if len(new_pool) != len(pool) else None), None
+        opponent = min(waiting,
+                       key=lambda item: abs(item[1] - ticket['rate']))
+        new_pool.remove(opponent)
+        return new_pool, opponent
+
+    bucket = _bucket(ticket['rate'])
+    buckets = []
+    for distance in range(widen + 1):
+        buckets.extend(sorted(set([bucket - distance, bucket + distance])))
+    # Pools without waiting players are not changed
+    pools = memcache.get_multi([MEMCACHE_POOL % candidate
+                                for candidate in buckets])
+    for candidate in buckets:
+        if candidates(pools.get(MEMCACHE_POOL % candidate) or []):
+            opponent = _update_pool(candidate, change)
+            if opponent is not None:
+                return opponent
+    return None
+
+
+@ndb.transactional(xg=True)
+def _create_game(game_key, waiting, joining):
+    """Creates the game if requests of both players are still waiting - the
+    waiting player plays X
+    Args:
+        game_key: the allocated key of the game
+        waiting, joining: pool entries of players
+    Returns: list of MatchRequest of both players, None for a missing one
+    """
+    requests = ndb.get_multi([MatchRequest.key_for(waiting[0]),
+                              MatchRequest.key_for(joining[0])])
+    if not all(requests) or any(request.game for request in requests):
+        return requests
+    game = Game.create(ndb.Key(urlsafe=waiting[2]),
+                       ndb.Key(urlsafe=joining[2]), key=game_key)
+    for request in requests:
+        request.game = game_key
+        request.user_name_x, request.user_name_o = waiting[0], joining[0]
+    ndb.put_multi([game, History(key=History.key_for(game_key))] + requests +
+                  ActiveGames.update(added=[game]))
+    return requests
+
+
+def _match(ticket, widen):
+    """Matches the player with a waiting player or puts it into its pool
+    Args:
+        ticket: the ticket of the waiting player
+        widen: number of pools searched above and below the pool of the rate
+    Returns: the ticket of the player
+    """
+    # The player is not in the pool while it looks for the opponent
+    _remove(ticket)
+    for _ in range(MATCH_RETRIES):
+        opponent = _take(ticket, widen)
+        if opponent is None:
+            break
+        requests = _create_game(Game.allocate_key(), opponent,
+                                _entry(ticket))
+        if requests[1] is not None and requests[1].game:
+            tickets = [_ticket(request) for request in requests if request]
+            memcache.set_multi(dict((MEMCACHE_TICKET % item['name'], item)
+                                    for item in tickets), time=MATCH_TIME)
+            return tickets[-1]
+        # The opponent was matched or left, it is not returned to the pool
+    _add(ticket)
+    return ticket
+
+
+@ndb.transactional
+def _insert_request(user):
+    """Creates the request of the user, the request which is waiting or
+    matched meanwhile is kept
+    Returns: the request"""
+    key = MatchRequest.key_for(user.name)
+    request = key.get()
+    if request is None:
+        request = MatchRequest(key=key, user=user.key, rate=user.rate,
+                               joined=time.time())
+        request.put()
+    return request
+
+
+@ndb.transactional
+def _delete_request(name, game_key):
+    """Deletes the request matched with the game"""
+    request = MatchRequest.key_for(name).get()
+    if request is not None and request.game == game_key:
+        request.key.delete()
+
+
+def _deliver(ticket):
+    """Deletes the request of the matched ticket returned to its player
+    Returns: the ticket"""
+    if ticket['game'] and not ticket.get('delivered'):
+        _delete_request(ticket['name'], ndb.Key(urlsafe=ticket['game']))
+        ticket = dict(ticket, delivered=True)
+        memcache.set(MEMCACHE_TICKET % ticket['name'], ticket,
+                     time=MATCH_TIME)
+    return ticket
+
+
+def join(user):
+    """Puts the user into the queue, the user is matched at once with the
+    waiting player of the closest rate if there is one
+    Args:
+        user: the User
+    Returns: the ticket - dict with game, user_name_x and user_name_o set if
+        the user is matched
+    """
+    ticket = memcache.get(MEMCACHE_TICKET % user.name)
+    if ticket is not None and not ticket['game']:
+        return ticket
+    request = _insert_request(user)
+    ticket = _ticket(request)
+    memcache.set(MEMCACHE_TICKET % user.name, ticket, time=MATCH_TIME)
+    if request.game:
+        return _deliver(ticket)
+    return _deliver(_match(ticket, 0))
+
+
+def poll(name):
+    """Returns the state of the player in the queue. The waiting player is
+    matched with the search widened by its waiting time. Only memcache is
+    read while the ticket is there.
+    Args:
+        name: name of the user
+    Returns: the ticket as of join or None if the user is not in the queue
+    """
+    ticket = memcache.get(MEMCACHE_TICKET % name)
+    if ticket is None:
+        request = MatchRequest.key_for(name).get()
+        if request is None:
+            return None
+        ticket = _ticket(request)
+        memcache.set(MEMCACHE_TICKET % name, ticket, time=MATCH_TIME)
+    if ticket['game']:
+        return _deliver(ticket)
+    widen = min(int(time.time() - ticket['joined']) // MATCH_WIDEN_SECONDS,
+                MATCH_MAX_WIDEN)
+    return _deliver(_match(ticket, widen))
+
+
+def clean_requests(urlsafe_cursor=None):
+    """ clean_requests: deletes requests of one page which joined more than
+    MATCH_TIME ago - players who left the queue or were not told of their
+    game
+    Args:
+        urlsafe_cursor: the cursor of the page or None for the first page
+    Returns: tuple of the number of deleted requests and the urlsafe cursor
+        of the next page or None
+    """
+    cursor = Cursor(urlsafe=urlsafe_cursor) if urlsafe_cursor else None
+    requests, next_cursor, more = MatchRequest.query().fetch_page(
+        CLEAN_PAGE_SIZE, start_cursor=cursor)
+    expired = time.time() - MATCH_TIME
+    keys = [request.key for request in requests
+            if (request.joined or 0) < expired]
+    ndb.delete_multi(keys)
+    if more and next_cursor:
+        return len(keys), next_cursor.urlsafe()
+    return len(keys), None
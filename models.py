@@ -1,19 +1,87 @@
 """models.py - This file contains the class definitions for the Datastore"""
 
+import collections
+import os
+import random
+import zlib
+
 from protorpc import messages
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
 from google.appengine.ext import ndb
 
+from engine import Board, SparseBoard, SYMBOLS
+from utils import LRUCache, add_window_task, delete_leased, lease_all
+import bot
+
+USER_NAMES_CACHE_SIZE = 10000
+# Number of StatisticShard entities per user, it can only be increased
+STATISTIC_SHARDS = 20
+MEMCACHE_STATISTIC = 'STATISTIC:'
+STATISTIC_CACHE_TIME = 60
+# Staleness bound of rates, ranks and the leaderboard
+RATE_REFRESH_SECONDS = int(os.environ.get('RATE_REFRESH_SECONDS', '10'))
+RATES_QUEUE = 'rates'
+RATES_LEASE_SECONDS = 60
+RATES_LEASE_SIZE = 1000
+RATES_LEASES_PER_RUN = 10
+# Users moved with one bucket, a transaction has at most 25 entity groups
+MOVES_PER_BUCKET = 24
+MEMCACHE_GAME_VERSION = 'GAME_VERSION:%s'
+GAME_VERSION_TIME = 60 * 60
+BACKFILL_PAGE_SIZE = 500
+USER_NAMES_MIGRATION = 'user_names'
+# Number of ActiveGames shards per user, it can not be changed - the shard
+# of a game is fixed by its key
+ACTIVE_GAMES_SHARDS = 8
+# Games read with the index shard in one transaction of add_active_games,
+# in the limit of entity groups
+ACTIVE_GAMES_BATCH_SIZE = 20
+BOOK_QUEUE = 'book'
+BOOK_REFRESH_SECONDS = 60
+BOOK_DEPTH = 9
+# Positions of larger boards rarely repeat, their games are not in the book
+BOOK_MAX_SIZE = 4
+# Version of the deleted game
+GAME_DELETED = -1
+ROUND_ROBIN = 'round_robin'
+SWISS = 'swiss'
+
 
 class User(ndb.Model):
-    """User profile"""
+    """User profile keyed by the name. win, loss and draw are the statistic
+    saved before StatisticShard, rate is refreshed from the aggregated
+    statistic. Users saved before with numeric IDs are found by UserName.
+    ranked is False until the new user is counted in its RateBucket by the
+    rates refresh. rate_from and rate_to keep the move between buckets saved
+    with the rate until the buckets are updated, so a failed refresh is
+    finished by the next one."""
     name = ndb.StringProperty(required=True)
     email = ndb.StringProperty()
     win = ndb.IntegerProperty(default=0)
     loss = ndb.IntegerProperty(default=0)
     draw = ndb.IntegerProperty(default=0)
-    rank = ndb.IntegerProperty()
-    rate = ndb.ComputedProperty(lambda self:
-                                2 * self.win + self.draw - self.loss)
+    rate = ndb.IntegerProperty(default=0)
+    ranked = ndb.BooleanProperty(default=True, indexed=False)
+    rate_from = ndb.IntegerProperty(indexed=False)
+    rate_to = ndb.IntegerProperty(indexed=False)
+
+    def moving(self):
+        """Returns True if the move between rate buckets is not finished"""
+        return self.rate_from is not None or self.rate_to is not None
+
+    @classmethod
+    def key_for(cls, name):
+        """Returns the key of the user with the name"""
+        return ndb.Key(cls, name)
+
+    def _post_put_hook(self, future):
+        _user_names.delete(self.key)
+
+    @classmethod
+    def _post_delete_hook(cls, key, future):
+        _user_names.delete(key)
 
     def user_to_form(self):
         form = UserForm()
@@ -21,143 +89,1116 @@ class User(ndb.Model):
         form.email = self.email
         return form
 
-    def statistic_to_form(self):
+    def statistic_to_form(self, rank, statistic):
         form = StatisticForm()
         form.name = self.name
-        form.win = self.win
-        form.loss = self.loss
-        form.draw = self.draw
-        form.rate = self.rate
-        form.rank = self.rank
+        form.win, form.loss, form.draw = statistic
+        form.rate = get_rate(*statistic)
+        form.rank = rank
         return form
 
-    def rate_to_form(self):
+    def rate_to_form(self, rank, live_rate=None):
         form = RatingForm()
         form.name = self.name
         form.rate = self.rate
-        form.rank = self.rank
+        form.rank = rank
+        form.live_rate = live_rate
         return form
 
 
+class UserName(ndb.Model):
+    """ UserName object - keyed by the name of the user saved before users
+    were keyed by name, it points to the user"""
+    user = ndb.KeyProperty(kind='User', required=True, indexed=False)
+
+
+class Migration(ndb.Model):
+    """ Migration object - keyed by the name of a finished migration of
+    saved entities. Until it exists, readers fall back to the entities
+    which are not migrated yet."""
+    date = ndb.DateTimeProperty(auto_now_add=True, indexed=False)
+
+
+_finished_migrations = set()
+
+
+@ndb.tasklet
+def is_migrated_async(name):
+    """ is_migrated_async: True if the migration is finished, a finished
+    migration is remembered by the instance
+    Returns: Future with True or False
+    """
+    if name not in _finished_migrations:
+        if (yield ndb.Key(Migration, name).get_async()) is None:
+            raise ndb.Return(False)
+        _finished_migrations.add(name)
+    raise ndb.Return(True)
+
+
+@ndb.tasklet
+def get_user_async(name):
+    """ get_user_async: the user with the name by key - the user keyed by
+    the name or the user of UserName. Users saved before are queried by the
+    name until migrate_user_names is finished.
+    Returns: Future with the User or None
+    """
+    if not name:
+        raise ndb.Return(None)
+    user, alias = yield ndb.get_multi_async([User.key_for(name),
+                                             ndb.Key(UserName, name)])
+    if user is None and alias is not None:
+        user = yield alias.user.get_async()
+    if (user is None and alias is None and
+            not (yield is_migrated_async(USER_NAMES_MIGRATION))):
+        user = yield User.query(User.name == name).get_async()
+    raise ndb.Return(user)
+
+
+def get_user(name):
+    """ get_user: the user with the name or None"""
+    return get_user_async(name).get_result()
+
+
+def insert_user(name, email=None):
+    """ insert_user: creates the user keyed by the name, the name is checked
+    in the same transaction. Until migrate_user_names is finished, names of
+    users saved before are checked by the query first - they are not
+    created any more and the query can not run in the transaction.
+    Returns: the new User or None if the name is already used
+    """
+    if (not is_migrated_async(USER_NAMES_MIGRATION).get_result() and
+            User.query(User.name == name).get(keys_only=True)):
+        return None
+    return _insert_user(name, email)
+
+
+@ndb.transactional(xg=True)
+def _insert_user(name, email):
+    """Creates the user keyed by the name if the name is not used. The user
+    is counted in the rate bucket by the rates refresh, so signups do not
+    contend for the bucket of rate 0
+    Returns: the new User or None
+    """
+    key = User.key_for(name)
+    if any(ndb.get_multi([key, ndb.Key(UserName, name)])):
+        return None
+    user = User(key=key, name=name, email=email, ranked=False)
+    user.put()
+    rates_changed([key])
+    return user
+
+
+@ndb.transactional(xg=True)
+def _add_user_name(user_key, name):
+    """Saves UserName of the user, the first user with the name wins"""
+    key = ndb.Key(UserName, name)
+    if not any(ndb.get_multi([key, User.key_for(name)])):
+        UserName(key=key, user=user_key).put()
+
+
+def migrate_user_names(urlsafe_cursor=None):
+    """ migrate_user_names: adds UserName for one page of users saved before
+    users were keyed by name, the migration is finished by the last page
+    Args:
+        urlsafe_cursor: the cursor of the page or None for the first page
+    Returns: the urlsafe cursor of the next page or None
+    """
+    cursor = Cursor(urlsafe=urlsafe_cursor) if urlsafe_cursor else None
+    users, next_cursor, more = User.query().fetch_page(
+        BACKFILL_PAGE_SIZE, start_cursor=cursor, projection=[User.name])
+    for user in users:
+        if user.key.id() != user.name:
+            _add_user_name(user.key, user.name)
+    if more and next_cursor:
+        return next_cursor.urlsafe()
+    Migration(key=ndb.Key(Migration, USER_NAMES_MIGRATION)).put()
+    return None
+
+
 class Game(ndb.Model):
-    """Game object"""
+    """Game object. The game with size is played on the large board - its
+    moves are packed in their order by SparseBoard and game_field is empty,
+    so the entity grows with the number of moves."""
     game_over = ndb.BooleanProperty(required=True, default=False)
     game_field = ndb.StringProperty(required=True, default="         ")
     user_x = ndb.KeyProperty(required=True, kind='User')
     user_o = ndb.KeyProperty(required=True, kind='User')
     date = ndb.DateTimeProperty(auto_now_add=True)
+    tournament = ndb.KeyProperty(kind='Tournament', indexed=False)
+    round = ndb.IntegerProperty(indexed=False)
+    size = ndb.IntegerProperty(indexed=False)
+    length = ndb.IntegerProperty(indexed=False)
+    packed_moves = ndb.BlobProperty(default='')
 
     @classmethod
-    def new_game(cls, user_x, user_o):
-        """Creates and returns a new game
+    def create(cls, user_x, user_o, **values):
+        """Returns a new game which is not saved yet
         Args:
             user_x: user who plays X
             user_o: user who plays O
+            values: other properties, e.g. key, tournament or size
         """
         if user_x == user_o:
             raise ValueError('Players should be different')
-        game = Game(user_x=user_x,
-                    user_o=user_o
-                    )
-        game.put()
+        if values.get('size'):
+            values.setdefault('game_field', '')
+        return cls(user_x=user_x, user_o=user_o, **values)
+
+    @classmethod
+    def allocate_key(cls):
+        """Returns a new key, so the game and its history can be saved
+        together"""
+        return ndb.Key(cls, cls.allocate_ids(1)[0])
+
+    @classmethod
+    def new_game(cls, user_x, user_o):
+        """Creates and returns a new game with its history
+        Args:
+            user_x: user who plays X
+            user_o: user who plays O
+        """
+        game = cls.create(user_x, user_o, key=cls.allocate_key())
+        save_new_game(game, History(key=History.key_for(game.key)))
         return game
 
-    def to_form(self, message):
+    def board(self):
+        """Returns the engine board for the current game field or moves"""
+        if self.size:
+            return SparseBoard.from_packed(self.size, self.length,
+                                           self.packed_moves)
+        return Board.from_field(self.game_field)
+
+    def set_board(self, board):
+        """Saves the board into the game field or packed moves, the game is
+        saved by caller"""
+        if board.SPARSE:
+            self.packed_moves = board.to_packed()
+        else:
+            self.game_field = board.to_field()
+
+    def moves_made(self):
+        """Returns the number of moves made in the game - its version"""
+        if self.size:
+            return len(self.packed_moves) // 2
+        return len(self.game_field) - self.game_field.count(' ')
+
+    def move_cells(self, history):
+        """Returns cells of moves of the game in their order
+        Args:
+            history: the History of the game or None, moves of the classic
+                board are kept only by the history
+        """
+        board = self.board()
+        if board.SPARSE:
+            return list(board.order)
+        cells = []
+        if history is not None:
+            # Draw games have an extra JSON record without the player
+            for move in history.moves:
+                if move.get('Player'):
+                    row, col = [int(coord) for coord in move['Move'].split()]
+                    cells.append(row * board.size + col)
+            cells.extend(byte & History.CELL
+                         for byte in bytearray(history.packed_moves))
+        return cells
+
+    def to_form(self, message, names=None):
         """Returns a GameForm representation of the Game
         Args:
             message: returns current state
+            names: dict user key -> name, resolved if not given
         """
+        if names is None:
+            names = get_user_names([self.user_x, self.user_o])
         form = GameForm()
         form.urlsafe_key = self.key.urlsafe()
-        form.user_name_x = self.user_x.get().name
-        form.user_name_o = self.user_o.get().name
+        form.user_name_x = names[self.user_x]
+        form.user_name_o = names[self.user_o]
         form.game_over = self.game_over
         form.date = self.date.strftime("%Y-%m-%d %H:%M:%S")
         form.message = message
+        form.size = self.size
+        form.length = self.length
         return form
 
-    def end_game(self, user_winner, user_loser):
-        """Ends the game - win/loss
+    @classmethod
+    def to_forms(cls, games, message):
+        """Returns GameForm representations of the Games, names of all
+        players are resolved at once
+        Args:
+            games: iterable of Games
+            message: returns current state
+        """
+        games = list(games)
+        names = get_user_names([key for game in games
+                                for key in (game.user_x, game.user_o)])
+        return [game.to_form(message, names) for game in games]
+
+    def end_game(self, user_winner, user_loser, history=None):
+        """Ends the game - win/loss. The game and shards are saved by caller.
         Args:
-            user_winner: winner of the game
-            user_loser: loser of the game
+            user_winner: key of the winner of the game
+            user_loser: key of the loser of the game
+            history: the History of the game, its moves are added to the
+                opening book
+        Returns: list of StatisticShard, TournamentStanding and ActiveGames
+            entities to be saved
         """
         self.game_over = True
-        self.put()
-        update_statistic(user_winner, user_loser)
+        rates_changed([user_winner, user_loser])
+        if history is not None:
+            opening_played(self, history,
+                           'x' if user_winner == self.user_x else 'o')
+        return (update_statistic(user_winner, user_loser) +
+                TournamentStanding.record(self, user_winner) +
+                ActiveGames.update(removed=[self]))
 
-    def end_game_draw(self, user1, user2):
-        """Ends the game - draw
+    def end_game_draw(self, user1, user2, history=None):
+        """Ends the game - draw. The game and shards are saved by caller.
         Args:
-            user1, user2: players of the game
+            user1, user2: keys of players of the game
+            history: the History of the game, its moves are added to the
+                opening book
+        Returns: list of StatisticShard, TournamentStanding and ActiveGames
+            entities to be saved
             """
         self.game_over = True
-        self.put()
-        update_statistic_draw(user1, user2)
+        rates_changed([user1, user2])
+        if history is not None:
+            opening_played(self, history, 'draw')
+        return (update_statistic_draw(user1, user2) +
+                TournamentStanding.record(self, None) +
+                ActiveGames.update(removed=[self]))
+
+
+class ActiveGames(ndb.Model):
+    """ ActiveGames object - one of ACTIVE_GAMES_SHARDS shards of keys of
+    active games of the user in the order of creation. The shard of a game
+    is fixed by its key and it is changed in the same transaction as the
+    game, so active games of the user are read by key instead of the query,
+    and games of the same user contend for one shard only. The computer
+    player has no index - it plays too many games."""
+    games = ndb.KeyProperty(kind='Game', repeated=True, indexed=False)
+    count = ndb.IntegerProperty(default=0)
+
+    @classmethod
+    def key_for(cls, user_key, shard):
+        """Returns the key of the shard of the index of the user"""
+        return ndb.Key(cls, '%s:%d' % (user_key.urlsafe(), shard))
+
+    @classmethod
+    def keys_for(cls, user_key):
+        """Returns keys of all shards of the index of the user"""
+        return [cls.key_for(user_key, shard)
+                for shard in range(ACTIVE_GAMES_SHARDS)]
+
+    @classmethod
+    def shard_key(cls, user_key, game_key):
+        """Returns the key of the shard with the game"""
+        return cls.key_for(user_key, zlib.crc32(str(game_key.id())) %
+                           ACTIVE_GAMES_SHARDS)
+
+    @classmethod
+    def user_key(cls, key):
+        """Returns the key of the user of the index shard"""
+        return ndb.Key(urlsafe=key.id().rsplit(':', 1)[0])
+
+    @classmethod
+    def update(cls, added=(), removed=()):
+        """ Adds and removes games in indices of their players, they are
+        saved by caller
+        Args:
+            added: new games
+            removed: games which are over or deleted
+        Returns: list of changed ActiveGames entities
+        """
+        bot_key = User.key_for(bot.BOT_NAME)
+        changes = collections.defaultdict(lambda: ([], []))
+        for games, change in ((added, 0), (removed, 1)):
+            for game in games:
+                for user_key in set([game.user_x, game.user_o]) - set(
+                        [bot_key]):
+                    changes[cls.shard_key(user_key, game.key)][change].append(
+                        game.key)
+        keys = list(changes)
+        indices = []
+        for key, index in zip(keys, ndb.get_multi(keys)):
+            index = index or cls(key=key)
+            added_keys, removed_keys = changes[key]
+            index.games.extend(game_key for game_key in added_keys
+                               if game_key not in index.games)
+            index.games = [game_key for game_key in index.games
+                           if game_key not in removed_keys]
+            index.count = len(index.games)
+            indices.append(index)
+        return indices
+
+    @classmethod
+    @ndb.transactional_tasklet(xg=True)
+    def add_async(cls, key, game_keys):
+        """Adds games which are not over to the index shard in a
+        transaction. A game which ends later removes itself in its own
+        transaction.
+        Args:
+            key: key of the index shard
+            game_keys: keys of games of the shard, at most
+                ACTIVE_GAMES_BATCH_SIZE entity groups
+        """
+        entities = yield [key.get_async()] + ndb.get_multi_async(game_keys)
+        index = entities[0] or cls(key=key)
+        added = [game.key for game in entities[1:]
+                 if game is not None and not game.game_over and
+                 game.key not in index.games]
+        if added:
+            index.games.extend(added)
+            index.count = len(index.games)
+            yield index.put_async()
+
+
+def add_active_games(games):
+    """ add_active_games: adds games to indices of their players. Games are
+    read again with the index shard in one transaction per batch, so a game
+    which is over is not added. All batches run in parallel.
+    Args:
+        games: games with their players
+    """
+    bot_key = User.key_for(bot.BOT_NAME)
+    game_keys = collections.defaultdict(list)
+    for game in games:
+        for user_key in set([game.user_x, game.user_o]) - set([bot_key]):
+            game_keys[ActiveGames.shard_key(user_key, game.key)].append(
+                game.key)
+    futures = [ActiveGames.add_async(key, keys[start:start +
+                                               ACTIVE_GAMES_BATCH_SIZE])
+               for key, keys in game_keys.items()
+               for start in range(0, len(keys), ACTIVE_GAMES_BATCH_SIZE)]
+    for future in futures:
+        future.check_success()
+
+
+def backfill_active_games(urlsafe_cursor=None):
+    """ backfill_active_games: adds one page of active games saved before
+    ActiveGames to indices of their players, games which are over by the
+    time they are added are skipped
+    Args:
+        urlsafe_cursor: the cursor of the page or None for the first page
+    Returns: the urlsafe cursor of the next page or None
+    """
+    cursor = Cursor(urlsafe=urlsafe_cursor) if urlsafe_cursor else None
+    games, next_cursor, more = Game.query(Game.game_over == False).fetch_page(
+        BACKFILL_PAGE_SIZE, start_cursor=cursor,
+        projection=[Game.user_x, Game.user_o])
+    add_active_games(games)
+    if more and next_cursor:
+        return next_cursor.urlsafe()
+    return None
+
+
+@ndb.transactional(xg=True)
+def save_new_game(game, history):
+    """ save_new_game: saves the new game, its history and indices of active
+    games of its players in one transaction
+    Args:
+        game: the game with the allocated key
+        history: the history of the game
+    """
+    ndb.put_multi([game, history] + ActiveGames.update(added=[game]))
+
+
+def set_game_versions(games):
+    """ set_game_versions: saves versions of changed games in memcache,
+    waiting clients read the game only when its version changes
+    Args:
+        games: changed games
+    """
+    memcache.set_multi(dict((MEMCACHE_GAME_VERSION % game.key.urlsafe(),
+                             game.moves_made()) for game in games),
+                       time=GAME_VERSION_TIME)
+
+
+def delete_game_version(game_key):
+    """ delete_game_version: marks the game as deleted for waiting clients"""
+    memcache.set(MEMCACHE_GAME_VERSION % game_key.urlsafe(), GAME_DELETED,
+                 time=GAME_VERSION_TIME)
+
+
+def get_game_version(game_key, refresh=False):
+    """ get_game_version: the number of moves made in the game from memcache,
+    on a miss the game is read and its version is added to memcache
+    Args:
+        game_key: key of the game
+        refresh: True to read the game and save its version - a version
+            which was not saved after a move stays stale in memcache
+    Returns: the version or GAME_DELETED if the game does not exist
+    """
+    memcache_key = MEMCACHE_GAME_VERSION % game_key.urlsafe()
+    version = None if refresh else memcache.get(memcache_key)
+    if version is None:
+        game = game_key.get()
+        version = game.moves_made() if game else GAME_DELETED
+        if refresh:
+            memcache.set(memcache_key, version, time=GAME_VERSION_TIME)
+        else:
+            # A newer version saved meanwhile is not overwritten
+            memcache.add(memcache_key, version, time=GAME_VERSION_TIME)
+    return version
+
+
+class ArchiveSegment(ndb.Model):
+    """ ArchiveSegment object - finished games with their histories archived
+    by one batch, keyed by the digest of IDs of the games. data is JSON
+    records, one per line, compressed with zlib. A retried batch of the
+    same games saves the same segment again. A game is in the segment its
+    ArchivedGame points to, the other records of a failed batch are left
+    over."""
+    data = ndb.BlobProperty(required=True)
+    count = ndb.IntegerProperty(indexed=False)
+    date = ndb.DateTimeProperty(auto_now_add=True)
+
+
+class ArchivedGame(ndb.Model):
+    """ ArchivedGame object - index of the archived game keyed by the ID of
+    the game: its segment and the offset and length of its record in the
+    decompressed data"""
+    segment = ndb.StringProperty(required=True, indexed=False)
+    offset = ndb.IntegerProperty(required=True, indexed=False)
+    length = ndb.IntegerProperty(required=True, indexed=False)
+
+    @classmethod
+    def key_for(cls, game_key):
+        """Returns the key of the index of the archived game"""
+        return ndb.Key(cls, game_key.id())
+
+
+class MatchRequest(ndb.Model):
+    """ MatchRequest object - the player in the matchmaking queue, keyed by
+    the name. game and names of its players are set when the player is
+    matched, the request is deleted when the player gets the game. joined is
+    the time in seconds since the epoch."""
+    user = ndb.KeyProperty(required=True, kind='User', indexed=False)
+    rate = ndb.IntegerProperty(default=0, indexed=False)
+    joined = ndb.FloatProperty(indexed=False)
+    game = ndb.KeyProperty(kind='Game', indexed=False)
+    user_name_x = ndb.StringProperty(indexed=False)
+    user_name_o = ndb.StringProperty(indexed=False)
+
+    @classmethod
+    def key_for(cls, name):
+        """Returns the key of the request of the user with the name"""
+        return ndb.Key(cls, name)
+
+
+class PositionStat(ndb.Model):
+    """ PositionStat object - results of finished games which passed
+    through the position, keyed by the canonical position (see
+    openings.position_id). moves is the results by the next move made in
+    the position: cell of the canonical board -> [wins_x, wins_o, draws]"""
+    wins_x = ndb.IntegerProperty(default=0, indexed=False)
+    wins_o = ndb.IntegerProperty(default=0, indexed=False)
+    draws = ndb.IntegerProperty(default=0, indexed=False)
+    moves = ndb.JsonProperty()
 
 
 class History(ndb.Model):
-    """ History object - saves all moves for each game  """
-    game = ndb.KeyProperty(required=True, kind='Game')
+    """ History object - saves all moves for each game. It is the child of
+    its Game, so it is fetched by key. Every move is packed into one byte:
+    index of the cell and O_MOVE flag for the moves of 'o'.
+    game and moves hold histories saved before with JSON moves."""
+    game = ndb.KeyProperty(kind='Game')
     moves = ndb.JsonProperty(repeated=True)
+    packed_moves = ndb.BlobProperty(default='')
+
+    O_MOVE = 0x80
+    CELL = 0x7f
+
+    @classmethod
+    def key_for(cls, game_key):
+        """Returns the key of the history of the game"""
+        return ndb.Key(cls, 1, parent=game_key)
+
+    @classmethod
+    def get_for_game(cls, game_key):
+        """Returns the history of the game, including not migrated ones"""
+        return (cls.key_for(game_key).get() or
+                cls.query(cls.game == game_key).get())
 
-    def to_form(self):
+    def to_form(self, game):
+        """Returns a HistoryForm representation of the History
+        Args:
+            game: the game of the history
+        """
+        names = get_user_names([game.user_x, game.user_o])
         form = HistoryForm()
-        form.moves = str(self.moves)
+        form.moves = str(list(self.iter_moves(game, names)))
         return form
 
-    def update_history(self, msg, player, row, col):
-        """ Updates history of the game
+    @classmethod
+    def pack_move(cls, symbol, cell):
+        """Returns the move packed into one byte"""
+        if cell > cls.CELL:
+            raise ValueError('The cell cannot be packed into one byte')
+        return chr(cell | cls.O_MOVE if symbol == 'o' else cell)
+
+    def update_history(self, symbol, cell):
+        """ Updates history of the game, it is saved by caller
         Args:
-            msg: game state
-            player: current player
-            row, col: coordinates of cell in grid
+            symbol: x or o - current player
+            cell: index of the cell in the game field
         Returns:
         """
-        self.moves.append(
-            {'Game state': msg, 'Player': player, 'Move': '%d %d' % (row,col)})
-        self.put()
+        self.packed_moves += self.pack_move(symbol, cell)
+
+    def iter_moves(self, game, names):
+        """ Decodes moves
+        Args:
+            game: the game of the history
+            names: dict user key -> name for players of the game
+        Returns: generator of dicts
+            {'Game state': <msg>, 'Player': <player>, 'Move': <row col>}
+        """
+        if game.size:
+            for move in self._iter_sparse_moves(game, names):
+                yield move
+            return
+        for move in self.moves:
+            yield move
+        packed = bytearray(self.packed_moves)
+        # The game field after each move is the current field without
+        # the cells of later moves
+        field = list(game.game_field)
+        fields = []
+        for byte in reversed(packed):
+            fields.append(''.join(field))
+            field[byte & self.CELL] = ' '
+        fields.reverse()
+
+        size = game.board().size
+        for index, byte in enumerate(packed):
+            symbol = 'o' if byte & self.O_MOVE else 'x'
+            player = names[game.user_o if symbol == 'o' else game.user_x]
+            row, col = divmod(byte & self.CELL, size)
+            move = '%d %d' % (row, col)
+            msg = 'Game_field is %s' % (fields[index],)
+            if game.game_over and index == len(packed) - 1:
+                board = Board.from_field(fields[index])
+                if board.is_winner(symbol, row, col):
+                    msg = 'Game is over! Winner-%s' % (player,)
+                else:
+                    yield {'Game state': msg, 'Player': player, 'Move': move}
+                    msg, player = 'Game is over! Draw game!', ''
+            yield {'Game state': msg, 'Player': player, 'Move': move}
+
+    @staticmethod
+    def _iter_sparse_moves(game, names):
+        """ Decodes moves of the large board, they are kept by the game"""
+        board = game.board()
+        for index, cell in enumerate(board.order):
+            symbol = SYMBOLS[index % 2]
+            player = names[game.user_o if symbol == 'o' else game.user_x]
+            row, col = divmod(cell, board.size)
+            move = '%d %d' % (row, col)
+            msg = 'Moves made: %d' % (index + 1,)
+            if game.game_over and index == len(board.order) - 1:
+                if board.is_winner(symbol, row, col):
+                    msg = 'Game is over! Winner-%s' % (player,)
+                else:
+                    yield {'Game state': msg, 'Player': player, 'Move': move}
+                    msg, player = 'Game is over! Draw game!', ''
+            yield {'Game state': msg, 'Player': player, 'Move': move}
+
+
+_user_names = LRUCache(USER_NAMES_CACHE_SIZE)
+
+
+@ndb.non_transactional
+def get_user_names(user_keys):
+    """ get_user_names: names of users, the names missing in the
+    in-process cache are fetched with one get_multi
+    Args:
+        user_keys: keys of users
+    Returns: dict user key -> name
+    """
+    names = {}
+    missing = []
+    for key in set(user_keys):
+        name = _user_names.get(key)
+        if name is None:
+            missing.append(key)
+        else:
+            names[key] = name
+    for key, user in zip(missing, ndb.get_multi(missing)):
+        if user is not None:
+            _user_names.set(key, user.name)
+            names[key] = user.name
+    return names
+
+
+@ndb.transactional(xg=True)
+def _migrate_history(legacy_key):
+    """Packs JSON moves of one history into the history keyed by its game"""
+    legacy = legacy_key.get()
+    game = legacy.game.get() if legacy else None
+    if game is None:
+        return
+    history = (History.key_for(game.key).get() or
+               History(key=History.key_for(game.key)))
+    size = game.board().size
+    # Draw games have an extra record without the player
+    moves = [move for move in legacy.moves if move.get('Player')]
+    packed = ''
+    for index, move in enumerate(moves):
+        row, col = [int(coord) for coord in move['Move'].split()]
+        packed += History.pack_move('x' if index % 2 == 0 else 'o',
+                                    row * size + col)
+    history.packed_moves = packed + history.packed_moves
+    history.put()
+    legacy_key.delete()
+
+
+def migrate_histories(urlsafe_cursor=None):
+    """ migrate_histories: converts one page of histories saved with JSON
+    moves to histories keyed by the game with packed moves
+    Args:
+        urlsafe_cursor: the cursor of the page or None for the first page
+    Returns: the urlsafe cursor of the next page or None
+    """
+    cursor = Cursor(urlsafe=urlsafe_cursor) if urlsafe_cursor else None
+    # Cursors of the != query need the order by key
+    query = History.query(History.game != None).order(History.game,
+                                                      History.key)
+    legacy_keys, next_cursor, more = query.fetch_page(
+        BACKFILL_PAGE_SIZE, start_cursor=cursor, keys_only=True)
+    for legacy_key in legacy_keys:
+        _migrate_history(legacy_key)
+    if more and next_cursor:
+        return next_cursor.urlsafe()
+    return None
+
+
+class StatisticShard(ndb.Model):
+    """ StatisticShard object - part of wins, losses and draws of a user.
+    Every game updates a random shard, so games of the same user do not
+    contend for one entity. The statistic is the sum of all shards."""
+    win = ndb.IntegerProperty(default=0, indexed=False)
+    loss = ndb.IntegerProperty(default=0, indexed=False)
+    draw = ndb.IntegerProperty(default=0, indexed=False)
+
+    @classmethod
+    def key_for(cls, user_key, index):
+        """Returns the key of the shard of the user"""
+        return ndb.Key(cls, '%s:%d' % (user_key.urlsafe(), index))
+
+
+class RateBucket(ndb.Model):
+    """ RateBucket object - number of users who have the same rate.
+    Ranks are calculated from buckets, so a finished game touches only
+    the buckets of changed rates instead of every User."""
+    rate = ndb.IntegerProperty(required=True)
+    count = ndb.IntegerProperty(required=True, default=0)
+
+    @classmethod
+    def key_for(cls, rate):
+        """Returns the key of the bucket for the rate"""
+        return ndb.Key(cls, 'rate:%d' % rate)
+
+
+class Tournament(ndb.Model):
+    """ Tournament object - players in the order of seeding. Games of a
+    round-robin tournament are created at once, games of a Swiss round when
+    the previous round is over. IDs of games of every scheduled block are
+    allocated as one range, first_game_ids keeps the first ID of each.
+    pairings keeps indices of players (x, o, x, o ...) of the current Swiss
+    round."""
+    name = ndb.StringProperty(required=True)
+    format = ndb.StringProperty(required=True, choices=(ROUND_ROBIN, SWISS))
+    players = ndb.KeyProperty(kind='User', repeated=True, indexed=False)
+    rounds = ndb.IntegerProperty(required=True, indexed=False)
+    round = ndb.IntegerProperty(default=0, indexed=False)
+    first_game_ids = ndb.IntegerProperty(repeated=True, indexed=False)
+    pairings = ndb.IntegerProperty(repeated=True, indexed=False)
+    date = ndb.DateTimeProperty(auto_now_add=True)
+
+    def to_form(self, standings, names):
+        """Returns a TournamentForm representation of the Tournament
+        Args:
+            standings: TournamentStanding of every player
+            names: dict user key -> name
+        """
+        standings = sorted(standings, key=lambda standing: -standing.points)
+        form = TournamentForm()
+        form.urlsafe_key = self.key.urlsafe()
+        form.name = self.name
+        form.format = self.format
+        form.rounds = self.rounds
+        form.round = self.round
+        for index, standing in enumerate(standings):
+            if index and standing.points == standings[index - 1].points:
+                rank = form.standings[-1].rank
+            else:
+                rank = index + 1
+            form.standings.append(standing.to_form(names[standing.user],
+                                                   rank))
+        return form
+
+
+class TournamentStanding(ndb.Model):
+    """ TournamentStanding object - results of the player in the tournament,
+    updated when a game of the tournament is over. It is not the child of
+    the tournament, so games of different players do not contend for one
+    entity group. Win and bye is 2 points, draw is 1 point."""
+    tournament = ndb.KeyProperty(kind='Tournament', required=True,
+                                 indexed=False)
+    user = ndb.KeyProperty(kind='User', required=True, indexed=False)
+    win = ndb.IntegerProperty(default=0, indexed=False)
+    loss = ndb.IntegerProperty(default=0, indexed=False)
+    draw = ndb.IntegerProperty(default=0, indexed=False)
+    bye = ndb.IntegerProperty(default=0, indexed=False)
+    opponents = ndb.KeyProperty(kind='User', repeated=True, indexed=False)
+
+    @classmethod
+    def key_for(cls, tournament_key, user_key):
+        """Returns the key of the standing of the player"""
+        return ndb.Key(cls, '%d:%s' % (tournament_key.id(),
+                                       user_key.urlsafe()))
+
+    @property
+    def points(self):
+        return 2 * (self.win + self.bye) + self.draw
+
+    @classmethod
+    def record(cls, game, user_winner):
+        """Adds the result of the game to standings of its players, they are
+        saved by caller
+        Args:
+            game: the game which is over
+            user_winner: key of the winner or None for the draw
+        Returns: list of TournamentStanding entities, empty if the game is
+            not a tournament game
+        """
+        if game.tournament is None:
+            return []
+        players = (game.user_x, game.user_o)
+        keys = [cls.key_for(game.tournament, key) for key in players]
+        standings = [standing or cls(key=key, tournament=game.tournament,
+                                     user=user_key)
+                     for key, user_key, standing in
+                     zip(keys, players, ndb.get_multi(keys))]
+        for standing, opponent in zip(standings, reversed(players)):
+            if user_winner is None:
+                standing.draw += 1
+            elif standing.user == user_winner:
+                standing.win += 1
+            else:
+                standing.loss += 1
+            standing.opponents.append(opponent)
+        return standings
+
+    def to_form(self, name, rank):
+        form = StandingForm()
+        form.name = name
+        form.points = self.points
+        form.win = self.win
+        form.loss = self.loss
+        form.draw = self.draw
+        form.bye = self.bye
+        form.rank = rank
+        return form
+
+
+def get_rate(win, loss, draw):
+    """ get_rate: 2 points for each win, 1 point for each draw and
+    -1 point for each loss"""
+    return 2 * win + draw - loss
+
+
+def _get_random_shards(user_keys):
+    """Returns a random StatisticShard for every user, new shards are
+    created"""
+    keys = [StatisticShard.key_for(key, random.randrange(STATISTIC_SHARDS))
+            for key in user_keys]
+    return [shard or StatisticShard(key=key)
+            for key, shard in zip(keys, ndb.get_multi(keys))]
 
 
 def update_statistic(user_winner, user_loser):
     """
-    update_statistic:
+    update_statistic: shards are changed in place and saved by caller
         Args:
-        user_winner: who won
-        user_loser: who lost
+        user_winner: key of who won
+        user_loser: key of who lost
+    Returns: list of StatisticShard entities
     """
-    winner = User.query(User.name == user_winner.get().name).get()
+    winner, loser = _get_random_shards([user_winner, user_loser])
     winner.win += 1
-    winner.put()
-    loser = User.query(User.name == user_loser.get().name).get()
     loser.loss += 1
-    loser.put()
-    update_rating()
+    return [winner, loser]
 
 
 def update_statistic_draw(user1, user2):
     """
-    update_statistic_draw:
+    update_statistic_draw: shards are changed in place and saved by caller
     Args:
-        user1, user2 - draw game
+        user1, user2 - keys of draw game players
+    Returns: list of StatisticShard entities
     """
-    user = User.query(User.name == user1.get().name).get()
-    user.draw += 1
-    user.put()
-    user = User.query(User.name == user2.get().name).get()
-    user.draw += 1
+    shards = _get_random_shards([user1, user2])
+    for shard in shards:
+        shard.draw += 1
+    return shards
+
+
+def get_statistics(users, use_cache=True):
+    """ get_statistics: aggregated statistic of users - the statistic saved
+    in User and the sum of its shards. Sums of shards are cached in memcache
+    Args:
+        users: User entities
+        use_cache: False to read shards from the datastore
+    Returns: dict user key -> (win, loss, draw)
+    """
+    sums = {}
+    if use_cache:
+        sums = memcache.get_multi([user.key.urlsafe() for user in users],
+                                  key_prefix=MEMCACHE_STATISTIC)
+    missing = [user.key for user in users if user.key.urlsafe() not in sums]
+    if missing:
+        shards = ndb.get_multi([StatisticShard.key_for(key, index)
+                                for key in missing
+                                for index in range(STATISTIC_SHARDS)])
+        loaded = {}
+        for position, key in enumerate(missing):
+            user_shards = [shard for shard in
+                           shards[position * STATISTIC_SHARDS:
+                                  (position + 1) * STATISTIC_SHARDS]
+                           if shard is not None]
+            loaded[key.urlsafe()] = (sum(shard.win for shard in user_shards),
+                                     sum(shard.loss for shard in user_shards),
+                                     sum(shard.draw for shard in user_shards))
+        memcache.set_multi(loaded, key_prefix=MEMCACHE_STATISTIC,
+                           time=STATISTIC_CACHE_TIME)
+        sums.update(loaded)
+    statistics = {}
+    for user in users:
+        win, loss, draw = sums[user.key.urlsafe()]
+        statistics[user.key] = (user.win + win, user.loss + loss,
+                                user.draw + draw)
+    return statistics
+
+
+def statistic_changed(user_keys):
+    """ statistic_changed: clears cached statistic of users after the
+    commit of their game, rates are marked dirty by the game itself
+    Args:
+        user_keys: keys of users
+    """
+    memcache.delete_multi([key.urlsafe() for key in user_keys],
+                          key_prefix=MEMCACHE_STATISTIC)
+
+
+def rates_changed(user_keys):
+    """ rates_changed: marks rates of users dirty with a pull task in
+    RATES_QUEUE, the task is added with the transaction which changes their
+    statistic, so the mark is not lost if the request fails after the
+    commit. One named refresh task per RATE_REFRESH_SECONDS runs at the end
+    of the window and refreshes rates of all marked users at once
+    Args:
+        user_keys: keys of users
+    """
+    taskqueue.Queue(RATES_QUEUE).add(
+        taskqueue.Task(payload=' '.join(key.urlsafe() for key in user_keys),
+                       method='PULL'),
+        transactional=ndb.in_transaction())
+    add_window_task('/tasks/refresh_rates', 'rates', RATE_REFRESH_SECONDS)
+
+
+def opening_played(game, history, result):
+    """ opening_played: adds the first BOOK_DEPTH moves of the finished
+    game to the opening book with a pull task in BOOK_QUEUE, the task is
+    added with the transaction of the game. One named refresh task per
+    BOOK_REFRESH_SECONDS adds games finished in the window at once. Games of
+    boards larger than BOOK_MAX_SIZE are not added.
+    Args:
+        game, history: the game and its history
+        result: 'x' or 'o' for the winner or 'draw'
+    """
+    board = game.board()
+    if board.size > BOOK_MAX_SIZE:
+        return
+    cells = game.move_cells(history)[:BOOK_DEPTH]
+    payload = ' '.join(str(item) for item in
+                       [board.size, board.length, result] + cells)
+    taskqueue.Queue(BOOK_QUEUE).add(
+        taskqueue.Task(payload=payload, method='PULL'),
+        transactional=ndb.in_transaction())
+    add_window_task('/tasks/refresh_book', 'book', BOOK_REFRESH_SECONDS)
+
+
+def refresh_dirty_rates(user_keys=()):
+    """ refresh_dirty_rates: leases pull tasks of rates_changed and
+    refreshes rates of all their users with one pass, the tasks are deleted
+    when rates are saved
+    Args:
+        user_keys: keys of other users to be refreshed
+    Returns: tuple of users with changed rates, the number of coalesced
+        updates and True if there are more updates to refresh
+    """
+    tasks, more = lease_all(RATES_QUEUE, RATES_LEASE_SECONDS,
+                            RATES_LEASE_SIZE, RATES_LEASES_PER_RUN)
+    keys = set(user_keys)
+    keys.update(ndb.Key(urlsafe=urlsafe_key) for task in tasks
+                for urlsafe_key in task.payload.split())
+    changed = refresh_rates(list(keys))
+    delete_leased(RATES_QUEUE, tasks)
+    return changed, len(tasks), more
+
+
+@ndb.transactional
+def _save_rate(user_key, rate):
+    """Saves the rate of the user with its move between buckets, the new
+    user is ranked
+    Returns: the user or None if the move of another refresh is not finished
+    """
+    user = user_key.get()
+    if user.moving():
+        return None
+    if user.ranked:
+        user.rate_from = user.rate
+    user.rate_to = rate
+    user.rate = rate
+    user.ranked = True
     user.put()
-    update_rating()
+    return user
 
 
-def update_rating():
-    """ update_rating: recalculate rating and ranks for users"""
-    rank = 1
-    users = User.query().order(-User.rate)
+def refresh_rates(user_keys):
+    """ refresh_rates: saves rates calculated from the aggregated statistic
+    and updates the rank index. Moves left by a failed refresh are finished
+    first.
+    Args:
+        user_keys: keys of users
+    Returns: list of users with changed rates
+    """
+    users = [user for user in ndb.get_multi(user_keys) if user is not None]
+    _move_rate_buckets([user for user in users if user.moving()])
+    statistics = get_statistics(users, use_cache=False)
+    changed = []
+    busy = []
+    for user in users:
+        rate = get_rate(*statistics[user.key])
+        if rate != user.rate or not user.ranked:
+            saved = _save_rate(user.key, rate)
+            if saved is None:
+                busy.append(user.key)
+            else:
+                changed.append(saved)
+    _move_rate_buckets(changed)
+    if busy:
+        # Refreshed again in the next window
+        rates_changed(busy)
+    return changed
+
+
+def _move_rate_buckets(users):
+    """Moves users between buckets saved with their rates, every bucket is
+    saved once for up to MOVES_PER_BUCKET users"""
+    moves = collections.defaultdict(list)
     for user in users:
-        user.rank = rank
-        user.put()
-        rank += 1
+        for rate in set([user.rate_from, user.rate_to]) - set([None]):
+            moves[rate].append(user.key)
+    for rate, keys in moves.items():
+        for start in range(0, len(keys), MOVES_PER_BUCKET):
+            _move_rate_bucket(rate, keys[start:start + MOVES_PER_BUCKET])
+
+
+@ndb.transactional(xg=True)
+def _move_rate_bucket(rate, user_keys):
+    """Counts users moved from or to the bucket of the rate and clears their
+    moves in one transaction, so a retry does not count them again"""
+    key = RateBucket.key_for(rate)
+    entities = ndb.get_multi([key] + user_keys)
+    bucket = entities[0] or RateBucket(key=key, rate=rate)
+    moved = []
+    for user in entities[1:]:
+        if user is None:
+            continue
+        if user.rate_from == rate:
+            bucket.count -= 1
+            user.rate_from = None
+            moved.append(user)
+        if user.rate_to == rate:
+            bucket.count += 1
+            user.rate_to = None
+            if user not in moved:
+                moved.append(user)
+    if not moved:
+        return
+    ndb.put_multi(moved)
+    if bucket.count > 0:
+        bucket.put()
+    else:
+        key.delete()
+
+
+@ndb.transactional
+def _shift_rate_bucket(rate, delta):
+    """Adds delta to the bucket of the rate, empty buckets are removed"""
+    key = RateBucket.key_for(rate)
+    bucket = key.get() or RateBucket(key=key, rate=rate)
+    bucket.count += delta
+    if bucket.count > 0:
+        bucket.put()
+    else:
+        key.delete()
+
+
+def get_rank(rate):
+    """ get_rank: rank for the rate - users with equal rate share
+    the same rank (1, 2, 2, 4 ...)
+    Args:
+        rate: rate of the user
+    Returns: 1 + number of users with a higher rate
+    """
+    higher = RateBucket.query(RateBucket.rate > rate)
+    return 1 + sum(bucket.count for bucket in higher)
+
+
+def get_rank_table():
+    """ get_rank_table: ranks for all rates in use
+    Returns: dict rate -> rank
+    """
+    ranks = {}
+    rank = 1
+    for bucket in RateBucket.query().order(-RateBucket.rate):
+        ranks[bucket.rate] = rank
+        rank += bucket.count
+    return ranks
+
+
+def rebuild_rank_index(urlsafe_cursor=None):
+    """ rebuild_rank_index: recounts rate buckets from one page of users,
+    buckets are deleted before the first page. Used to build the index for
+    existing data.
+    Args:
+        urlsafe_cursor: the cursor of the page or None for the first page
+    Returns: the urlsafe cursor of the next page or None
+    """
+    cursor = Cursor(urlsafe=urlsafe_cursor) if urlsafe_cursor else None
+    if cursor is None:
+        ndb.delete_multi(RateBucket.query().fetch(keys_only=True))
+    users, next_cursor, more = User.query().fetch_page(
+        BACKFILL_PAGE_SIZE, start_cursor=cursor)
+    # Users which are not ranked yet are counted by the rates refresh,
+    # unfinished moves are dropped as users are counted at their rates
+    counts = collections.Counter(user.rate for user in users
+                                 if user.ranked)
+    moving = [user for user in users if user.moving()]
+    for user in moving:
+        user.rate_from = user.rate_to = None
+    ndb.put_multi(moving)
+    for rate, count in counts.items():
+        _shift_rate_bucket(rate, count)
+    if more and next_cursor:
+        return next_cursor.urlsafe()
+    return None
 
 
 class GameForm(messages.Message):
@@ -168,17 +1209,52 @@ class GameForm(messages.Message):
     user_name_x = messages.StringField(5, required=True)
     user_name_o = messages.StringField(6, required=True)
     date = messages.StringField(7, required=True)
+    size = messages.IntegerField(8)
+    length = messages.IntegerField(9)
 
 
 class GameForms(messages.Message):
     """GameForms for multiple GameForm"""
     items = messages.MessageField(GameForm, 1, repeated=True)
+    next_cursor = messages.StringField(2)
+
+
+class GameWaitForm(messages.Message):
+    """GameWaitForm - the game if its version differs from the known one"""
+    changed = messages.BooleanField(1, required=True)
+    move = messages.IntegerField(2)
+    game = messages.MessageField(GameForm, 3)
+
+
+class MatchForm(messages.Message):
+    """MatchForm - the state of the player in the matchmaking queue"""
+    matched = messages.BooleanField(1, required=True)
+    message = messages.StringField(2, required=True)
+    urlsafe_game_key = messages.StringField(3)
+    user_name_x = messages.StringField(4)
+    user_name_o = messages.StringField(5)
+
+
+class PositionForm(messages.Message):
+    """PositionForm - results of finished games which passed through the
+    position for the player to move and the most successful next move"""
+    symbol = messages.StringField(1, required=True)
+    wins = messages.IntegerField(2, required=True)
+    draws = messages.IntegerField(3, required=True)
+    losses = messages.IntegerField(4, required=True)
+    best_move = messages.StringField(5)
+    best_wins = messages.IntegerField(6)
+    best_draws = messages.IntegerField(7)
+    best_losses = messages.IntegerField(8)
 
 
 class NewGameForm(messages.Message):
-    """Used to create a new game"""
+    """Used to create a new game, size and length only for the large
+    board"""
     user_name_x = messages.StringField(1, required=True)
     user_name_o = messages.StringField(2, required=True)
+    size = messages.IntegerField(3)
+    length = messages.IntegerField(4)
 
 
 class UserForm(messages.Message):
@@ -193,6 +1269,7 @@ class UserForm(messages.Message):
 class UserForms(messages.Message):
     """Return multiple UserForm"""
     items = messages.MessageField(UserForm, 1, repeated=True)
+    next_cursor = messages.StringField(2)
 
 
 class MakeMoveForm(messages.Message):
@@ -202,6 +1279,32 @@ class MakeMoveForm(messages.Message):
     user = messages.StringField(3, required=True)
 
 
+class GameMoveForm(messages.Message):
+    """Move in a game of the batch"""
+    urlsafe_game_key = messages.StringField(1, required=True)
+    row = messages.IntegerField(2, required=True)
+    col = messages.IntegerField(3, required=True)
+    user = messages.StringField(4, required=True)
+
+
+class GameMoveForms(messages.Message):
+    """Used to make a batch of moves"""
+    moves = messages.MessageField(GameMoveForm, 1, repeated=True)
+
+
+class MoveResultForm(messages.Message):
+    """Result of one move of the batch - the message or the error"""
+    urlsafe_game_key = messages.StringField(1, required=True)
+    message = messages.StringField(2)
+    game_over = messages.BooleanField(3)
+    error = messages.StringField(4)
+
+
+class MoveResultForms(messages.Message):
+    """Return MoveResultForm for every move of the batch"""
+    items = messages.MessageField(MoveResultForm, 1, repeated=True)
+
+
 class StatisticForm(messages.Message):
     """StatisticForm for outbound statistic information"""
     name = messages.StringField(1, required=True)
@@ -215,18 +1318,22 @@ class StatisticForm(messages.Message):
 class StatisticForms(messages.Message):
     """Return multiple StatisticForm"""
     items = messages.MessageField(StatisticForm, 1, repeated=True)
+    next_cursor = messages.StringField(2)
 
 
 class RatingForm(messages.Message):
-    """RatingForm for rating users"""
+    """RatingForm for rating users, rank is of the saved rate and live_rate
+    is the rate of games not refreshed yet"""
     name = messages.StringField(1, required=True)
     rate = messages.IntegerField(2)
     rank = messages.IntegerField(3)
+    live_rate = messages.IntegerField(4)
 
 
 class RatingForms(messages.Message):
     """Return multiple RatingForms"""
     items = messages.MessageField(RatingForm, 1, repeated=True)
+    next_cursor = messages.StringField(2)
 
 
 class HistoryForm(messages.Message):
@@ -237,3 +1344,61 @@ class HistoryForm(messages.Message):
 class StringMessage(messages.Message):
     """StringMessage -- outbound (single) string message"""
     message = messages.StringField(1, required=True)
+
+
+class CounterForm(messages.Message):
+    """CounterForm - the total of a counter of the endpoint or handler"""
+    name = messages.StringField(1, required=True)
+    total = messages.IntegerField(2)
+
+
+class EndpointStatForm(messages.Message):
+    """EndpointStatForm for sampled requests of one endpoint or handler"""
+    name = messages.StringField(1, required=True)
+    requests = messages.IntegerField(2)
+    errors = messages.IntegerField(3)
+    latency_ms = messages.FloatField(4)
+    p50_ms = messages.IntegerField(5)
+    p95_ms = messages.IntegerField(6)
+    p99_ms = messages.IntegerField(7)
+    datastore_calls = messages.FloatField(8)
+    memcache_calls = messages.FloatField(9)
+    memcache_hit_ratio = messages.FloatField(10)
+    histogram = messages.IntegerField(11, repeated=True)
+    counters = messages.MessageField(CounterForm, 12, repeated=True)
+
+
+class EndpointStatForms(messages.Message):
+    """Return multiple EndpointStatForm"""
+    items = messages.MessageField(EndpointStatForm, 1, repeated=True)
+    sample_rate = messages.FloatField(2)
+    latency_buckets = messages.IntegerField(3, repeated=True)
+
+
+class TournamentRequestForm(messages.Message):
+    """Used to create a tournament"""
+    name = messages.StringField(1, required=True)
+    players = messages.StringField(2, repeated=True)
+    format = messages.StringField(3, default=ROUND_ROBIN)
+    rounds = messages.IntegerField(4)
+
+
+class StandingForm(messages.Message):
+    """StandingForm for the player of the tournament"""
+    name = messages.StringField(1, required=True)
+    points = messages.IntegerField(2)
+    win = messages.IntegerField(3)
+    loss = messages.IntegerField(4)
+    draw = messages.IntegerField(5)
+    bye = messages.IntegerField(6)
+    rank = messages.IntegerField(7)
+
+
+class TournamentForm(messages.Message):
+    """TournamentForm for the tournament with standings of players"""
+    urlsafe_key = messages.StringField(1, required=True)
+    name = messages.StringField(2, required=True)
+    format = messages.StringField(3, required=True)
+    rounds = messages.IntegerField(4)
+    round = messages.IntegerField(5)
+    standings = messages.MessageField(StandingForm, 6, repeated=True)
@@ -0,0 +1,131 @@
+"""ndb_storage.py - Repository of users, games and histories in the datastore.
+
+A move loads the game and its history with one get_multi and saves them with
+statistic shards, tournament standings and active games of players with one
+put_multi in a transaction. Versions of games, rates and tournament rounds
+are updated after the commit. Games which are not in the datastore are read
+from the archive.
+"""
+from google.appengine.ext import ndb
+
+from models import (
+    User,
+    Game,
+    History,
+    ActiveGames,
+    delete_game_version,
+    get_user,
+    get_user_names,
+    insert_user,
+    save_new_game,
+    set_game_versions,
+    statistic_changed,
+)
+from service import NotFoundError
+from storage import Repository
+import archive
+import tournament
+
+
+def end_game(game, result, history=None):
+    """Ends the game by the result of service.play, moves of the history
+    are added to the opening book
+    Returns: list of entities to be saved with the game
+    """
+    if result is None:
+        return []
+    winner, loser = result
+    if winner is None:
+        return game.end_game_draw(game.user_x, game.user_o, history)
+    return game.end_game(winner, loser, history)
+
+
+@ndb.transactional(xg=True)
+def _update_game(game_key, update):
+    history_key = History.key_for(game_key)
+    game, history = ndb.get_multi([game_key, history_key])
+    if game is None:
+        raise NotFoundError('Game not found!')
+    if history is None:
+        # JSON history of the game is packed by migrate_histories
+        history = History(key=history_key)
+    value, result = update(game, history)
+    ndb.put_multi([game, history] + end_game(game, result, history))
+    return game, value
+
+
+@ndb.transactional(xg=True)
+def _cancel_game(game_key):
+    """Deletes the active game which is not a tournament game and removes it
+    from active games of its players in one transaction
+    Returns: tuple of the game or None and True if it is deleted
+    """
+    game = game_key.get()
+    if game is None or game.game_over or game.tournament:
+        return game, False
+    game.key.delete()
+    ndb.put_multi(ActiveGames.update(removed=[game]))
+    return game, True
+
+
+class NdbRepository(Repository):
+    """Repository of User, Game and History entities"""
+    def user_key(self, name):
+        return User.key_for(name)
+
+    def get_user(self, name):
+        return get_user(name)
+
+    def create_user(self, name, email=None):
+        # The rank index and the leaderboard are updated by the rates refresh
+        return insert_user(name, email)
+
+    def get_user_names(self, user_keys):
+        return get_user_names(user_keys)
+
+    def new_game(self, user_x, user_o, before_save=None, size=None,
+                 length=None):
+        game = Game.create(user_x, user_o, key=Game.allocate_key(),
+                           size=size, length=length)
+        history = History(key=History.key_for(game.key))
+        if before_save is not None:
+            before_save(game, history)
+        # The game, its history and active games of players in one commit
+        save_new_game(game, history)
+        return game
+
+    def get_game(self, game_key):
+        return game_key.get() or archive.get_archived(game_key)[0]
+
+    def get_game_history(self, game_key):
+        game = game_key.get()
+        if game is None:
+            return archive.get_archived(game_key)
+        # JSON histories which are not migrated yet are found by the query
+        return game, History.get_for_game(game_key)
+
+    def cancel_game(self, game_key):
+        game, deleted = _cancel_game(game_key)
+        if deleted:
+            # Waiting clients see the game is deleted
+            delete_game_version(game_key)
+        return game, deleted
+
+    def update_game(self, game_key, update):
+        game, value = _update_game(game_key, update)
+        set_game_versions([game])
+        if game.game_over:
+            # Rates, ranks and the leaderboard are refreshed by the task
+            statistic_changed([game.user_x, game.user_o])
+            tournament.games_over([game])
+        return game, value
+
+    def active_games(self, user_key, offset=0, limit=None):
+        # Keys of active games come from shards of the index of the user
+        game_keys = [game_key
+                     for index in ndb.get_multi(ActiveGames.keys_for(user_key))
+                     if index is not None for game_key in index.games]
+        end = len(game_keys) if limit is None else offset + limit
+        games = [game for game in ndb.get_multi(game_keys[offset:end])
+                 if game is not None and not game.game_over]
+        return games, end < len(game_keys)
@@ -0,0 +1,206 @@
+"""openings.py - Opening book: results of finished games by position.
+
+The first BOOK_DEPTH moves of every finished game are replayed into
+PositionStat entities - one per position the game passed through, with the
+result of the game and the next move made in the position. Positions are
+keyed by their canonical form - the smallest of the 8 rotations and
+reflections of the board as of bot.canonical - so symmetric positions share
+one entity and its moves are cells of the canonical board. In a position
+which is symmetric itself, equivalent moves are counted under the smallest
+of their cells. Only boards up to BOOK_MAX_SIZE are in the book - positions
+of larger boards rarely repeat, every game would add new entities only.
+
+The book is updated incrementally: the game adds its moves with a pull task
+in the transaction which ends it (models.opening_played) and one refresh
+per BOOK_REFRESH_SECONDS replays all games of the window and saves every
+position once. So the start position, which every game passes, is written
+once per window rather than once per game. A refresh which fails after
+positions are saved counts its games again when their tasks are leased
+again.
+
+A lookup is one get of the position key. Read positions are cached in
+memcache and the cached ones are replaced when the refresh changes them, so
+hot positions are read from memcache only.
+"""
+import collections
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+from bot import canonical_permutations
+from engine import Board, GOMOKU_LENGTH
+from models import PositionStat, BOOK_MAX_SIZE, BOOK_QUEUE
+from service import BadRequestError
+from utils import delete_leased, lease_all
+
+BOOK_LEASE_SECONDS = 60
+BOOK_LEASE_SIZE = 1000
+BOOK_LEASES_PER_RUN = 10
+# Positions saved by one transaction, in the limit of entity groups
+BOOK_BATCH_SIZE = 20
+MEMCACHE_POSITION = 'POSITION:'
+POSITION_CACHE_TIME = 60 * 60
+RESULTS = ('x', 'o', 'draw')
+
+
+def position_id(size, length, x, o):
+    """Returns the key name of the canonical position and permutations of
+    cells which give it
+    Args:
+        size, length: the board
+        x, o: bitboards of the players
+    """
+    (x, o), permutations = canonical_permutations(x, o, size)
+    return '%d:%d:%x:%x' % (size, length, x, o), permutations
+
+
+def replay(size, length, result, cells):
+    """Returns generator of (position key name, cell of the next move on
+    the canonical board or None for the last position) of the game. Moves
+    which are the same in a symmetric position get the smallest of their
+    canonical cells."""
+    x = o = 0
+    for index in range(len(cells) + 1):
+        position, permutations = position_id(size, length, x, o)
+        if index == len(cells):
+            yield position, None
+            return
+        cell = cells[index]
+        yield position, min(permutation[cell]
+                            for permutation in permutations)
+        if index % 2:
+            o |= 1 << cell
+        else:
+            x |= 1 << cell
+
+
+def _cached(stat):
+    """Returns the memcache value of the PositionStat"""
+    return stat.wins_x, stat.wins_o, stat.draws, stat.moves or {}
+
+
+@ndb.transactional(xg=True)
+def _add_results(totals):
+    """Adds counts to positions
+    Args:
+        totals: dict position key name -> Counter of (cell or None for the
+            position, result)
+    Returns: list of saved PositionStat
+    """
+    keys = [ndb.Key(PositionStat, position) for position in totals]
+    stats = []
+    for key, stat in zip(keys, ndb.get_multi(keys)):
+        stat = stat or PositionStat(key=key)
+        moves = dict(stat.moves or {})
+        for (cell, result), count in totals[key.id()].items():
+            index = RESULTS.index(result)
+            if cell is None:
+                name = ('wins_x', 'wins_o', 'draws')[index]
+                setattr(stat, name, getattr(stat, name) + count)
+            else:
+                counts = list(moves.get(str(cell), [0, 0, 0]))
+                counts[index] += count
+                moves[str(cell)] = counts
+        stat.moves = moves
+        stats.append(stat)
+    ndb.put_multi(stats)
+    return stats
+
+
+def refresh_book():
+    """ refresh_book: leases pull tasks of opening_played and adds their
+    games to the book, every position is saved once. The tasks are deleted
+    when positions are saved.
+    Returns: tuple of the number of games, the number of saved positions and
+        True if there are more games to add
+    """
+    tasks, more = lease_all(BOOK_QUEUE, BOOK_LEASE_SECONDS,
+                            BOOK_LEASE_SIZE, BOOK_LEASES_PER_RUN)
+    totals = collections.defaultdict(collections.Counter)
+    for task in tasks:
+        items = task.payload.split()
+        size, length, result = int(items[0]), int(items[1]), items[2]
+        for position, cell in replay(size, length, result,
+                                     [int(item) for item in items[3:]]):
+            totals[position][(None, result)] += 1
+            if cell is not None:
+                totals[position][(cell, result)] += 1
+    positions = list(totals)
+    for start in range(0, len(positions), BOOK_BATCH_SIZE):
+        batch = positions[start:start + BOOK_BATCH_SIZE]
+        stats = _add_results(dict((position, totals[position])
+                                  for position in batch))
+        # Only positions which are read are kept in memcache
+        memcache.replace_multi(dict((stat.key.id(), _cached(stat))
+                                    for stat in stats),
+                               key_prefix=MEMCACHE_POSITION,
+                               time=POSITION_CACHE_TIME)
+    delete_leased(BOOK_QUEUE, tasks)
+    return len(tasks), len(positions), more
+
+
+def _parse_field(game_field, length=None):
+    """Returns the board of the game field
+    Raises:
+        BadRequestError: If the position is not possible.
+    """
+    try:
+        board = Board.from_field(game_field or '')
+    except ValueError:
+        raise BadRequestError('Game field should be a square grid!')
+    if not 3 <= board.size <= BOOK_MAX_SIZE:
+        raise BadRequestError(
+            'Board size should be 3 to %d!' % (BOOK_MAX_SIZE,))
+    board.length = length or min(board.size, GOMOKU_LENGTH)
+    if not 3 <= board.length <= board.size:
+        raise BadRequestError('Length should be 3 to board size!')
+    moves_x = bin(board.bits['x']).count('1')
+    moves_o = bin(board.bits['o']).count('1')
+    if moves_x - moves_o not in (0, 1):
+        raise BadRequestError('X moves first, players move in turn!')
+    return board
+
+
+def get_position(game_field, length=None):
+    """ get_position: results of finished games which passed through the
+    position and the most successful next move
+    Args:
+        game_field: cells of the board row by row, 'x' and 'o' for marks
+            and any other character for an empty cell
+        length: marks in a row to win, as of new_game by default
+    Returns: dict with symbol of the player to move, wins, draws and losses
+        of that player, and best_move - (row, col) or None - with its
+        best_wins, best_draws and best_losses
+    Raises:
+        BadRequestError: If the position is not possible.
+    """
+    board = _parse_field(game_field, length)
+    x, o = board.bits['x'], board.bits['o']
+    position, permutations = position_id(board.size, board.length, x, o)
+    cached = memcache.get(MEMCACHE_POSITION + position)
+    if cached is None:
+        stat = ndb.Key(PositionStat, position).get() or PositionStat()
+        cached = _cached(stat)
+        memcache.set(MEMCACHE_POSITION + position, cached,
+                     time=POSITION_CACHE_TIME)
+    wins_x, wins_o, draws, moves = cached
+    symbol = 'x' if bin(x).count('1') == bin(o).count('1') else 'o'
+    mine, theirs = (0, 1) if symbol == 'x' else (1, 0)
+    position = {'symbol': symbol,
+                'wins': (wins_x, wins_o)[mine],
+                'draws': draws,
+                'losses': (wins_x, wins_o)[theirs],
+                'best_move': None}
+
+    def score(item):
+        counts = item[1]
+        games = sum(counts)
+        return (counts[mine] + counts[2] / 2.0) / games, games
+
+    if moves:
+        cell, counts = max(moves.items(), key=score)
+        # The cell of the canonical board is mapped back to the position
+        row, col = divmod(permutations[0].index(int(cell)), board.size)
+        position.update(best_move=(row, col), best_wins=counts[mine],
+                        best_draws=counts[2], best_losses=counts[theirs])
+    return position
@@ -0,0 +1,256 @@
+"""service.py - Game play independent of the storage.
+
+GameService creates users and games and makes moves on a repository of
+users, games and histories (storage.Repository) - the datastore behind the
+endpoints (ndb_storage.NdbRepository) or MemoryRepository, which runs
+simulations and benchmarks in one process without App Engine. Errors are
+GameError subclasses with the message for the client, the endpoints turn them
+into endpoints exceptions.
+"""
+from engine import MAX_SPARSE_SIZE, GOMOKU_LENGTH
+import bot
+
+
+class GameError(Exception):
+    """Base of errors of the game service"""
+
+
+class NotFoundError(GameError):
+    """The user or the game does not exist"""
+
+
+class BadRequestError(GameError):
+    """The request is not valid"""
+
+
+class ForbiddenError(GameError):
+    """The action is not allowed by the game rules"""
+
+
+class ConflictError(GameError):
+    """The name is already used"""
+
+
+def check_move(game, board, names, user_name, row, col):
+    """Validates the move by the game rules
+    Args:
+        game, board: the game and its engine board
+        names: dict user key -> name for players of the game
+        user_name: player who makes move
+        row, col: coordinates of the cell in the grid
+    Returns: tuple of the symbol of the player and the key of the opponent
+    Raises:
+        BadRequestError: If the cell is out of the grid.
+        ForbiddenError: If the move is illegal.
+    """
+    if game.game_over:
+        raise ForbiddenError('Illegal action: Game is already over.')
+    if user_name == bot.BOT_NAME:
+        raise ForbiddenError('Illegal action: The computer makes own moves!')
+    elif user_name == names[game.user_x]:
+        symbol, opponent = 'x', game.user_o
+    elif user_name == names[game.user_o]:
+        symbol, opponent = 'o', game.user_x
+    else:
+        raise ForbiddenError('Illegal action: It is not your game!')
+
+    try:
+        if not board.is_free(row, col):
+            raise ForbiddenError('Illegal action: the cell is already used.')
+    except ValueError:
+        raise BadRequestError('Illegal action: the cell is out of the grid.')
+    if board.next_symbol() != symbol:
+        raise ForbiddenError('Illegal action: It is not your move!')
+    return symbol, opponent
+
+
+def play(game, history, board, names, symbol, row, col):
+    """Applies the valid move to the game, its history and board. The game
+    is ended by the repository.
+    Args:
+        game, history, board: the game, its history and engine board
+        names: dict user key -> name for players of the game
+        symbol: x or o - player who makes move
+        row, col: coordinates of the cell in the grid
+    Returns: tuple of the message and the result - None if the game is not
+        over, (winner key, loser key) or (None, None) for a draw
+    """
+    board.play(symbol, row, col)
+    game.set_board(board)
+    if not board.SPARSE:
+        # Moves of the sparse board are kept by the game in their order
+        history.update_history(symbol, board.cell(row, col))
+    player, opponent = game.user_x, game.user_o
+    if symbol == 'o':
+        player, opponent = opponent, player
+    # Check whether game is over and winner
+    if board.is_winner(symbol, row, col):
+        return ('Game is over! Winner-%s' % (names[player],),
+                (player, opponent))
+    if board.is_full():
+        return 'Game is over! Draw game!', (None, None)
+    if board.SPARSE:
+        return 'Moves made: %d' % (board.moves,), None
+    return 'Game_field is %s' % (game.game_field,), None
+
+
+def play_bot(game, history, board, names):
+    """Makes the move of the computer player
+    Returns: tuple of the message and the result as of play
+    """
+    row, col = bot.choose_move(board)
+    return play(game, history, board, names, board.next_symbol(), row, col)
+
+
+class GameService(object):
+    """Users, games and moves on the repository"""
+    def __init__(self, repository):
+        """
+        Args:
+            repository: storage.Repository of users, games and histories
+        """
+        self.repository = repository
+        self.bot_key = repository.user_key(bot.BOT_NAME)
+
+    def create_user(self, name, email=None):
+        """Creates the user
+        Returns: the new user
+        Raises:
+            ConflictError: If the name is used or it is the computer player.
+        """
+        user = None
+        if name != bot.BOT_NAME:
+            user = self.repository.create_user(name, email)
+        if user is None:
+            raise ConflictError('A User with that name already exists!')
+        return user
+
+    def get_player(self, name):
+        """Returns the user with the name or None, the computer player is
+        created on the first game"""
+        user = self.repository.get_user(name)
+        if user is None and name == bot.BOT_NAME:
+            user = (self.repository.create_user(name) or
+                    self.repository.get_user(name))
+        return user
+
+    def new_game(self, name_x, name_o, size=None, length=None):
+        """Creates the game, the computer player makes the first move if it
+        plays X
+        Args:
+            name_x, name_o: names of players
+            size: dimension of the large board, the classic 3x3 game field
+                if it is not given
+            length: marks in a row to win on the large board, GOMOKU_LENGTH
+                by default
+        Returns: tuple of the game and dict user key -> name
+        Raises:
+            NotFoundError: If a user does not exist.
+            BadRequestError: If the game is created with one user or the
+                board is not possible.
+        """
+        user_x = self.get_player(name_x)
+        user_o = self.get_player(name_o)
+        if not user_x or not user_o:
+            raise NotFoundError('A User with that name does not exist!')
+        if user_x.key == user_o.key:
+            raise BadRequestError('Players should be different!')
+        if size is not None:
+            length = length or min(size, GOMOKU_LENGTH)
+            if not 3 <= size <= MAX_SPARSE_SIZE:
+                raise BadRequestError(
+                    'Board size should be 3 to %d!' % (MAX_SPARSE_SIZE,))
+            if not 3 <= length <= size:
+                raise BadRequestError('Length should be 3 to board size!')
+            if self.bot_key in (user_x.key, user_o.key):
+                raise BadRequestError(
+                    'The computer plays only the classic board!')
+        names = {user_x.key: user_x.name, user_o.key: user_o.name}
+
+        def first_move(game, history):
+            if user_x.key == self.bot_key:
+                play_bot(game, history, game.board(), names)
+        game = self.repository.new_game(user_x.key, user_o.key, first_move,
+                                        size, length)
+        return game, names
+
+    def get_game(self, game_key):
+        """Returns the game
+        Raises:
+            NotFoundError: If the game does not exist.
+        """
+        game = self.repository.get_game(game_key)
+        if game is None:
+            raise NotFoundError('Game not found!')
+        return game
+
+    def get_game_history(self, game_key):
+        """Returns tuple of the game and its history
+        Raises:
+            NotFoundError: If the game does not exist.
+        """
+        game, history = self.repository.get_game_history(game_key)
+        if game is None:
+            raise NotFoundError('Game not found!')
+        return game, history
+
+    def cancel_game(self, game_key):
+        """Deletes the active game, finished and tournament games are kept
+        Returns: tuple of the game and True if it is deleted
+        Raises:
+            NotFoundError: If the game does not exist.
+        """
+        game, deleted = self.repository.cancel_game(game_key)
+        if game is None:
+            raise NotFoundError('Game not found!')
+        return game, deleted
+
+    def apply_move(self, game, history, board, names, user_name, row, col):
+        """Validates the move and applies it, if the opponent is the
+        computer player, its move is made too
+        Args:
+            game, history, board: the game, its history and engine board
+            names: dict user key -> name for players of the game
+            user_name: player who makes move
+            row, col: coordinates of the cell in the grid
+        Returns: tuple of the message and the result as of play
+        Raises:
+            BadRequestError: If the cell is out of the grid.
+            ForbiddenError: If the move is illegal.
+        """
+        symbol, opponent = check_move(game, board, names, user_name, row, col)
+        msg, result = play(game, history, board, names, symbol, row, col)
+        if result is None and opponent == self.bot_key:
+            msg, result = play_bot(game, history, board, names)
+        return msg, result
+
+    def make_move(self, game_key, user_name, row, col):
+        """Makes the move in one update of the game and its history
+        Returns: tuple of the game, message and dict user key -> name
+        Raises:
+            NotFoundError: If the game does not exist.
+            BadRequestError: If the cell is out of the grid.
+            ForbiddenError: If the move is illegal.
+        """
+        def move(game, history):
+            names = self.repository.get_user_names([game.user_x, game.user_o])
+            msg, result = self.apply_move(game, history, game.board(), names,
+                                          user_name, row, col)
+            return (msg, names), result
+        game, (msg, names) = self.repository.update_game(game_key, move)
+        return game, msg, names
+
+    def get_user_games(self, name, offset=0, limit=None):
+        """Returns one page of active games of the user
+        Returns: tuple of the list of games and True if there are more
+        Raises:
+            NotFoundError: If the user does not exist.
+                           If there are no active games.
+        """
+        user = self.repository.get_user(name)
+        if not user:
+            raise NotFoundError('A User with that name does not exist!')
+        games, more = self.repository.active_games(user.key, offset, limit)
+        if not games and not offset:
+            raise NotFoundError('There are no active games for %s!' % (name,))
+        return games, more
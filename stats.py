@@ -0,0 +1,223 @@
+"""stats.py - Latency and RPC statistics of endpoints and handlers.
+
+A sampled request counts its datastore and memcache RPCs with apiproxy hooks
+and measures its wall time. The counters are added to memcache with one
+offset_multi at the end of the request, so requests which are not sampled
+pay only for the random number. Counters are kept per STATS_WINDOW.
+"""
+import functools
+import os
+import random
+import threading
+import time
+
+from google.appengine.api import apiproxy_stub_map, memcache
+
+SAMPLE_RATE = float(os.environ.get('STATS_SAMPLE_RATE', '0.1'))
+STATS_WINDOW = 60 * 60
+MEMCACHE_STATS = 'STATS:%d:%s:%s'
+# Upper bounds of latency buckets in ms, the last bucket has no bound
+LATENCY_BUCKETS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+COUNTERS = ('requests', 'errors', 'latency_ms', 'datastore', 'memcache',
+            'memcache_keys', 'memcache_hits')
+
+# Task and cron handlers of main.app with the counters they add. Endpoints
+# are another WSGI application, which may run in an instance that has not
+# imported main, so the handlers are registered here
+HANDLERS = (
+    ('/crons/send_reminder', ()),
+    ('/tasks/reminder_scan', ()),
+    ('/tasks/reminder_mail', ()),
+    ('/tasks/_cache_current_leader', ()),
+    ('/tasks/refresh_rates', ('coalesced', 'changed')),
+    ('/tasks/rebuild_rank_index', ()),
+    ('/tasks/migrate_histories', ()),
+    ('/tasks/backfill_active_games', ()),
+    ('/tasks/migrate_user_names', ()),
+    ('/tasks/archive_games', ('archived',)),
+    ('/tasks/refresh_book', ('games', 'positions')),
+    ('/tasks/tournament_games', ()),
+    ('/tasks/tournament_round', ()),
+)
+
+_names = []
+# Counters added by instrumented functions with count()
+_custom_counters = {}
+_local = threading.local()
+
+
+def _count_call(service, call, request, response):
+    """Pre-call hook - counts RPCs of the sampled request"""
+    counters = getattr(_local, 'counters', None)
+    if counters is None:
+        return
+    if service == 'datastore_v3':
+        counters['datastore'] += 1
+    elif service == 'memcache':
+        counters['memcache'] += 1
+
+
+def _count_hits(service, call, request, response):
+    """Post-call hook - counts memcache hits of the sampled request"""
+    counters = getattr(_local, 'counters', None)
+    if counters is None or service != 'memcache' or call != 'Get':
+        return
+    counters['memcache_keys'] += request.key_size()
+    counters['memcache_hits'] += response.item_size()
+
+
+apiproxy_stub_map.apiproxy.GetPreCallHooks().Append('stats', _count_call)
+apiproxy_stub_map.apiproxy.GetPostCallHooks().Append('stats', _count_hits)
+
+
+def _bucket(latency_ms):
+    for index, bound in enumerate(LATENCY_BUCKETS):
+        if latency_ms <= bound:
+            return index
+    return len(LATENCY_BUCKETS)
+
+
+def _window(now=None):
+    return int(now or time.time()) // STATS_WINDOW
+
+
+def _save(name, counters):
+    """Adds counters of one request to memcache"""
+    window = _window()
+    memcache.offset_multi(
+        dict((MEMCACHE_STATS % (window, name, counter), value)
+             for counter, value in counters.items() if value),
+        initial_value=0)
+
+
+def register(name, counters=()):
+    """Adds the name of statistics and its counters to names()"""
+    known = _custom_counters.get(name)
+    if known is None:
+        _names.append(name)
+        known = ()
+    _custom_counters[name] = known + tuple(counter for counter in counters
+                                           if counter not in known)
+
+
+for _name, _counters in HANDLERS:
+    register(_name, _counters)
+
+
+def instrument(name=None, sample_rate=None, counters=()):
+    """Decorator of endpoint methods and handler methods - SAMPLE_RATE of
+    calls are measured
+    Args:
+        name: name of the statistics, the function name by default
+        sample_rate: measured part of calls, SAMPLE_RATE by default
+        counters: names of counters the function adds with count(), the
+            ones of HANDLERS are registered already
+    """
+    def decorator(function):
+        stats_name = name or function.__name__
+        register(stats_name, counters)
+        rate = SAMPLE_RATE if sample_rate is None else sample_rate
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            # Nested calls are counted by the outer one
+            if (getattr(_local, 'counters', None) is not None or
+                    random.random() >= rate):
+                return function(*args, **kwargs)
+            counters = dict.fromkeys(COUNTERS, 0)
+            counters['requests'] = 1
+            _local.counters = counters
+            start = time.time()
+            try:
+                return function(*args, **kwargs)
+            except Exception:
+                counters['errors'] = 1
+                raise
+            finally:
+                latency_ms = int(1000 * (time.time() - start))
+                counters['latency_ms'] = latency_ms
+                counters['bucket:%d' % _bucket(latency_ms)] = 1
+                _local.counters = None
+                _save(stats_name, counters)
+        return wrapper
+    return decorator
+
+
+def count(counter, value=1):
+    """Adds value to the counter of the measured call, it is ignored if the
+    call is not sampled"""
+    counters = getattr(_local, 'counters', None)
+    if counters is not None:
+        counters[counter] = counters.get(counter, 0) + value
+
+
+def names():
+    """Returns names of instrumented functions"""
+    return list(_names)
+
+
+def _percentile(histogram, total, fraction):
+    """Returns the upper bound of the bucket with the percentile"""
+    seen = 0
+    for index, bucket_count in enumerate(histogram):
+        seen += bucket_count
+        if seen >= fraction * total:
+            return LATENCY_BUCKETS[min(index, len(LATENCY_BUCKETS) - 1)]
+    return LATENCY_BUCKETS[-1]
+
+
+def get_stats(stats_names, windows=2):
+    """Returns statistics of sampled requests
+    Args:
+        stats_names: names of instrumented functions
+        windows: number of the latest windows, the current one included
+    Returns: list of dicts with name, requests, errors, mean latency and
+        p50, p95, p99 estimated by latency buckets, datastore and memcache
+        calls per request, memcache hit ratio, the latency histogram and
+        totals of counters added by count()
+    """
+    current = _window()
+    buckets = ['bucket:%d' % index
+               for index in range(len(LATENCY_BUCKETS) + 1)]
+
+    def name_counters(name):
+        return (list(COUNTERS) + buckets +
+                list(_custom_counters.get(name, ())))
+
+    keys = [MEMCACHE_STATS % (window, name, counter)
+            for name in stats_names
+            for window in range(current - windows + 1, current + 1)
+            for counter in name_counters(name)]
+    values = memcache.get_multi(keys)
+
+    stats = []
+    for name in stats_names:
+        counters = name_counters(name)
+        total = dict.fromkeys(counters, 0)
+        for window in range(current - windows + 1, current + 1):
+            for counter in counters:
+                total[counter] += int(values.get(
+                    MEMCACHE_STATS % (window, name, counter), 0))
+        requests = total['requests']
+        if not requests:
+            continue
+        histogram = [total['bucket:%d' % index]
+                     for index in range(len(LATENCY_BUCKETS) + 1)]
+        stats.append({
+            'name': name,
+            'requests': requests,
+            'errors': total['errors'],
+            'latency_ms': total['latency_ms'] / float(requests),
+            'p50_ms': _percentile(histogram, requests, 0.5),
+            'p95_ms': _percentile(histogram, requests, 0.95),
+            'p99_ms': _percentile(histogram, requests, 0.99),
+            'datastore_calls': total['datastore'] / float(requests),
+            'memcache_calls': total['memcache'] / float(requests),
+            'memcache_hit_ratio': (
+                total['memcache_hits'] / float(total['memcache_keys'])
+                if total['memcache_keys'] else None),
+            'histogram': histogram,
+            'counters': [(counter, total[counter])
+                         for counter in _custom_counters.get(name, ())],
+        })
+    return stats
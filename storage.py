@@ -0,0 +1,254 @@
+"""storage.py - Repositories of users, games and histories.
+
+Repository is the storage used by service.GameService. The datastore
+implementation is ndb_storage.NdbRepository. MemoryRepository keeps
+everything in dicts of one process - it needs no App Engine SDK, so games can
+be simulated and benchmarked locally. Its records have the attributes and
+methods of the ndb models that the game service uses.
+"""
+import collections
+import datetime
+import itertools
+import threading
+
+from engine import Board, SparseBoard
+from service import NotFoundError
+
+
+class Repository(object):
+    """Storage of users, games and histories. Keys are opaque to the caller -
+    ndb keys in the datastore, names and integers in memory."""
+    def user_key(self, name):
+        """Returns the key of the user with the name"""
+        raise NotImplementedError
+
+    def get_user(self, name):
+        """Returns the user with the name or None"""
+        raise NotImplementedError
+
+    def create_user(self, name, email=None):
+        """Creates the user, the name is checked atomically
+        Returns: the new user or None if the name is already used
+        """
+        raise NotImplementedError
+
+    def get_user_names(self, user_keys):
+        """Returns dict user key -> name"""
+        raise NotImplementedError
+
+    def new_game(self, user_x, user_o, before_save=None, size=None,
+                 length=None):
+        """Saves a new game with its history and adds it to active games of
+        players
+        Args:
+            user_x, user_o: keys of players
+            before_save: function (game, history) called before the game is
+                saved, e.g. the first move of the computer player
+            size, length: the large board, the classic game field if size
+                is None
+        Returns: the game
+        """
+        raise NotImplementedError
+
+    def get_game(self, game_key):
+        """Returns the game or None, archived games included"""
+        raise NotImplementedError
+
+    def get_game_history(self, game_key):
+        """Returns tuple of the game and its history or (None, None),
+        archived games included"""
+        raise NotImplementedError
+
+    def cancel_game(self, game_key):
+        """Deletes the active game which is not a tournament game and removes
+        it from active games of players atomically
+        Returns: tuple of the game or None and True if it is deleted
+        """
+        raise NotImplementedError
+
+    def update_game(self, game_key, update):
+        """Loads the game with its history, applies the update and saves them
+        atomically - nothing is saved if the update raises
+        Args:
+            game_key: key of the game
+            update: function (game, history) which returns a tuple of a value
+                and the result of the game as of service.play - the game is
+                ended with statistics of players by the repository
+        Returns: tuple of the game and the value
+        Raises:
+            NotFoundError: If the game does not exist.
+        """
+        raise NotImplementedError
+
+    def active_games(self, user_key, offset=0, limit=None):
+        """Returns one page of active games of the user in the order of its
+        index - the order of creation in memory, shard after shard in the
+        datastore
+        Returns: tuple of the list of games and True if there are more
+        """
+        raise NotImplementedError
+
+
+class MemoryUser(object):
+    """User of MemoryRepository keyed by the name"""
+    def __init__(self, name, email=None):
+        self.key = name
+        self.name = name
+        self.email = email
+        self.win = 0
+        self.loss = 0
+        self.draw = 0
+
+
+class MemoryGame(object):
+    """Game of MemoryRepository, the large board keeps packed moves instead
+    of the game field"""
+    def __init__(self, key, user_x, user_o, size=None, length=None):
+        self.key = key
+        self.user_x = user_x
+        self.user_o = user_o
+        self.size = size
+        self.length = length
+        self.game_field = '' if size else Board().to_field()
+        self.packed_moves = ''
+        self.game_over = False
+        self.tournament = None
+        self.date = datetime.datetime.now()
+
+    def board(self):
+        """Returns the engine board for the current game field or moves"""
+        if self.size:
+            return SparseBoard.from_packed(self.size, self.length,
+                                           self.packed_moves)
+        return Board.from_field(self.game_field)
+
+    def set_board(self, board):
+        """Saves the board into the game field or packed moves"""
+        if board.SPARSE:
+            self.packed_moves = board.to_packed()
+        else:
+            self.game_field = board.to_field()
+
+    def moves_made(self):
+        """Returns the number of moves made in the game"""
+        if self.size:
+            return len(self.packed_moves) // 2
+        return len(self.game_field) - self.game_field.count(' ')
+
+    def copy(self):
+        game = MemoryGame(self.key, self.user_x, self.user_o, self.size,
+                          self.length)
+        game.game_field = self.game_field
+        game.packed_moves = self.packed_moves
+        game.game_over = self.game_over
+        game.tournament = self.tournament
+        game.date = self.date
+        return game
+
+
+class MemoryHistory(object):
+    """History of MemoryRepository - (symbol, cell) of every move"""
+    def __init__(self, moves=()):
+        self.moves = list(moves)
+
+    def update_history(self, symbol, cell):
+        self.moves.append((symbol, cell))
+
+    def copy(self):
+        return MemoryHistory(self.moves)
+
+
+class MemoryRepository(Repository):
+    """Repository in dicts of the process. Changes are serialized by one
+    lock, an update works on copies of the game and history, so a failed
+    move changes nothing."""
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._users = {}
+        self._games = {}
+        self._histories = {}
+        self._active = collections.defaultdict(list)
+        self._ids = itertools.count(1)
+
+    def user_key(self, name):
+        return name
+
+    def get_user(self, name):
+        return self._users.get(name)
+
+    def create_user(self, name, email=None):
+        with self._lock:
+            if name in self._users:
+                return None
+            user = self._users[name] = MemoryUser(name, email)
+            return user
+
+    def get_user_names(self, user_keys):
+        return dict((key, self._users[key].name)
+                    for key in user_keys if key in self._users)
+
+    def new_game(self, user_x, user_o, before_save=None, size=None,
+                 length=None):
+        with self._lock:
+            game = MemoryGame(next(self._ids), user_x, user_o, size, length)
+        history = MemoryHistory()
+        if before_save is not None:
+            before_save(game, history)
+        with self._lock:
+            self._games[game.key] = game
+            self._histories[game.key] = history
+            for user_key in (user_x, user_o):
+                self._active[user_key].append(game.key)
+        return game
+
+    def get_game(self, game_key):
+        return self._games.get(game_key)
+
+    def get_game_history(self, game_key):
+        with self._lock:
+            return self._games.get(game_key), self._histories.get(game_key)
+
+    def cancel_game(self, game_key):
+        with self._lock:
+            game = self._games.get(game_key)
+            if game is None or game.game_over or game.tournament:
+                return game, False
+            del self._games[game_key]
+            del self._histories[game_key]
+            for user_key in (game.user_x, game.user_o):
+                self._active[user_key].remove(game_key)
+        return game, True
+
+    def update_game(self, game_key, update):
+        with self._lock:
+            game = self._games.get(game_key)
+            if game is None:
+                raise NotFoundError('Game not found!')
+            game = game.copy()
+            history = self._histories[game_key].copy()
+            value, result = update(game, history)
+            if result is not None:
+                self._end_game(game, result)
+            self._games[game_key] = game
+            self._histories[game_key] = history
+        return game, value
+
+    def _end_game(self, game, result):
+        """Ends the game - statistics of players and active games"""
+        game.game_over = True
+        winner, loser = result
+        if winner is None:
+            self._users[game.user_x].draw += 1
+            self._users[game.user_o].draw += 1
+        else:
+            self._users[winner].win += 1
+            self._users[loser].loss += 1
+        for user_key in (game.user_x, game.user_o):
+            self._active[user_key].remove(game.key)
+
+    def active_games(self, user_key, offset=0, limit=None):
+        with self._lock:
+            game_keys = list(self._active.get(user_key, ()))
+        end = len(game_keys) if limit is None else offset + limit
+        return ([self._games[key] for key in game_keys[offset:end]],
+                end < len(game_keys))
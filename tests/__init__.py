@@ -0,0 +1,16 @@
+"""Tests of the application.
+
+The App Engine SDK is found on sys.path or in APPENGINE_SDK. Tests which
+need the SDK are skipped without it.
+
+    APPENGINE_SDK=~/google_appengine python -m pytest tests
+"""
+import os
+
+from tools.sdk import fix_sys_path
+
+try:
+    fix_sys_path(os.environ.get('APPENGINE_SDK'))
+    HAS_SDK = True
+except ImportError:
+    HAS_SDK = False
@@ -0,0 +1,37 @@
+"""base.py - Test case with App Engine service stubs."""
+import unittest
+
+from tests import HAS_SDK
+from tools.sdk import ROOT, RpcCounter
+
+
+@unittest.skipUnless(HAS_SDK, 'App Engine SDK is not found')
+class TestbedCase(unittest.TestCase):
+    """Fresh datastore, memcache and taskqueue stubs for every test, API
+    calls are counted by self.rpcs"""
+    def setUp(self):
+        from google.appengine.datastore import datastore_stub_util
+        from google.appengine.ext import ndb, testbed
+
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        # endpoints reads the revision from the version ID
+        self.testbed.setup_env(current_version_id='test.1', overwrite=True)
+        self.testbed.init_datastore_v3_stub(
+            consistency_policy=datastore_stub_util.
+            PseudoRandomHRConsistencyPolicy(probability=1))
+        self.testbed.init_memcache_stub()
+        self.testbed.init_taskqueue_stub(root_path=ROOT)
+        self.testbed.init_app_identity_stub()
+        ndb.get_context().clear_cache()
+        self.rpcs = RpcCounter()
+        self.rpcs.install()
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def tasks(self, queue_name):
+        """Returns tasks of the queue"""
+        from google.appengine.ext import testbed
+        return self.testbed.get_stub(
+            testbed.TASKQUEUE_SERVICE_NAME).GetTasks(queue_name)
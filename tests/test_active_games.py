@@ -0,0 +1,71 @@
+"""test_active_games.py - Sharded index of active games."""
+from tests.base import TestbedCase
+
+
+class ActiveGamesTest(TestbedCase):
+    def setUp(self):
+        super(ActiveGamesTest, self).setUp()
+        import api
+
+        self.service = api._service
+        for name in ('alice', 'bob', 'carol'):
+            self.service.create_user(name)
+
+    def user_games(self, name):
+        games, more = self.service.repository.active_games(
+            self.service.repository.user_key(name))
+        return set(game.key for game in games)
+
+    def test_games_in_shards(self):
+        from google.appengine.ext import ndb
+        from models import ActiveGames, User
+
+        games = [self.service.new_game('alice', opponent)[0]
+                 for opponent in ('bob', 'carol') * 10]
+        self.assertEqual(self.user_games('alice'),
+                         set(game.key for game in games))
+        shards = [index for index in ndb.get_multi(
+            ActiveGames.keys_for(User.key_for('alice'))) if index]
+        self.assertGreater(len(shards), 1)
+        self.assertEqual(sum(index.count for index in shards), len(games))
+        for index in shards:
+            self.assertEqual(ActiveGames.user_key(index.key),
+                             User.key_for('alice'))
+
+        # The game which is over is removed from its shard only
+        game = games[0]
+        for row, col, name in ((0, 0, 'alice'), (1, 0, 'bob'),
+                               (0, 1, 'alice'), (1, 1, 'bob'),
+                               (0, 2, 'alice')):
+            self.service.make_move(game.key, name, row, col)
+        self.assertEqual(self.user_games('alice'),
+                         set(game.key for game in games[1:]))
+        self.assertEqual(self.user_games('bob'),
+                         set(game.key for game in games[2::2]))
+
+    def test_add_skips_games_which_are_over(self):
+        from google.appengine.ext import ndb
+        from models import ActiveGames, Game, User, add_active_games
+
+        ended = Game.create(User.key_for('alice'), User.key_for('bob'))
+        ended.game_over = True
+        active = Game.create(User.key_for('alice'), User.key_for('carol'))
+        ndb.put_multi([ended, active])
+        # The backfill read both games before the first one ended
+        ended.game_over = False
+        add_active_games([ended, active])
+        self.assertEqual(self.user_games('alice'), set([active.key]))
+        self.assertEqual(self.user_games('bob'), set())
+        self.assertEqual(
+            [index for index in ndb.get_multi(
+                ActiveGames.keys_for(User.key_for('bob'))) if index], [])
+
+    def test_cancel_removes_game(self):
+        from models import GAME_DELETED, get_game_version
+
+        game, _ = self.service.new_game('alice', 'bob')
+        game, deleted = self.service.cancel_game(game.key)
+        self.assertTrue(deleted)
+        self.assertEqual(self.user_games('alice'), set())
+        self.assertEqual(get_game_version(game.key), GAME_DELETED)
+        self.assertIsNone(self.service.repository.get_game(game.key))
@@ -0,0 +1,105 @@
+"""test_archive.py - Retried archive batches and the export of archived
+games."""
+import json
+import os
+import shutil
+import tempfile
+
+from tests.base import TestbedCase
+
+# Moves of X win on the first row
+WIN_MOVES = ((0, 0, 'x'), (1, 0, 'o'), (0, 1, 'x'), (1, 1, 'o'), (0, 2, 'x'))
+
+
+class ArchiveTest(TestbedCase):
+    def setUp(self):
+        super(ArchiveTest, self).setUp()
+        import api
+        import archive
+
+        self.archive = archive
+        self.after_days = archive.ARCHIVE_AFTER_DAYS
+        archive.ARCHIVE_AFTER_DAYS = -1
+        service = api._service
+        service.create_user('alice')
+        service.create_user('bob')
+        self.game_keys = []
+        for _ in range(3):
+            game, _ = service.new_game('alice', 'bob')
+            for row, col, symbol in WIN_MOVES:
+                service.make_move(game.key, 'alice' if symbol == 'x'
+                                  else 'bob', row, col)
+            self.game_keys.append(game.key)
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.archive.ARCHIVE_AFTER_DAYS = self.after_days
+        shutil.rmtree(self.directory)
+        super(ArchiveTest, self).tearDown()
+
+    def archive_failed_delete(self):
+        """Archives the batch and saves its games and histories again as if
+        the delete failed"""
+        from google.appengine.ext import ndb
+        from models import History
+
+        keys = self.game_keys + [History.key_for(key)
+                                 for key in self.game_keys]
+        entities = ndb.get_multi(keys)
+        self.assertEqual(self.archive.archive_games()[0], 3)
+        ndb.put_multi(entities)
+
+    def exported(self):
+        import export
+
+        path = os.path.join(self.directory, 'games.ndjson')
+        export.export_ndjson(path)
+        with open(path) as out:
+            return [json.loads(line)['game'] for line in out]
+
+    def segments(self):
+        from models import ArchiveSegment
+        return ArchiveSegment.query().fetch()
+
+    def test_retry_after_failed_delete(self):
+        self.archive_failed_delete()
+        self.assertEqual(self.archive.archive_games()[0], 3)
+        self.assertEqual(len(self.segments()), 1)
+        for key in self.game_keys:
+            self.assertIsNone(key.get())
+            self.assertTrue(self.archive.get_archived(key)[0].game_over)
+        self.assertEqual(sorted(self.exported()),
+                         sorted(key.urlsafe() for key in self.game_keys))
+
+    def test_retry_after_failed_index(self):
+        from models import ArchivedGame
+
+        self.archive_failed_delete()
+        # One index was not saved
+        ArchivedGame.key_for(self.game_keys[0]).delete()
+        self.archive.archive_games()
+        self.assertEqual(sorted(segment.count
+                                for segment in self.segments()), [1, 3])
+        self.assertTrue(
+            self.archive.get_archived(self.game_keys[0])[0].game_over)
+        # The left over record of the first segment is not exported
+        self.assertEqual(sorted(self.exported()),
+                         sorted(key.urlsafe() for key in self.game_keys))
+
+    def test_export_legacy_history(self):
+        import export
+        from models import History
+
+        game_key = self.game_keys[0]
+        History.key_for(game_key).delete()
+        # The history saved before with JSON moves
+        History(game=game_key,
+                moves=[{'Player': 'alice' if symbol == 'x' else 'bob',
+                        'Move': '%d %d' % (row, col)}
+                       for row, col, symbol in WIN_MOVES]).put()
+        records = [record for records, _ in export.iter_game_batches()
+                   for record in records]
+        record = [record for record in records
+                  if record['game'] == game_key.urlsafe()][0]
+        self.assertEqual(record['moves'], [0, 3, 1, 4, 2])
+        self.assertEqual(record['result'], 'x')
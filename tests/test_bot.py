@@ -0,0 +1,80 @@
+"""test_bot.py - Moves of the computer player."""
+import unittest
+
+from bot import canonical, choose_move
+from engine import Board
+
+
+def play(board, row, col):
+    """Makes the move of the player whose move it is
+    Returns: 'x' or 'o' if the move wins, 'draw' if the board is full, or
+        None if the game goes on"""
+    symbol = board.next_symbol()
+    board.play(symbol, row, col)
+    if board.is_winner(symbol, row, col):
+        return symbol
+    if board.is_full():
+        return 'draw'
+    return None
+
+
+def copy(board):
+    return Board(board.size, board.length, board.bits['x'], board.bits['o'])
+
+
+class PerfectPlayTest(unittest.TestCase):
+    def worst_result(self, board, bot_symbol):
+        """Plays every move of the opponent against the bot
+        Returns: set of results of all games"""
+        if board.next_symbol() == bot_symbol:
+            result = play(board, *choose_move(board))
+            return set([result]) if result else self.worst_result(
+                board, bot_symbol)
+        results = set()
+        for cell in range(board.size * board.size):
+            row, col = divmod(cell, board.size)
+            if not board.is_free(row, col):
+                continue
+            child = copy(board)
+            result = play(child, row, col)
+            results |= (set([result]) if result else
+                        self.worst_result(child, bot_symbol))
+        return results
+
+    def test_bot_against_bot_is_draw(self):
+        board = Board(3)
+        result = None
+        while result is None:
+            result = play(board, *choose_move(board))
+        self.assertEqual(result, 'draw')
+
+    def test_never_loses(self):
+        self.assertNotIn('o', self.worst_result(Board(3), 'x'))
+        self.assertNotIn('x', self.worst_result(Board(3), 'o'))
+
+    def test_takes_the_win(self):
+        # O could block, but X wins on the first row at once
+        board = Board.from_field('xx oo    ')
+        self.assertEqual(choose_move(board), (0, 2))
+
+    def test_blocks_the_line(self):
+        board = Board.from_field('o     xx ')
+        self.assertEqual(board.next_symbol(), 'o')
+        self.assertEqual(choose_move(board), (2, 2))
+
+    def test_search_on_larger_board(self):
+        # X has three of four in a row, O must block the last cell
+        board = Board.from_field('xxx ' 'oo  ' '    ' '    ')
+        self.assertEqual(choose_move(board), (0, 3))
+        board = Board.from_field('ooo ' 'xx  ' 'x   ' '    ')
+        self.assertEqual(choose_move(board), (0, 3))
+
+
+class CanonicalTest(unittest.TestCase):
+    def test_symmetric_positions(self):
+        # X in any corner is the same position
+        corners = [Board.from_field(field).bits['x']
+                   for field in ('x        ', '  x      ', '      x  ',
+                                 '        x')]
+        positions = set(canonical(0, x, 3)[0] for x in corners)
+        self.assertEqual(len(positions), 1)
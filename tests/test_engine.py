@@ -0,0 +1,135 @@
+"""test_engine.py - Moves and win detection of the bitboard engine."""
+import unittest
+
+from engine import Board, SparseBoard, win_masks
+
+
+class BoardTest(unittest.TestCase):
+    def play(self, board, moves):
+        """Plays moves in turn, 'x' first
+        Returns: True if the last move wins"""
+        for row, col in moves:
+            symbol = board.next_symbol()
+            board.play(symbol, row, col)
+        return board.is_winner(symbol, row, col)
+
+    def test_field_round_trip(self):
+        field = 'xo x o  x'
+        board = Board.from_field(field)
+        self.assertEqual(board.size, 3)
+        self.assertEqual(board.to_field(), field)
+        self.assertEqual(board.moves, 5)
+        self.assertEqual(board.next_symbol(), 'o')
+        self.assertFalse(board.is_free(0, 0))
+        self.assertTrue(board.is_free(0, 2))
+
+    def test_not_square_field(self):
+        self.assertRaises(ValueError, Board.from_field, 'xo x o')
+
+    def test_cell_out_of_grid(self):
+        board = Board(3)
+        self.assertRaises(ValueError, board.play, 'x', 3, 0)
+        self.assertRaises(ValueError, board.is_free, 0, -1)
+
+    def test_row_column_and_diagonals(self):
+        self.assertTrue(self.play(Board(3), [(1, 0), (0, 0), (1, 1), (0, 1),
+                                             (1, 2)]))
+        self.assertTrue(self.play(Board(3), [(0, 2), (0, 0), (1, 2), (0, 1),
+                                             (2, 2)]))
+        self.assertTrue(self.play(Board(3), [(0, 0), (0, 1), (1, 1), (0, 2),
+                                             (2, 2)]))
+        self.assertTrue(self.play(Board(3), [(0, 0), (0, 2), (1, 0), (1, 1),
+                                             (0, 1), (2, 0)]))
+
+    def test_no_winner(self):
+        board = Board(3)
+        self.assertFalse(self.play(board, [(0, 0), (1, 1), (0, 1), (0, 2),
+                                           (2, 0), (1, 0), (1, 2), (2, 1),
+                                           (2, 2)]))
+        self.assertTrue(board.is_full())
+
+    def test_line_through_other_cell(self):
+        # The line is full but the latest move is not in it
+        board = Board.from_field('xxxoo o  ')
+        self.assertTrue(board.is_winner('x', 0, 1))
+        self.assertFalse(board.is_winner('o', 1, 1))
+        self.assertFalse(board.is_winner('o', 2, 0))
+
+    def test_length_in_a_row(self):
+        board = Board(5, 4)
+        self.assertFalse(self.play(board, [(4, 0), (0, 0), (3, 1), (0, 1),
+                                           (2, 2)]))
+        self.assertTrue(self.play(board, [(0, 2), (1, 3)]))
+        self.assertFalse(Board(5).is_winner('x', 0, 0))
+
+    def test_win_masks(self):
+        # 3 rows, 3 columns and 2 diagonals
+        self.assertEqual(len(win_masks(3, 3)), 8)
+        # 2 lines of 4 in every row and column, 4 on the diagonals
+        self.assertEqual(len(win_masks(5, 4)), 2 * 5 * 2 + 2 * 4)
+
+
+
+class SparseBoardTest(unittest.TestCase):
+    def play(self, board, moves):
+        """Plays moves in turn, 'x' first
+        Returns: True if the last move wins"""
+        for row, col in moves:
+            symbol = board.next_symbol()
+            board.play(symbol, row, col)
+        return board.is_winner(symbol, row, col)
+
+    def test_five_in_a_row(self):
+        board = SparseBoard(15)
+        self.assertEqual(board.length, 5)
+        moves = []
+        for step in range(4):
+            moves += [(7, 3 + step), (0, step)]
+        self.assertFalse(self.play(board, moves))
+        # The last mark fills the gap in the middle of the line
+        self.assertFalse(self.play(SparseBoard(15), [(7, 3), (0, 0), (7, 4),
+                                                     (0, 1), (7, 6), (0, 2),
+                                                     (7, 7)]))
+        self.assertTrue(self.play(board, [(7, 7)]))
+
+    def test_diagonals_at_the_edge(self):
+        moves = []
+        for step in range(5):
+            moves += [(14 - step, step), (0, 5 + step)]
+        self.assertTrue(self.play(SparseBoard(15), moves[:-1]))
+        moves = []
+        for step in range(5):
+            moves += [(10 + step, 10 + step), (0, step)]
+        self.assertTrue(self.play(SparseBoard(15), moves[:-1]))
+
+    def test_line_of_other_player(self):
+        # X has four in the first row and O four in the second one
+        board = SparseBoard(15, cells=[0, 15, 1, 16, 2, 17, 3, 18])
+        self.assertEqual(board.next_symbol(), 'x')
+        board.play('x', 1, 4)
+        self.assertFalse(board.is_winner('x', 1, 4))
+        board.play('o', 0, 4)
+        self.assertFalse(board.is_winner('o', 0, 4))
+        board.play('x', 0, 5)
+        self.assertFalse(board.is_winner('x', 0, 5))
+
+    def test_packed_round_trip(self):
+        board = SparseBoard(19, cells=[360, 0, 180])
+        copy = SparseBoard.from_packed(19, 5, board.to_packed())
+        self.assertEqual(copy.order, [360, 0, 180])
+        self.assertEqual(copy.marks, board.marks)
+        self.assertFalse(copy.is_free(0, 0))
+        self.assertRaises(ValueError, copy.play, 'o', 19, 0)
+
+    def test_same_result_as_board(self):
+        # Both boards find the same winners on the small grid
+        for cells in ([0, 3, 1, 4, 2], [0, 1, 4, 2, 8], [4, 0, 2, 8, 6],
+                      [0, 4, 8, 2, 6, 3, 5, 1, 7]):
+            sparse = SparseBoard(3, 3, cells)
+            board = Board(3)
+            for index, cell in enumerate(cells):
+                board.play('xo'[index % 2], *divmod(cell, 3))
+            row, col = divmod(cells[-1], 3)
+            symbol = 'xo'[(len(cells) - 1) % 2]
+            self.assertEqual(sparse.is_winner(symbol, row, col),
+                             board.is_winner(symbol, row, col))
@@ -0,0 +1,65 @@
+"""test_evaluator.py - Batch evaluation against the reference check."""
+import unittest
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from benchmarks.batch_evaluator import check_winner, random_games
+
+
+class ReferenceTest(unittest.TestCase):
+    def test_engine(self):
+        from engine import Board
+
+        for size in (3, 4, 5):
+            for field, symbol, row, col in random_games(2000, size):
+                self.assertEqual(
+                    Board.from_field(field).is_winner(symbol, row, col),
+                    check_winner(field, symbol, row, col))
+
+
+@unittest.skipUnless(numpy, 'NumPy is not installed')
+class EvaluatorTest(unittest.TestCase):
+    def test_check_winners(self):
+        import evaluator
+
+        for size in (3, 4, 5):
+            games = random_games(2000, size, seed=size)
+            boards = evaluator.load_fields(field for field, _, _, _ in games)
+            result = evaluator.check_winners(
+                boards,
+                [evaluator.X if symbol == 'x' else evaluator.O
+                 for _, symbol, _, _ in games],
+                [row for _, _, row, _ in games],
+                [col for _, _, _, col in games])
+            self.assertEqual(list(result),
+                             [check_winner(*game) for game in games])
+            # Some games of every size are won
+            self.assertTrue(result.any())
+
+    def test_evaluate(self):
+        import evaluator
+
+        games = random_games(2000, 3)
+        fields = [field for field, _, _, _ in games]
+        result = evaluator.evaluate(evaluator.load_fields(fields))
+        for index, field in enumerate(fields):
+            winners = set(field[cell] for cell in range(9)
+                          if field[cell] != ' ' and
+                          check_winner(field, field[cell], *divmod(cell, 3)))
+            winner = {'x': evaluator.X, 'o': evaluator.O}.get(
+                winners.pop() if winners else None, evaluator.EMPTY)
+            self.assertEqual(result['winner'][index], winner)
+            self.assertEqual(result['draw'][index],
+                             ' ' not in field and winner == evaluator.EMPTY)
+            self.assertEqual(result['turn'][index],
+                             evaluator.X if field.count('x') ==
+                             field.count('o') else evaluator.O)
+
+    def test_not_square_field(self):
+        import evaluator
+
+        boards = evaluator.load_fields(['xo x o', 'xo  o '])
+        self.assertRaises(ValueError, evaluator.evaluate, boards)
@@ -0,0 +1,72 @@
+"""test_leaderboard.py - Write-through of the leaderboard snapshot."""
+from tests.base import TestbedCase
+
+
+class LeaderboardTest(TestbedCase):
+    def setUp(self):
+        super(LeaderboardTest, self).setUp()
+        from google.appengine.ext import ndb
+        import leaderboard
+        from models import User
+
+        self.leaderboard = leaderboard
+        self.users = [User(key=User.key_for('player%d' % index),
+                           name='player%d' % index, rate=1000 - index)
+                      for index in range(leaderboard.LEADERBOARD_SIZE + 10)]
+        ndb.put_multi(self.users)
+        leaderboard.rebuild()
+
+    def change(self, user, rate):
+        user.rate = rate
+        user.put()
+        self.leaderboard.update([user])
+
+    def test_user_drops_out(self):
+        self.change(self.users[0], 0)
+        rows, next_cursor = self.leaderboard.get_page(
+            0, self.leaderboard.LEADERBOARD_SIZE)
+        self.assertEqual(len(rows), self.leaderboard.LEADERBOARD_SIZE)
+        self.assertEqual(rows[0], ('player1', 999, 1))
+        # The next user is taken from the datastore
+        self.assertEqual(rows[-1][0],
+                         'player%d' % self.leaderboard.LEADERBOARD_SIZE)
+        self.assertNotIn('player0', [row[0] for row in rows])
+
+    def test_user_moves_up(self):
+        last = self.users[-1]
+        self.rpcs.reset()
+        self.change(last, 2000)
+        rows, complete = self.leaderboard.get_leaderboard()
+        self.assertFalse(complete)
+        self.assertEqual(len(rows), self.leaderboard.LEADERBOARD_SIZE)
+        self.assertEqual(rows[0], (last.name, 2000, 1))
+        # The write-through needs no query
+        self.assertEqual(self.rpcs.datastore('RunQuery'), 0)
+
+    def test_all_users(self):
+        from google.appengine.ext import ndb
+
+        ndb.delete_multi([user.key for user in self.users[20:]])
+        self.leaderboard.rebuild()
+        self.change(self.users[0], 0)
+        rows, complete = self.leaderboard.get_leaderboard()
+        self.assertTrue(complete)
+        self.assertEqual(len(rows), 20)
+        self.assertEqual(rows[-1], ('player0', 0, 20))
+
+    def test_unranked_users(self):
+        from models import User
+
+        User(key=User.key_for('newcomer'), name='newcomer', rate=5000,
+             ranked=False).put()
+        rows, complete = self.leaderboard.rebuild()
+        self.assertNotIn('newcomer', [row[0] for row in rows])
+        self.assertEqual(rows[0], ('player0', 1000, 1))
+        self.assertEqual(len(rows), self.leaderboard.LEADERBOARD_SIZE)
+
+    def test_negative_offset(self):
+        import endpoints
+
+        self.assertEqual(self.leaderboard.get_offset('top:5'), 5)
+        self.assertRaises(endpoints.BadRequestException,
+                          self.leaderboard.get_offset, 'top:-5')
@@ -0,0 +1,74 @@
+"""test_make_move.py - Datastore calls of make_move."""
+from tests.base import TestbedCase
+
+# Moves of X win on the first row
+WIN_MOVES = ((0, 0, 'x'), (1, 0, 'o'), (0, 1, 'x'), (1, 1, 'o'), (0, 2, 'x'))
+
+
+class MakeMoveTest(TestbedCase):
+    def setUp(self):
+        super(MakeMoveTest, self).setUp()
+        import api
+
+        self.api = api.tictactoegame()
+        self.request = api.MAKE_MOVE_REQUEST.combined_message_class
+        api._service.create_user('alice')
+        api._service.create_user('bob')
+        self.game = self.api.new_game(
+            api.NEW_GAME_REQUEST.combined_message_class(
+                user_name_x='alice', user_name_o='bob'))
+
+    def move(self, row, col, symbol):
+        """Makes the move with counted calls and the empty context cache"""
+        from google.appengine.ext import ndb
+
+        ndb.get_context().clear_cache()
+        self.rpcs.reset()
+        return self.api.make_move(self.request(
+            urlsafe_game_key=self.game.urlsafe_key, row=row, col=col,
+            user='alice' if symbol == 'x' else 'bob'))
+
+    def test_move(self):
+        # The first move reads names of the players into the name cache
+        self.move(*WIN_MOVES[0])
+        form = self.move(*WIN_MOVES[1])
+        self.assertFalse(form.game_over)
+        # The game and its history are read and saved together
+        self.assertEqual(self.rpcs.datastore('Get'), 1)
+        self.assertEqual(self.rpcs.datastore('Put'), 1)
+        self.assertEqual(self.rpcs.datastore('RunQuery', 'Next'), 0)
+
+    def test_game_over(self):
+        for move in WIN_MOVES[:-1]:
+            self.move(*move)
+        rates_tasks = len(self.tasks('rates'))
+        form = self.move(*WIN_MOVES[-1])
+        self.assertTrue(form.game_over)
+        self.assertIn('Winner-alice', form.message)
+        # Both users are read and saved with the game and its history
+        self.assertLessEqual(self.rpcs.datastore('Get'), 3)
+        self.assertEqual(self.rpcs.datastore('Put'), 1)
+        self.assertEqual(self.rpcs.datastore('RunQuery', 'Next'), 0)
+        # Rates of both users are marked dirty in the same transaction
+        self.assertEqual(len(self.tasks('rates')), rates_tasks + 1)
+
+    def test_batch_ends_games(self):
+        import api
+        from models import BOOK_QUEUE, GameMoveForm, GameMoveForms
+
+        other = self.api.new_game(
+            api.NEW_GAME_REQUEST.combined_message_class(
+                user_name_x='alice', user_name_o='bob'))
+        rates_tasks = len(self.tasks('rates'))
+        moves = [GameMoveForm(urlsafe_game_key=game.urlsafe_key, row=row,
+                              col=col,
+                              user='alice' if symbol == 'x' else 'bob')
+                 for row, col, symbol in WIN_MOVES
+                 for game in (self.game, other)]
+        results = self.api.make_moves(GameMoveForms(moves=moves)).items
+        self.assertEqual([result.error for result in results],
+                         [None] * len(moves))
+        self.assertTrue(all(result.game_over for result in results[-2:]))
+        # Tasks of every game are added with its own transaction
+        self.assertEqual(len(self.tasks('rates')), rates_tasks + 2)
+        self.assertEqual(len(self.tasks(BOOK_QUEUE)), 2)
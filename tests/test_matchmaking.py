@@ -0,0 +1,63 @@
+"""test_matchmaking.py - Match requests and pools of the queue."""
+import time
+
+from tests.base import TestbedCase
+
+
+class MatchmakingTest(TestbedCase):
+    def setUp(self):
+        super(MatchmakingTest, self).setUp()
+        import api
+        import matchmaking
+        from models import MatchRequest, get_user
+
+        self.matchmaking = matchmaking
+        self.MatchRequest = MatchRequest
+        for name in ('alice', 'bob'):
+            api._service.create_user(name)
+        self.alice = get_user('alice')
+        self.bob = get_user('bob')
+
+    def test_join_keeps_matched_game(self):
+        from google.appengine.api import memcache
+
+        self.assertFalse(self.matchmaking.join(self.alice)['game'])
+        game = self.matchmaking.join(self.bob)['game']
+        self.assertTrue(game)
+        # The ticket of alice is lost, joining again returns the game
+        memcache.flush_all()
+        ticket = self.matchmaking.join(self.alice)
+        self.assertEqual(ticket['game'], game)
+        self.assertEqual(self.MatchRequest.query().count(), 0)
+
+    def test_matched_requests_are_deleted(self):
+        self.matchmaking.join(self.alice)
+        self.matchmaking.join(self.bob)
+        self.assertEqual(self.MatchRequest.query().count(), 1)
+        self.assertTrue(self.matchmaking.poll('alice')['game'])
+        self.assertEqual(self.MatchRequest.query().count(), 0)
+        # The delivered ticket is returned again from memcache
+        self.rpcs.reset()
+        self.assertTrue(self.matchmaking.poll('alice')['game'])
+        self.assertEqual(self.rpcs.datastore('Get', 'Delete'), 0)
+
+    def test_old_requests_are_cleaned(self):
+        self.matchmaking.join(self.alice)
+        request = self.MatchRequest.key_for('alice').get()
+        request.joined = time.time() - self.matchmaking.MATCH_TIME - 1
+        request.put()
+        self.assertEqual(self.matchmaking.clean_requests(), (1, None))
+        self.assertIsNone(self.MatchRequest.key_for('alice').get())
+
+    def test_poll_reads_pools_at_once(self):
+        ticket = self.matchmaking.join(self.alice)
+        ticket['joined'] -= (self.matchmaking.MATCH_MAX_WIDEN *
+                             self.matchmaking.MATCH_WIDEN_SECONDS)
+        self.matchmaking.memcache.set(
+            self.matchmaking.MEMCACHE_TICKET % 'alice', ticket)
+        self.rpcs.reset()
+        self.assertFalse(self.matchmaking.poll('alice')['game'])
+        memcache_calls = sum(count for (service, _), count
+                             in self.rpcs.calls.items()
+                             if service == 'memcache')
+        self.assertLessEqual(memcache_calls, 6)
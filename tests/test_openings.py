@@ -0,0 +1,50 @@
+"""test_openings.py - Positions and moves of the opening book."""
+from tests.base import TestbedCase
+
+
+class OpeningBookTest(TestbedCase):
+    def setUp(self):
+        super(OpeningBookTest, self).setUp()
+        import api
+
+        self.service = api._service
+        self.service.create_user('alice')
+        self.service.create_user('bob')
+
+    def play(self, moves, size=None):
+        game, _ = self.service.new_game('alice', 'bob', size=size)
+        for index, (row, col) in enumerate(moves):
+            game, msg, _ = self.service.make_move(
+                game.key, 'bob' if index % 2 else 'alice', row, col)
+        self.assertTrue(game.game_over)
+
+    def test_symmetric_moves(self):
+        import openings
+
+        # O answers the center in opposite corners - the same move
+        self.play([(1, 1), (0, 0), (0, 1), (0, 2), (2, 1)])
+        self.play([(1, 1), (2, 2), (1, 2), (0, 2), (1, 0)])
+        self.assertEqual(openings.refresh_book()[0], 2)
+        position = openings.get_position(' ' * 4 + 'x' + ' ' * 4)
+        self.assertEqual(position['symbol'], 'o')
+        self.assertEqual(position['losses'], 2)
+        self.assertIn(position['best_move'], [(0, 0), (0, 2), (2, 0),
+                                              (2, 2)])
+        self.assertEqual(position['best_losses'], 2)
+
+    def test_replay_of_symmetric_position(self):
+        import openings
+
+        moves = [dict(openings.replay(3, 3, 'x', [4, cell]))
+                 for cell in (0, 2, 6, 8)]
+        center = openings.position_id(3, 3, 1 << 4, 0)[0]
+        self.assertEqual(len(set(move[center] for move in moves)), 1)
+
+    def test_large_boards_are_not_in_the_book(self):
+        import openings
+        from service import BadRequestError
+
+        self.play([(7, col + offset) for col in range(5)
+                   for offset in (0, 7)][:-1], size=15)
+        self.assertEqual(self.tasks('book'), [])
+        self.assertRaises(BadRequestError, openings.get_position, ' ' * 25)
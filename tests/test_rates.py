@@ -0,0 +1,66 @@
+"""test_rates.py - Rate buckets moved with the saved rates."""
+from tests.base import TestbedCase
+
+
+class RefreshRatesTest(TestbedCase):
+    def setUp(self):
+        super(RefreshRatesTest, self).setUp()
+        from google.appengine.ext import ndb
+        import models
+
+        self.models = models
+        self.users = [models.User(key=models.User.key_for(name), name=name,
+                                  win=win, draw=draw, ranked=False)
+                      for name, win, draw in [('alice', 1, 0),
+                                              ('bob', 1, 0),
+                                              ('carol', 0, 1)]]
+        self.keys = ndb.put_multi(self.users)
+
+    def counts(self):
+        return dict((bucket.rate, bucket.count)
+                    for bucket in self.models.RateBucket.query())
+
+    def refresh_failing_once(self):
+        """Fails the first bucket move, the rerun finishes the refresh"""
+        move = self.models._move_rate_bucket
+
+        def fail(rate, user_keys):
+            self.models._move_rate_bucket = move
+            raise RuntimeError('bucket move failed')
+
+        self.models._move_rate_bucket = fail
+        try:
+            self.assertRaises(RuntimeError, self.models.refresh_rates,
+                              self.keys)
+        finally:
+            self.models._move_rate_bucket = move
+        self.models.refresh_rates(self.keys)
+
+    def test_failed_refresh_is_finished(self):
+        self.refresh_failing_once()
+        self.assertEqual(self.counts(), {2: 2, 1: 1})
+        alice = self.keys[0].get()
+        alice.win = 0
+        alice.put()
+        self.refresh_failing_once()
+        self.assertEqual(self.counts(), {2: 1, 1: 1, 0: 1})
+        self.assertFalse(any(user.moving()
+                             for user in self.models.ndb.get_multi(self.keys)))
+        self.assertEqual(self.models.get_rank(0), 3)
+
+    def test_rerun_does_not_count_twice(self):
+        self.models.refresh_rates(self.keys)
+        self.models.refresh_rates(self.keys)
+        self.assertEqual(self.counts(), {2: 2, 1: 1})
+
+    def test_user_rate_ranks_saved_rate(self):
+        import api
+
+        self.models.refresh_rates(self.keys)
+        carol = self.keys[2].get()
+        carol.win = 5
+        carol.put()
+        form = api.tictactoegame().get_user_rate(
+            api.USER_REQUEST.combined_message_class(user_name='carol'))
+        # The buckets still count the saved rate 1
+        self.assertEqual((form.rate, form.rank, form.live_rate), (1, 3, 11))
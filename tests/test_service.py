@@ -0,0 +1,116 @@
+"""test_service.py - Game rules and errors of GameService."""
+import unittest
+
+import bot
+from service import (BadRequestError, ConflictError, ForbiddenError,
+                     GameService, NotFoundError)
+from storage import MemoryRepository
+
+
+class GameServiceTest(unittest.TestCase):
+    def setUp(self):
+        self.repository = MemoryRepository()
+        self.service = GameService(self.repository)
+        self.service.create_user('alice')
+        self.service.create_user('bob')
+        self.game, _ = self.service.new_game('alice', 'bob')
+
+    def move(self, name, row, col):
+        return self.service.make_move(self.game.key, name, row, col)[:2]
+
+    def test_duplicate_user(self):
+        self.assertRaises(ConflictError, self.service.create_user, 'alice')
+        self.assertRaises(ConflictError, self.service.create_user,
+                          bot.BOT_NAME)
+
+    def test_new_game_errors(self):
+        self.assertRaises(NotFoundError, self.service.new_game, 'alice',
+                          'carol')
+        self.assertRaises(BadRequestError, self.service.new_game, 'alice',
+                          'alice')
+        self.assertRaises(BadRequestError, self.service.new_game, 'alice',
+                          'bob', size=20)
+        self.assertRaises(BadRequestError, self.service.new_game, 'alice',
+                          'bob', size=15, length=2)
+        self.assertRaises(BadRequestError, self.service.new_game, 'alice',
+                          bot.BOT_NAME, size=15)
+
+    def test_game_not_found(self):
+        self.assertRaises(NotFoundError, self.service.get_game, 0)
+        self.assertRaises(NotFoundError, self.service.make_move, 0, 'alice',
+                          0, 0)
+
+    def test_illegal_moves(self):
+        self.assertRaises(BadRequestError, self.move, 'alice', 3, 0)
+        self.assertRaises(ForbiddenError, self.move, 'bob', 0, 0)
+        self.service.create_user('carol')
+        self.assertRaises(ForbiddenError, self.move, 'carol', 0, 0)
+        self.assertRaises(ForbiddenError, self.move, bot.BOT_NAME, 0, 0)
+        self.move('alice', 0, 0)
+        self.assertRaises(ForbiddenError, self.move, 'bob', 0, 0)
+        self.assertRaises(ForbiddenError, self.move, 'alice', 1, 1)
+        # Failed moves change nothing
+        self.assertEqual(self.repository.get_game(self.game.key).moves_made(),
+                         1)
+
+    def test_win(self):
+        for name, row, col in (('alice', 0, 0), ('bob', 1, 0),
+                               ('alice', 0, 1), ('bob', 1, 1)):
+            game, msg = self.move(name, row, col)
+            self.assertFalse(game.game_over)
+        game, msg = self.move('alice', 0, 2)
+        self.assertTrue(game.game_over)
+        self.assertEqual(msg, 'Game is over! Winner-alice')
+        self.assertEqual(self.repository.get_user('alice').win, 1)
+        self.assertEqual(self.repository.get_user('bob').loss, 1)
+        self.assertEqual(self.repository.active_games('alice'), ([], False))
+        self.assertRaises(ForbiddenError, self.move, 'bob', 2, 2)
+        self.assertEqual(self.repository.get_user('bob').loss, 1)
+
+    def test_draw(self):
+        for name, row, col in (('alice', 0, 0), ('bob', 1, 1),
+                               ('alice', 0, 1), ('bob', 0, 2),
+                               ('alice', 2, 0), ('bob', 1, 0),
+                               ('alice', 1, 2), ('bob', 2, 1),
+                               ('alice', 2, 2)):
+            game, msg = self.move(name, row, col)
+        self.assertTrue(game.game_over)
+        self.assertEqual(msg, 'Game is over! Draw game!')
+        self.assertEqual(self.repository.get_user('alice').draw, 1)
+        self.assertEqual(self.repository.get_user('bob').draw, 1)
+
+    def test_active_games(self):
+        self.service.new_game('bob', 'alice')
+        games, more = self.service.get_user_games('alice', limit=1)
+        self.assertEqual((len(games), more), (1, True))
+        self.assertRaises(NotFoundError, self.service.get_user_games, 'carol')
+        self.service.create_user('carol')
+        self.assertRaises(NotFoundError, self.service.get_user_games, 'carol')
+
+    def test_bot_answers(self):
+        game, _ = self.service.new_game('alice', bot.BOT_NAME)
+        game, msg, _ = self.service.make_move(game.key, 'alice', 1, 1)
+        self.assertEqual(game.moves_made(), 2)
+        game, _ = self.service.new_game(bot.BOT_NAME, 'alice')
+        self.assertEqual(game.moves_made(), 1)
+
+    def test_cancel_game(self):
+        self.move('alice', 0, 0)
+        game, history = self.service.get_game_history(self.game.key)
+        self.assertEqual(history.moves, [('x', 0)])
+        game, deleted = self.service.cancel_game(self.game.key)
+        self.assertTrue(deleted)
+        self.assertRaises(NotFoundError, self.service.get_game_history,
+                          self.game.key)
+        self.assertRaises(NotFoundError, self.service.cancel_game,
+                          self.game.key)
+        self.assertEqual(self.repository.active_games('alice'), ([], False))
+
+    def test_finished_game_is_kept(self):
+        for name, row, col in (('alice', 0, 0), ('bob', 1, 0),
+                               ('alice', 0, 1), ('bob', 1, 1),
+                               ('alice', 0, 2)):
+            self.move(name, row, col)
+        game, deleted = self.service.cancel_game(self.game.key)
+        self.assertFalse(deleted)
+        self.assertTrue(self.service.get_game(self.game.key).game_over)
@@ -0,0 +1,39 @@
+"""test_users.py - Users keyed by name and users saved before."""
+from tests.base import TestbedCase
+
+
+class LegacyUserTest(TestbedCase):
+    def setUp(self):
+        super(LegacyUserTest, self).setUp()
+        import models
+
+        self.models = models
+        models._finished_migrations.clear()
+        # The user saved with a numeric ID before users were keyed by name
+        self.legacy = models.User(name='alice', email='alice@example.com')
+        self.legacy.put()
+
+    def tearDown(self):
+        self.models._finished_migrations.clear()
+        super(LegacyUserTest, self).tearDown()
+
+    def test_before_migration(self):
+        self.assertEqual(self.models.get_user('alice').key, self.legacy.key)
+        self.assertIsNone(self.models.insert_user('alice'))
+        self.assertIsNone(self.models.get_user('bob'))
+        self.assertEqual(self.models.insert_user('bob').key,
+                         self.models.User.key_for('bob'))
+
+    def test_after_migration(self):
+        cursor = self.models.migrate_user_names()
+        while cursor:
+            cursor = self.models.migrate_user_names(cursor)
+        self.assertTrue(
+            self.models.is_migrated_async(
+                self.models.USER_NAMES_MIGRATION).get_result())
+        self.rpcs.reset()
+        self.assertEqual(self.models.get_user('alice').key, self.legacy.key)
+        self.assertIsNone(self.models.insert_user('alice'))
+        self.assertIsNone(self.models.get_user('bob'))
+        # Lookups are gets by key only
+        self.assertEqual(self.rpcs.datastore('RunQuery'), 0)
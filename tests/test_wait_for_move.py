@@ -0,0 +1,71 @@
+"""test_wait_for_move.py - Long-poll of game versions."""
+from tests.base import TestbedCase
+
+# Moves of X win on the first row
+WIN_MOVES = ((0, 0, 'x'), (1, 0, 'o'), (0, 1, 'x'), (1, 1, 'o'), (0, 2, 'x'))
+
+
+class WaitForMoveTest(TestbedCase):
+    def setUp(self):
+        super(WaitForMoveTest, self).setUp()
+        import api
+
+        self.api_module = api
+        self.wait_seconds = api.WAIT_SECONDS
+        api.WAIT_SECONDS = 0
+        self.api = api.tictactoegame()
+        api._service.create_user('alice')
+        api._service.create_user('bob')
+        self.game = self.api.new_game(
+            api.NEW_GAME_REQUEST.combined_message_class(
+                user_name_x='alice', user_name_o='bob'))
+
+    def tearDown(self):
+        self.api_module.WAIT_SECONDS = self.wait_seconds
+        super(WaitForMoveTest, self).tearDown()
+
+    def move(self, row, col, symbol):
+        self.api.make_move(
+            self.api_module.MAKE_MOVE_REQUEST.combined_message_class(
+                urlsafe_game_key=self.game.urlsafe_key, row=row, col=col,
+                user='alice' if symbol == 'x' else 'bob'))
+
+    def wait(self, move):
+        return self.api.wait_for_move(
+            self.api_module.WAIT_FOR_MOVE_REQUEST.combined_message_class(
+                urlsafe_game_key=self.game.urlsafe_key, move=move))
+
+    def test_no_change(self):
+        self.move(*WIN_MOVES[0])
+        form = self.wait(1)
+        self.assertFalse(form.changed)
+        self.assertEqual(form.move, 1)
+
+    def test_stale_version(self):
+        from google.appengine.api import memcache
+        import models
+
+        self.move(*WIN_MOVES[0])
+        # The version was not saved after the move
+        memcache.set(models.MEMCACHE_GAME_VERSION % self.game.urlsafe_key, 0)
+        form = self.wait(0)
+        self.assertTrue(form.changed)
+        self.assertEqual(form.move, 1)
+        self.assertEqual(self.wait(1).changed, False)
+
+    def test_archived_game(self):
+        import archive
+
+        for move in WIN_MOVES:
+            self.move(*move)
+        after_days = archive.ARCHIVE_AFTER_DAYS
+        archive.ARCHIVE_AFTER_DAYS = -1
+        try:
+            self.assertEqual(archive.archive_games()[0], 1)
+        finally:
+            archive.ARCHIVE_AFTER_DAYS = after_days
+        for move in (len(WIN_MOVES), 0):
+            form = self.wait(move)
+            self.assertEqual(form.changed, move != len(WIN_MOVES))
+            self.assertEqual(form.move, len(WIN_MOVES))
+            self.assertTrue(form.game.game_over)
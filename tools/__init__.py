@@ -0,0 +1 @@
+"""tools - Offline scripts working with the deployed application."""
@@ -0,0 +1,35 @@
+"""export_games.py - Exports all games of the application into NDJSON.
+
+The datastore of the deployed application is read by the remote API (the
+remote_api builtin in app.yaml) with export.export_ndjson. An interrupted
+export is resumed from its checkpoint when the command is run again.
+
+    python -m tools.export_games --sdk ~/google_appengine \\
+        --server tictactoegame-1361.appspot.com --out games.ndjson
+"""
+import argparse
+
+from tools.sdk import fix_sys_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sdk', help='path to the App Engine SDK')
+    parser.add_argument('--server', required=True,
+                        help='host of the application')
+    parser.add_argument('--out', default='games.ndjson')
+    parser.add_argument('--batch-size', type=int, default=500)
+    arguments = parser.parse_args()
+    fix_sys_path(arguments.sdk)
+
+    from google.appengine.ext.remote_api import remote_api_stub
+    remote_api_stub.ConfigureRemoteApiForOAuth(arguments.server,
+                                               '/_ah/remote_api')
+    import export
+
+    count = export.export_ndjson(arguments.out, arguments.batch_size)
+    print('{} games exported to {}'.format(count, arguments.out))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+"""sdk.py - App Engine SDK libraries for scripts run outside the runtime.
+
+Benchmarks, tools and tests import the application modules, which need the
+SDK and its bundled libraries (webapp2, endpoints, protorpc) on sys.path.
+"""
+import collections
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def fix_sys_path(sdk=None):
+    """Adds App Engine SDK libraries and the application to sys.path
+    Args:
+        sdk: path to the SDK, it is found on sys.path if not given
+    Raises:
+        ImportError: If the SDK is not found.
+    """
+    if sdk:
+        sys.path.insert(0, sdk)
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+
+
+class RpcCounter(object):
+    """Counts API calls by (service, method) with an apiproxy pre-call hook.
+    testbed replaces the apiproxy when it is activated, so the counter is
+    installed after the stubs."""
+    def __init__(self):
+        self.calls = collections.Counter()
+
+    def install(self):
+        """Registers the hook in the current apiproxy"""
+        from google.appengine.api import apiproxy_stub_map
+        # Hooks should be functions or methods, apiproxy inspects their
+        # arguments
+        apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+            'rpc_counter', self.count)
+
+    def count(self, service, call, request, response):
+        self.calls[(service, call)] += 1
+
+    def datastore(self, *methods):
+        """Returns the number of datastore calls of the methods"""
+        return sum(self.calls[('datastore_v3', method)]
+                   for method in methods)
+
+    def reset(self):
+        self.calls.clear()
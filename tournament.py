@@ -0,0 +1,277 @@
+"""tournament.py - Scheduling of tournaments.
+
+Games of a round-robin tournament are paired by the circle method and all
+of them are created when the tournament is created. A Swiss round is paired
+by points when all games of the previous round are over. Game IDs of every
+scheduled block are allocated as one range, so a game is created with its
+history by put_multi without a round trip per game. Large blocks are created
+by tasks, TOURNAMENT_BATCH_SIZE games each.
+"""
+import math
+
+import archive
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from models import (
+    User,
+    Game,
+    History,
+    Tournament,
+    TournamentStanding,
+    add_active_games,
+    ROUND_ROBIN,
+    SWISS,
+    RATE_REFRESH_SECONDS,
+)
+from utils import add_named_tasks, add_window_task
+import bot
+
+TOURNAMENT_BATCH_SIZE = 500
+
+
+def round_robin_pairings(count):
+    """Returns rounds of the round-robin tournament by the circle method
+    Args:
+        count: number of players
+    Returns: list of rounds - lists of (x, o) indices of players, the player
+        without a pair in the round has a bye
+    """
+    players = list(range(count))
+    if count % 2:
+        players.append(None)
+    half = len(players) // 2
+    rounds = []
+    for _ in range(len(players) - 1):
+        pairs = []
+        for index in range(half):
+            first, second = players[index], players[-index - 1]
+            if first is None or second is None:
+                continue
+            # Every player plays X in about half of games
+            if (first < second) == bool((first + second) % 2):
+                first, second = second, first
+            pairs.append((first, second))
+        rounds.append(pairs)
+        players.insert(1, players.pop())
+    return rounds
+
+
+def swiss_pairings(standings, round_number):
+    """Pairs players with equal or close points who have not met before
+    Args:
+        standings: TournamentStanding of players in the order of seeding
+        round_number: number of the round to be paired
+    Returns: tuple of the list of (x, o) indices of players and the index of
+        the player with a bye or None
+    """
+    order = sorted(range(len(standings)),
+                   key=lambda index: (-standings[index].points, index))
+    bye = None
+    if len(order) % 2:
+        # The lowest player who has not had a bye
+        bye = next((index for index in reversed(order)
+                    if not standings[index].bye), order[-1])
+        order.remove(bye)
+
+    if round_number == 1:
+        # The top half of seeding plays the bottom half
+        half = len(order) // 2
+        return [(first, second) if index % 2 else (second, first)
+                for index, (first, second) in
+                enumerate(zip(order[:half], order[half:]))], bye
+
+    pairs = []
+    while order:
+        first = order.pop(0)
+        met = set(standings[first].opponents)
+        second = next((index for index in order
+                       if standings[index].user not in met), order[0])
+        order.remove(second)
+        if (round_number + len(pairs)) % 2:
+            first, second = second, first
+        pairs.append((first, second))
+    return pairs, bye
+
+
+def _block(tournament):
+    """Returns (round, x index, o index) of games of the last scheduled
+    block - all games of the round-robin tournament or the Swiss round"""
+    if tournament.format == ROUND_ROBIN:
+        return [(number + 1, x, o) for number, pairs in
+                enumerate(round_robin_pairings(len(tournament.players)))
+                for x, o in pairs]
+    return [(tournament.round, tournament.pairings[index],
+             tournament.pairings[index + 1])
+            for index in range(0, len(tournament.pairings), 2)]
+
+
+def _game_keys(tournament, start, end):
+    first = tournament.first_game_ids[-1]
+    return [ndb.Key(Game, first + index) for index in range(start, end)]
+
+
+def create_games(tournament, start, end):
+    """Creates games of the last scheduled block from start to end and adds
+    them to active games of players. Existing games are not overwritten, so
+    the call can be repeated
+    Args:
+        tournament: the Tournament
+        start, end: indices of games in the block
+    """
+    block = _block(tournament)[start:end]
+    keys = _game_keys(tournament, start, start + len(block))
+    bot_key = User.key_for(bot.BOT_NAME)
+    entities = []
+    active = []
+    for key, game, (number, x, o) in zip(keys, ndb.get_multi(keys), block):
+        if game is not None:
+            if not game.game_over:
+                active.append(game)
+            continue
+        user_x, user_o = tournament.players[x], tournament.players[o]
+        # The computer player makes moves only as O
+        if user_x == bot_key:
+            user_x, user_o = user_o, user_x
+        game = Game.create(user_x, user_o, key=key,
+                           tournament=tournament.key, round=number)
+        active.append(game)
+        entities.extend([game, History(key=History.key_for(key))])
+    ndb.put_multi(entities)
+    add_active_games(active)
+
+
+def schedule_games(tournament):
+    """Creates games of the last scheduled block, large blocks are created
+    by tasks"""
+    count = len(_block(tournament))
+    if count <= TOURNAMENT_BATCH_SIZE:
+        create_games(tournament, 0, count)
+        return
+    add_named_tasks([taskqueue.Task(
+        url='/tasks/tournament_games',
+        name='tournament-%d-%d-%d' % (tournament.key.id(), tournament.round,
+                                      start),
+        params={'tournament': tournament.key.urlsafe(),
+                'round': tournament.round,
+                'start': start})
+        for start in range(0, count, TOURNAMENT_BATCH_SIZE)])
+
+
+def create_tournament(name, players, format, rounds=None):
+    """Creates the tournament with standings of players and schedules its
+    games
+    Args:
+        name: name of the tournament
+        players: keys of users in the order of seeding
+        format: ROUND_ROBIN or SWISS
+        rounds: number of Swiss rounds, enough to find the winner by default
+    Returns: the Tournament
+    Raises:
+        ValueError: If there are less than 2 players or the same player
+            is given twice, or rounds are not possible.
+    """
+    if len(players) < 2 or len(set(players)) != len(players):
+        raise ValueError('Tournament needs at least 2 different players')
+    if format == ROUND_ROBIN:
+        rounds = len(round_robin_pairings(len(players)))
+    elif not rounds:
+        rounds = int(math.ceil(math.log(len(players), 2)))
+    elif not 0 < rounds < len(players):
+        raise ValueError('Swiss tournament can have 1 to %d rounds' %
+                         (len(players) - 1,))
+    key = ndb.Key(Tournament, Tournament.allocate_ids(1)[0])
+    tournament = Tournament(key=key, name=name, format=format,
+                            players=players, rounds=rounds)
+    if format == ROUND_ROBIN:
+        count = sum(len(pairs) for pairs in
+                    round_robin_pairings(len(players)))
+        tournament.round = rounds
+        tournament.first_game_ids = [Game.allocate_ids(count)[0]]
+    ndb.put_multi([tournament] + [
+        TournamentStanding(key=TournamentStanding.key_for(key, user_key),
+                           tournament=key, user=user_key)
+        for user_key in players])
+    if format == ROUND_ROBIN:
+        schedule_games(tournament)
+    else:
+        advance_round(key, 0)
+    return tournament
+
+
+def get_standings(tournament):
+    """Returns TournamentStanding of every player of the tournament"""
+    return ndb.get_multi([TournamentStanding.key_for(tournament.key, key)
+                          for key in tournament.players])
+
+
+def _round_over(tournament):
+    """Returns True if all games of the current round exist and are over,
+    missing games are over if they are archived"""
+    count = len(tournament.pairings) // 2
+    keys = _game_keys(tournament, 0, count)
+    games = ndb.get_multi(keys)
+    if not all(game is None or game.game_over for game in games):
+        return False
+    return all(archive.is_archived([key for key, game in zip(keys, games)
+                                    if game is None]))
+
+
+@ndb.transactional(xg=True)
+def _start_round(tournament_key, finished_round, pairs, bye):
+    """Saves pairings of the next Swiss round and the bye
+    Returns: the Tournament or None if the round is already started"""
+    tournament = tournament_key.get()
+    if tournament.round != finished_round:
+        return None
+    tournament.round += 1
+    tournament.first_game_ids.append(Game.allocate_ids(len(pairs))[0])
+    tournament.pairings = [index for pair in pairs for index in pair]
+    entities = [tournament]
+    if bye is not None:
+        standing = TournamentStanding.key_for(
+            tournament_key, tournament.players[bye]).get()
+        standing.bye += 1
+        entities.append(standing)
+    ndb.put_multi(entities)
+    return tournament
+
+
+def advance_round(tournament_key, finished_round):
+    """Pairs and creates the next Swiss round if the round is over. It can
+    be repeated - the round is started once and its games are created if
+    they are missing.
+    Args:
+        tournament_key: key of the Swiss tournament
+        finished_round: number of the round which should be over
+    """
+    tournament = tournament_key.get()
+    if tournament is None or tournament.format != SWISS:
+        return
+    if tournament.round == finished_round + 1:
+        schedule_games(tournament)
+        return
+    if (tournament.round != finished_round or
+            finished_round >= tournament.rounds or
+            finished_round and not _round_over(tournament)):
+        return
+    pairs, bye = swiss_pairings(get_standings(tournament), finished_round + 1)
+    tournament = _start_round(tournament_key, finished_round, pairs, bye)
+    if tournament is not None:
+        schedule_games(tournament)
+
+
+def games_over(games):
+    """Adds tasks which start the next Swiss round for tournament games which
+    are over - one task per round in RATE_REFRESH_SECONDS
+    Args:
+        games: games which are over
+    """
+    for game in games:
+        if game.tournament is not None:
+            add_window_task('/tasks/tournament_round',
+                            'round-%d-%d' % (game.tournament.id(), game.round),
+                            RATE_REFRESH_SECONDS,
+                            params={'tournament': game.tournament.urlsafe(),
+                                    'round': game.round})
@@ -1,22 +1,28 @@
 """utils.py - File for collecting general utility functions."""
 
+import collections
+import threading
+import time
+from google.appengine.api import datastore_errors, taskqueue
+from google.appengine.datastore.datastore_query import Cursor
 from google.appengine.ext import ndb
 import endpoints
 
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
 
-def get_by_urlsafe(urlsafe, model):
-    """Returns an ndb.Model entity that the urlsafe key points to. Checks
-        that the type of entity returned is of the correct kind. Raises an
-        error if the key String is malformed or the entity is of the incorrect
-        kind
+
+def get_key_by_urlsafe(urlsafe, model):
+    """Returns an ndb.Key that the urlsafe key string points to without
+        fetching the entity. Checks that the key is of the correct kind.
     Args:
         urlsafe: A urlsafe key string
         model: The expected entity kind
     Returns:
-        The entity that the urlsafe Key string points to or None if no entity
-        exists.
+        The Key the urlsafe Key string points to.
     Raises:
-        ValueError:"""
+        endpoints.BadRequestException: If the key String is malformed.
+        ValueError: If the key is of the incorrect kind."""
     try:
         key = ndb.Key(urlsafe=urlsafe)
     except TypeError:
@@ -27,9 +33,168 @@ def get_by_urlsafe(urlsafe, model):
         else:
             raise
 
-    entity = key.get()
+    if key.kind() != model._get_kind():
+        raise ValueError('Incorrect Kind')
+    return key
+
+
+def get_by_urlsafe(urlsafe, model):
+    """Returns an ndb.Model entity that the urlsafe key points to. Checks
+        that the type of entity returned is of the correct kind. Raises an
+        error if the key String is malformed or the entity is of the incorrect
+        kind
+    Args:
+        urlsafe: A urlsafe key string
+        model: The expected entity kind
+    Returns:
+        The entity that the urlsafe Key string points to or None if no entity
+        exists.
+    Raises:
+        ValueError:"""
+    entity = get_key_by_urlsafe(urlsafe, model).get()
     if not entity:
         return None
     if not isinstance(entity, model):
         raise ValueError('Incorrect Kind')
     return entity
+
+
+def get_page_size(page_size):
+    """Returns the requested page size limited by MAX_PAGE_SIZE or
+    DEFAULT_PAGE_SIZE if it is not given"""
+    return min(page_size or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+
+
+def fetch_page(query, page_size, urlsafe_cursor, **options):
+    """Returns one page of the query results
+    Args:
+        query: ndb.Query
+        page_size: number of results, DEFAULT_PAGE_SIZE if not given
+        urlsafe_cursor: A urlsafe cursor string of the page or None for the
+            first page
+        options: query options, e.g. projection
+    Returns:
+        Tuple of the list of results and the urlsafe cursor string of the
+        next page or None if it is the last page.
+    Raises:
+        endpoints.BadRequestException: If the cursor String is malformed."""
+    page_size = get_page_size(page_size)
+    try:
+        cursor = Cursor(urlsafe=urlsafe_cursor) if urlsafe_cursor else None
+    except (datastore_errors.BadValueError, TypeError):
+        raise endpoints.BadRequestException('Invalid Cursor')
+    results, next_cursor, more = query.fetch_page(
+        page_size, start_cursor=cursor, **options)
+    if more and next_cursor:
+        return results, next_cursor.urlsafe()
+    return results, None
+
+
+def get_list_offset(cursor):
+    """Returns the offset of the page of a list from the cursor string,
+    0 for the first page
+    Raises:
+        endpoints.BadRequestException: If the cursor String is malformed."""
+    if not cursor:
+        return 0
+    try:
+        offset = int(cursor)
+    except ValueError:
+        raise endpoints.BadRequestException('Invalid Cursor')
+    if offset < 0:
+        raise endpoints.BadRequestException('Invalid Cursor')
+    return offset
+
+
+def add_named_tasks(tasks, queue_name='default'):
+    """Adds named tasks in batches, the tasks added before - by a failed
+    attempt or for the same window - are skipped
+    Args:
+        tasks: list of taskqueue.Task with names
+        queue_name: name of the push queue
+    """
+    for start in range(0, len(tasks), taskqueue.MAX_TASKS_PER_ADD):
+        batch = tasks[start:start + taskqueue.MAX_TASKS_PER_ADD]
+        try:
+            taskqueue.Queue(queue_name).add(batch)
+        except (taskqueue.TaskAlreadyExistsError,
+                taskqueue.TombstonedTaskError):
+            for task in batch:
+                try:
+                    task.add(queue_name)
+                except (taskqueue.TaskAlreadyExistsError,
+                        taskqueue.TombstonedTaskError):
+                    pass
+
+
+def add_window_task(url, prefix, seconds, params=None):
+    """Adds the task named by the prefix and the current window of seconds,
+    it runs at the end of the window. Only the first task of the window is
+    added, so work of the window is done by one task.
+    Args:
+        url: url of the task handler
+        prefix: name of the task without the window
+        seconds: length of the window
+        params: parameters of the task
+    """
+    now = time.time()
+    window = int(now) // seconds
+    add_named_tasks([taskqueue.Task(url=url, name='%s-%d' % (prefix, window),
+                                    params=params,
+                                    countdown=(window + 1) * seconds - now)])
+
+
+def lease_all(queue_name, lease_seconds, lease_size, leases):
+    """Leases pull tasks of the queue
+    Args:
+        queue_name: name of the pull queue
+        lease_seconds: lease time of tasks
+        lease_size: number of tasks per lease
+        leases: maximum number of leases
+    Returns: tuple of the list of tasks and True if there are more tasks
+    """
+    queue = taskqueue.Queue(queue_name)
+    tasks = []
+    more = False
+    for _ in range(leases):
+        leased = queue.lease_tasks(lease_seconds, lease_size)
+        tasks.extend(leased)
+        more = len(leased) == lease_size
+        if not more:
+            break
+    return tasks, more
+
+
+def delete_leased(queue_name, tasks):
+    """Deletes leased pull tasks of the queue in batches"""
+    queue = taskqueue.Queue(queue_name)
+    for start in range(0, len(tasks), taskqueue.MAX_TASKS_PER_LEASE):
+        queue.delete_tasks(tasks[start:start + taskqueue.MAX_TASKS_PER_LEASE])
+
+
+class LRUCache(object):
+    """Bounded in-process cache - the least recently used item is dropped
+    when the cache is full. It is shared by requests of the instance."""
+    def __init__(self, size):
+        self.size = size
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._items:
+                return default
+            value = self._items.pop(key)
+            self._items[key] = value
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = value
+            if len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._items.pop(key, None)